@@ -6,21 +6,22 @@ Raw Ingestion Zone: Where data is stored in its original format without modifica
 """
 import pandas as pd
 import os
-from utils import upload_dataframe_to_minio, get_minio_client
-from minio import Minio
+from utils import batched_index_updates, upload_dataframe_to_minio, get_minio_client
 
-def get_minio_client():
-    client = Minio(
-        "minio:9000",  # Correcto, coincide con el nombre del servicio en docker-compose.yml
-        access_key="minioadmin",
-        secret_key="minioadmin",
-        secure=False  # No es necesario usar HTTPS en este caso, ya que es HTTP
-    )
-    return client
+# Directorio local con los ficheros fuente (RAW_DATA_DIR permite apuntar a datos sintéticos) y ficheros que se ingieren
+DATA_DIR = os.environ.get('RAW_DATA_DIR', '/data/raw-ingestion-zone')
+SOURCE_FILES = [
+    'trafico-horario.csv',
+    'bicimad-usos.csv',
+    'parkings-rotacion.csv',
+    'ext_aparcamientos_info.csv',
+    'dump-bbdd-municipal.sql',
+    'distritos.geojson'
+]
 
-def main():
+def main(data_dir=None):
     # Save sample data to local CSV files
-    data_dir = '/data/raw-ingestion-zone'
+    data_dir = data_dir or DATA_DIR
     os.makedirs(data_dir, exist_ok=True)
 
     trafico_path = data_dir + "/trafico-horario.csv"
@@ -90,11 +91,24 @@ def main():
                 content_type='application/sql'
             )
 
+    # Subir los límites de los distritos (GeoJSON) si están disponibles
+    distritos_geojson_path = os.path.join(data_dir, "distritos.geojson")
+    if os.path.exists(distritos_geojson_path):
+        with open(distritos_geojson_path, 'rb') as file_data:
+            client = get_minio_client()
+            client.put_object(
+                bucket_name='raw-ingestion-zone',
+                object_name='geo/distritos.geojson',
+                data=file_data,
+                length=os.path.getsize(distritos_geojson_path),
+                content_type='application/geo+json'
+            )
+
     upload_dataframe_to_minio(trafico_df, 'raw-ingestion-zone', 'trafico/trafico-horario.csv', metadata=trafico_metadata)
     upload_dataframe_to_minio(usos_df, 'raw-ingestion-zone', 'bicimad/bicimad-usos.csv', metadata=usos_metadata)
     upload_dataframe_to_minio(aparcamiento_df, 'raw-ingestion-zone', 'aparcamiento/parkings_rotacion.csv', metadata=aparcamiento_metadata)
     upload_dataframe_to_minio(ext_aparcamiento_df, 'raw-ingestion-zone', 'aparcamiento/ext_aparcamientos_info.csv', metadata=ext_aparcamiento_metadata)
-    # Verificar los archivos en el bucket
+    # Verificar los archivos en el bucket (las subidas diferidas pueden no haber terminado aún)
     client = get_minio_client()
     print("\nVerifying uploaded files in raw-ingestion-zone:")
     objects = list(client.list_objects('raw-ingestion-zone', recursive=True))
@@ -106,5 +120,15 @@ def main():
     print("\nData ingestion into raw-ingestion-zone complete!")
     print("Note: The data in this zone is stored in its original format without modifications.")
 
+    # Datos en bruto para la siguiente etapa cuando el pipeline se ejecuta en un solo proceso
+    return {
+        'trafico': trafico_df,
+        'bicimad': usos_df,
+        'parkings': aparcamiento_df,
+        'ext': ext_aparcamiento_df,
+        'municipal_sql_path': dump_sql_path if os.path.exists(dump_sql_path) else None
+    }
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with batched_index_updates():
+        main()
\ No newline at end of file
@@ -5,18 +5,29 @@ y los sube a la process-zone en formato Parquet.
 """
 
 from utils import (
+    batched_index_updates,
     download_dataframe_from_minio,
+    get_minio_client,
     upload_dataframe_to_minio,
-    log_data_transformation
+    log_data_transformation,
+    validate_data_quality
 )
+from metrics import timed
+from storage import put_object_if_match
+from tables import load_pointer, new_snapshot_id
+from minio.error import S3Error
+from datetime import datetime
 import pandas as pd
 import pyarrow.parquet as pq
 import pyarrow as pa
 import sqlite3
 from pathlib import Path
 import re
-from minio import Minio
 import io
+import os
+import json
+import hashlib
+import secrets
 
 # Función para limpiar cadenas
 def clean_text_column(text):
@@ -27,13 +38,56 @@ def clean_text_column(text):
 
 # Procesamiento de datos de tráfico
 def column_clean_traffic(df):
-    df.drop(columns=['sensor_id', 'velocidad_media_kmh'], inplace=True, errors='ignore')
+    # sensor_id se conserva para los agregados por sensor de la access zone
+    df.drop(columns=['velocidad_media_kmh'], inplace=True, errors='ignore')
 
 def date_format_traffic(df):
-    df['hora'] = df['fecha_hora'].apply(lambda x: pd.to_datetime(x, format='%Y-%m-%d %H:%M:%S').time())
+    fecha_hora = pd.to_datetime(df['fecha_hora'], format='%Y-%m-%d %H:%M:%S')
+    df['fecha'] = fecha_hora.dt.date
+    df['hora'] = fecha_hora.dt.time
     df.drop(columns=['fecha_hora'], inplace=True, errors='ignore')
 
 # Procesamiento de datos de BiciMAD
+def date_format_bicimad(df):
+    # Fecha y hora de inicio del viaje, para particionar los agregados de la access zone
+    inicio = pd.to_datetime(df['fecha_hora_inicio'], format='%Y-%m-%d %H:%M:%S')
+    df['fecha'] = inicio.dt.date
+    df['hora'] = inicio.dt.hour
+
+# Secreto de la seudonimización cuando no se pasa PSEUDONYM_KEY (se genera en la primera ejecución)
+PSEUDONYM_KEY_OBJECT = ('govern-zone-security', 'secrets/pseudonym_key.json')
+
+def _stored_pseudonym_secret(client):
+    """Secret kept in ``PSEUDONYM_KEY_OBJECT``, generated and stored on the first run."""
+    bucket, name = PSEUDONYM_KEY_OBJECT
+    while True:
+        try:
+            response = client.get_object(bucket, name)
+            try:
+                return json.loads(response.read().decode('utf-8'))['secret']
+            finally:
+                response.close()
+                response.release_conn()
+        except S3Error as e:
+            if e.code != 'NoSuchKey':
+                raise
+        # Creación condicional: si dos procesos arrancan a la vez, ambos acaban usando el mismo secreto
+        payload = json.dumps({'secret': secrets.token_hex(32), 'created_at': datetime.now().isoformat()}).encode('utf-8')
+        if put_object_if_match(client, bucket, name, payload, 'application/json') is not None:
+            print(f"Generated a new pseudonymization secret in {bucket}/{name}")
+
+def pseudonym_key(client=None):
+    """Hash key derived from ``PSEUDONYM_KEY``, or from the secret stored in the lake if it is not set."""
+    secret = os.environ.get('PSEUDONYM_KEY') or _stored_pseudonym_secret(client or get_minio_client())
+    # Siempre un secreto aleatorio: con una clave conocida los ids (enteros pequeños) se recuperan probando todos
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()[:16]
+
+def pseudonymize_bicimad(df, key=None):
+    # usuario_id se sustituye por un hash con clave (SipHash): permite contar usuarios distintos sin exponer el id
+    key = key or pseudonym_key()
+    hashes = pd.util.hash_pandas_object(df['usuario_id'].astype(str), index=False, hash_key=key)
+    df['usuario_hash'] = hashes.map('{:016x}'.format).where(df['usuario_id'].notna())
+
 def column_clean_bicimad(df):
     df.drop(columns=['usuario_id', 'fecha_hora_inicio', 'fecha_hora_fin'], inplace=True, errors='ignore')
 
@@ -43,6 +97,29 @@ def column_clean_parkings(df):
     df['dia_semana'] = df['fecha'].dt.day_name()
     df.drop(columns=['plazas_libres', 'porcentaje_ocupacion'], inplace=True, errors='ignore')
 
+# Actualizaciones horarias archivadas por parking_stream.py
+STREAM_ARCHIVE = ('raw-ingestion-zone', 'aparcamiento/parkings_stream.parquet')
+PARKING_KEY = ['aparcamiento_id', 'fecha', 'hora']
+
+def fold_streamed_parkings(df):
+    """Add the streamed hours the raw file does not have yet; returns the DataFrame and the rows added.
+
+    The raw file wins for the hours it contains. Among the streamed rows of one hour the
+    last batch received wins.
+    """
+    if load_pointer(*STREAM_ARCHIVE) is None:
+        return df, 0
+    streamed = download_dataframe_from_minio(*STREAM_ARCHIVE, format='parquet')
+    if streamed.empty:
+        return df, 0
+    streamed = streamed.sort_values('lote').drop_duplicates(PARKING_KEY, keep='last').drop(columns=['lote'])
+    streamed = streamed.assign(fecha=pd.to_datetime(streamed['fecha']))
+    known = pd.MultiIndex.from_frame(df[PARKING_KEY])
+    missing = streamed[~pd.MultiIndex.from_frame(streamed[PARKING_KEY]).isin(known)]
+    if missing.empty:
+        return df, 0
+    return pd.concat([df, missing], ignore_index=True), len(missing)
+
 def column_clean_ext(df):
     df.drop(columns=['direccion', 'plazas_movilidad_reducida', 'plazas_vehiculos_electricos',
                      'horario', 'tarifa_hora_euros'], inplace=True, errors='ignore')
@@ -64,31 +141,50 @@ def download_sql_file(bucket_name: str, object_name: str, local_path: str):
         local_path (str): Ruta local donde guardar el archivo.
     """
     try:
-        client = Minio(
-            endpoint="minio:9000",
-            access_key="minioadmin",
-            secret_key="minioadmin",
-            secure=False
-        )
+        client = get_minio_client()
         client.fget_object(bucket_name, object_name, local_path)
     except Exception as e:
         raise Exception(f"Error downloading {object_name} from {bucket_name}: {e}")
 
-def main_process_zone():
+def download_raw_data():
+    """Download the raw DataFrames and the municipal SQL dump from raw-ingestion-zone."""
+    trafico_df = download_dataframe_from_minio('raw-ingestion-zone', 'trafico/trafico-horario.csv')
+    bicimad_df = download_dataframe_from_minio('raw-ingestion-zone', 'bicimad/bicimad-usos.csv')
+    parkings_df = download_dataframe_from_minio('raw-ingestion-zone', 'aparcamiento/parkings_rotacion.csv')
+    ext_df = download_dataframe_from_minio('raw-ingestion-zone', 'aparcamiento/ext_aparcamientos_info.csv')
+    # Descargamos SQL como archivo temporal
+    sql_temp_path = "temp_dump-bbdd-municipal.sql"
+    download_sql_file('raw-ingestion-zone', 'sql/dump-bbdd-municipal.sql', sql_temp_path)
+    with open(sql_temp_path, 'r', encoding='iso-8859-1') as f:
+        municipal_sql = f.read()
+    return trafico_df, bicimad_df, parkings_df, ext_df, municipal_sql
+
+def load_raw_data(raw):
+    """Raw DataFrames and SQL dump handed over in memory by the ingestion stage."""
+    if raw.get('municipal_sql_path') is None:
+        raise Exception("Municipal SQL dump not available")
+    with open(raw['municipal_sql_path'], 'r', encoding='iso-8859-1') as f:
+        municipal_sql = f.read()
+    return raw['trafico'], raw['bicimad'], raw['parkings'], raw['ext'], municipal_sql
+
+def main_process_zone(raw=None):
+    """Clean the raw zone datasets into the process zone; returns the processed DataFrames.
+
+    ``raw`` (the output of ``01_ingest_data.main``) skips the download from raw-ingestion-zone
+    when the stages run in the same process.
+    """
     print("Starting data processing for Process Zone...")
+    # El secreto de la seudonimización se resuelve antes de descargar nada
+    pseudonym = pseudonym_key()
 
-    # Descargamos datos desde raw-ingestion-zone
-    print("\nDownloading data from raw-ingestion-zone...")
+    # Descargamos datos desde raw-ingestion-zone (o los recibimos en memoria de la ingesta)
     try:
-        trafico_df = download_dataframe_from_minio('raw-ingestion-zone', 'trafico/trafico-horario.csv')
-        bicimad_df = download_dataframe_from_minio('raw-ingestion-zone', 'bicimad/bicimad-usos.csv')
-        parkings_df = download_dataframe_from_minio('raw-ingestion-zone', 'aparcamiento/parkings_rotacion.csv')
-        ext_df = download_dataframe_from_minio('raw-ingestion-zone', 'aparcamiento/ext_aparcamientos_info.csv')
-        # Descargamos SQL como archivo temporal
-        sql_temp_path = "temp_dump-bbdd-municipal.sql"
-        download_sql_file('raw-ingestion-zone', 'sql/dump-bbdd-municipal.sql', sql_temp_path)
-        with open(sql_temp_path, 'r', encoding='iso-8859-1') as f:
-            municipal_sql = f.read()
+        if raw is not None:
+            print("\nUsing raw data handed over in memory...")
+            trafico_df, bicimad_df, parkings_df, ext_df, municipal_sql = load_raw_data(raw)
+        else:
+            print("\nDownloading data from raw-ingestion-zone...")
+            trafico_df, bicimad_df, parkings_df, ext_df, municipal_sql = download_raw_data()
         print("Data downloaded successfully")
     except Exception as e:
         print(f"Error downloading data: {e}")
@@ -106,6 +202,8 @@ def main_process_zone():
     print("Traffic data cleaned and formatted")
 
     # BiciMAD
+    date_format_bicimad(bicimad_df)
+    pseudonymize_bicimad(bicimad_df, pseudonym)
     column_clean_bicimad(bicimad_df)
     for col in bicimad_df.select_dtypes(include=['object']).columns:
         bicimad_df[col] = bicimad_df[col].apply(clean_text_column)
@@ -118,6 +216,14 @@ def main_process_zone():
         parkings_df[col] = parkings_df[col].apply(clean_text_column)
     for col in ext_df.select_dtypes(include=['object']).columns:
         ext_df[col] = ext_df[col].apply(clean_text_column)
+    # La tabla se sustituye entera: las horas recibidas por el stream que el fichero aún no trae se conservan
+    try:
+        parkings_df, streamed_rows = fold_streamed_parkings(parkings_df)
+    except Exception as e:
+        print(f"Error reading the streamed parking updates: {e}")
+        return
+    if streamed_rows:
+        print(f"{streamed_rows} streamed parking hours added to the raw file")
     print("Parking data cleaned")
 
     # Municipal (SQL con SQLite)
@@ -130,9 +236,11 @@ def main_process_zone():
     try:
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
-        sql_script = preprocess_sql_script(municipal_sql)
-        cursor.executescript(sql_script)
-        conn.commit()
+        with timed('sql_dump_parse') as op:
+            sql_script = preprocess_sql_script(municipal_sql)
+            cursor.executescript(sql_script)
+            conn.commit()
+            op.add(bytes=len(sql_script))
 
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
         tables = [row[0] for row in cursor.fetchall()]
@@ -141,7 +249,8 @@ def main_process_zone():
         # Procesamos tablas
         if "distritos" in tables:
             df_distritos = pd.read_sql_query("SELECT * FROM distritos", conn)
-            df_distritos = df_distritos[['id', 'nombre', 'densidad_poblacion']]
+            # Conservamos el centroide para el enriquecimiento espacial de la access zone
+            df_distritos = df_distritos[['id', 'nombre', 'densidad_poblacion', 'latitud', 'longitud']]
             # Limpiamos columnas de texto
             for col in df_distritos.select_dtypes(include=['object']).columns:
                 df_distritos[col] = df_distritos[col].apply(clean_text_column)
@@ -179,11 +288,13 @@ def main_process_zone():
     print("\nUploading processed data to process-zone...")
     try:
         # Tráfico
+        snapshot_id = new_snapshot_id()
         upload_dataframe_to_minio(
             trafico_df,
             'process-zone',
             'trafico/cleaned_traffic.parquet',
             format='parquet',
+            snapshot_id=snapshot_id,
             metadata={
                 'description': 'Cleaned and formatted traffic data',
                 'primary_keys': [],
@@ -191,17 +302,20 @@ def main_process_zone():
             }
         )
         log_data_transformation(
-            'raw-ingestion-zone', 'trafico-horarios.csv',
+            'raw-ingestion-zone', 'trafico/trafico-horario.csv',
             'process-zone', 'trafico/cleaned_traffic.parquet',
-            'Traffic data cleaned and converted to Parquet'
+            'Traffic data cleaned and converted to Parquet',
+            target_snapshot=snapshot_id
         )
 
         # BiciMAD
+        snapshot_id = new_snapshot_id()
         upload_dataframe_to_minio(
             bicimad_df,
             'process-zone',
             'bicimad/cleaned_bicimad.parquet',
             format='parquet',
+            snapshot_id=snapshot_id,
             metadata={
                 'description': 'Cleaned BiciMAD data',
                 'primary_keys': [],
@@ -209,17 +323,20 @@ def main_process_zone():
             }
         )
         log_data_transformation(
-            'raw-ingestion-zone', 'bicimad-usos.csv',
+            'raw-ingestion-zone', 'bicimad/bicimad-usos.csv',
             'process-zone', 'bicimad/cleaned_bicimad.parquet',
-            'BiciMAD data cleaned and converted to Parquet'
+            'BiciMAD data cleaned and converted to Parquet',
+            target_snapshot=snapshot_id
         )
 
         # Parkings (rotación)
+        snapshot_id = new_snapshot_id()
         upload_dataframe_to_minio(
             parkings_df,
             'process-zone',
             'parkings/cleaned_parking_rotation.parquet',
             format='parquet',
+            snapshot_id=snapshot_id,
             metadata={
                 'description': 'Cleaned parking rotation data',
                 'primary_keys': [],
@@ -227,17 +344,21 @@ def main_process_zone():
             }
         )
         log_data_transformation(
-            'raw-ingestion-zone', 'parkings-rotacion.csv',
+            'raw-ingestion-zone', 'aparcamiento/parkings_rotacion.csv',
             'process-zone', 'parkings/cleaned_parking_rotation.parquet',
-            'Parking rotation data cleaned and converted to Parquet'
+            'Parking rotation data cleaned and converted to Parquet, with the streamed hours the file lacks',
+            additional_sources=[STREAM_ARCHIVE],
+            target_snapshot=snapshot_id
         )
 
         # Parkings (información externa)
+        snapshot_id = new_snapshot_id()
         upload_dataframe_to_minio(
             ext_df,
             'process-zone',
             'parkings/cleaned_parking_info.parquet',
             format='parquet',
+            snapshot_id=snapshot_id,
             metadata={
                 'description': 'Cleaned external parking info',
                 'primary_keys': [],
@@ -245,20 +366,23 @@ def main_process_zone():
             }
         )
         log_data_transformation(
-            'raw-ingestion-zone', 'ext_aparcamientos_info.csv',
+            'raw-ingestion-zone', 'aparcamiento/ext_aparcamientos_info.csv',
             'process-zone', 'parkings/cleaned_parking_info.parquet',
-            'External parking info cleaned and converted to Parquet'
+            'External parking info cleaned and converted to Parquet',
+            target_snapshot=snapshot_id
         )
 
         # Municipal (distritos y estaciones)
         for table in ['distritos', 'estaciones_transporte']:
             parquet_path = f"{PROCESSED_DATA_PATH}/{table}.parquet"
             df = pd.read_parquet(parquet_path)
+            snapshot_id = new_snapshot_id()
             upload_dataframe_to_minio(
                 df,
                 'process-zone',
                 f'municipal/{table}.parquet',
                 format='parquet',
+                snapshot_id=snapshot_id,
                 metadata={
                     'description': f'Cleaned {table} data from municipal SQL',
                     'primary_keys': [],
@@ -266,17 +390,43 @@ def main_process_zone():
                 }
             )
             log_data_transformation(
-                'raw-ingestion-zone', 'dump-bbdd-municipal.sql',
+                'raw-ingestion-zone', 'sql/dump-bbdd-municipal.sql',
                 'process-zone', f'municipal/{table}.parquet',
-                f'{table} data processed and stored'
+                f'{table} data processed and stored',
+                target_snapshot=snapshot_id
             )
 
     except Exception as e:
         print(f"Error uploading data to process-zone: {e}")
         return
 
+    # Controles de calidad de los datasets procesados (se acumulan en el histórico de calidad)
+    print("\nRunning data quality checks...")
+    quality_checks = [
+        ('cleaned_traffic', trafico_df, {'no_nulls': ['sensor_id', 'fecha', 'hora', 'total_vehiculos'], 'unique': []}),
+        ('cleaned_bicimad', bicimad_df, {'no_nulls': ['usuario_hash', 'estacion_origen', 'estacion_destino', 'duracion_segundos'], 'unique': ['id']}),
+        ('cleaned_parking_rotation', parkings_df, {'no_nulls': ['aparcamiento_id', 'fecha', 'hora', 'plazas_ocupadas'], 'unique': []}),
+        ('cleaned_parking_info', ext_df, {'no_nulls': ['aparcamiento_id', 'capacidad_total'], 'unique': ['aparcamiento_id']})
+    ]
+    for dataset_name, df, rules in quality_checks:
+        try:
+            validate_data_quality(df, dataset_name, rules)
+        except Exception as e:
+            print(f"Error running quality checks on {dataset_name}: {e}")
+
     print("\nProcess Zone processing complete!")
     print("Data cleaned, standardized, and saved in process-zone.")
 
+    # Datos procesados para la access zone cuando el pipeline se ejecuta en un solo proceso
+    return {
+        'trafico': trafico_df,
+        'bicimad': bicimad_df,
+        'parkings': parkings_df,
+        'ext': ext_df,
+        'distritos': df_distritos,
+        'estaciones': df_estaciones
+    }
+
 if __name__ == "__main__":
-    main_process_zone()
\ No newline at end of file
+    with batched_index_updates():
+        main_process_zone()
\ No newline at end of file
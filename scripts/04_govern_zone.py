@@ -6,10 +6,14 @@ Govern Zone: Responsible for ensuring data security, quality, lifecycle,
 access management, and metadata management.
 """
 from utils import get_minio_client
+from metrics import timed
+from catalog import read_catalog, rebuild_catalog
+from lineage_graph import load_lineage_graph, rebuild_lineage_graph
+from quality_history import backfill_quality_history, first_failures, pass_rate_trend, read_quality_history, regression_alerts
+from retention import enforce_retention
 import json
 import pandas as pd
 import io
-import datetime
 import yaml
 
 def list_all_metadata():
@@ -22,41 +26,21 @@ def list_all_metadata():
 
     print("Retrieving metadata catalog from govern-zone-metadata:")
 
-    metadata_catalog = {}
-    objects = list(client.list_objects('govern-zone-metadata', prefix='metadata/', recursive=True))
-
-    for obj in objects:
-        object_name = obj.object_name
-
-        # Saltar si es una pseudo-carpeta
-        if object_name.endswith('/'):
-            continue
-
-        # Solo procesar archivos .json
-        if not object_name.endswith('.json'):
-            continue
-
-        try:
-            # Descargar y cargar JSON
-            response = client.get_object('govern-zone-metadata', object_name)
-            metadata_json = json.loads(response.read().decode('utf-8'))
-
-            # Extraer info del JSON
-            source_bucket = metadata_json.get('source_bucket', 'unknown')
-            object_metadata_name = metadata_json.get('object_name', 'unknown')
-
-            if source_bucket not in metadata_catalog:
-                metadata_catalog[source_bucket] = {}
-
-            metadata_catalog[source_bucket][object_metadata_name] = metadata_json
-
-        except Exception as e:
-            print(f"Error reading metadata for {object_name}: {e}")
+    # Índice compactado: una sola lectura para todo el catálogo. Si aún no existe se construye
+    # descargando los documentos de metadata/ en paralelo
+    catalog = read_catalog(client)
+    if catalog is None:
+        print("Catalog index not found, scanning metadata objects...")
+        catalog = rebuild_catalog()
 
+    metadata_catalog = {}
+    for source_bucket, object_metadata_name, metadata_json in zip(
+            catalog['source_bucket'], catalog['object_name'], catalog['metadata_json']):
+        metadata_catalog.setdefault(source_bucket, {})[object_metadata_name] = json.loads(metadata_json)
     return metadata_catalog
 
 def trace_data_lineage(target_object, target_bucket='access-zone'):
-    """Trace the lineage of a specific dataset back to its origins."""
+    """Trace the lineage of a specific dataset back to its origins, across every source."""
     client = get_minio_client()
 
     if not client.bucket_exists('govern-zone-metadata'):
@@ -65,55 +49,25 @@ def trace_data_lineage(target_object, target_bucket='access-zone'):
 
     print(f"Tracing data lineage for {target_bucket}/{target_object}:")
 
-    # Find lineage objects where this dataset is the target
-    lineage_objects = list(client.list_objects('govern-zone-metadata', prefix='lineage/'))
-
-    # Build the lineage chain
-    lineage_chain = []
-    current_target = (target_bucket, target_object)
-
-    while current_target:
-        found_source = False
-
-        for obj in lineage_objects:
-            try:
-                response = client.get_object('govern-zone-metadata', obj.object_name)
-                lineage = json.loads(response.read().decode('utf-8'))
-
-                # Check if this lineage record has our current target
-                if (lineage['target']['bucket'] == current_target[0] and
-                        lineage['target']['object'] == current_target[1]):
-
-                    # Add to lineage chain
-                    lineage_chain.append(lineage)
-
-                    # Move to the source of this transformation
-                    if lineage['source'] != 'multiple':
-                        current_target = (lineage['source']['bucket'], lineage['source']['object'])
-                        found_source = True
-                        break
-                    else:
-                        # Multiple sources - need to handle differently
-                        lineage_chain.append({
-                            'timestamp': lineage['timestamp'],
-                            'note': 'This dataset was created from multiple source datasets',
-                            'transformation': lineage['transformation']
-                        })
-                        current_target = None
-                        break
-            except Exception as e:
-                print(f"Error reading lineage for {obj.object_name}: {e}")
-
-        # If we didn't find a source, we've reached the beginning of the chain
-        if not found_source:
-            current_target = None
-
-    # Reverse to get chronological order
+    # Grafo de linaje en memoria (una sola lectura); si no existe se reconstruye desde lineage/
+    graph = load_lineage_graph(client)
+    if graph is None:
+        print("Lineage graph index not found, rebuilding from lineage records...")
+        graph = rebuild_lineage_graph()
+
+    lineage_chain = graph.upstream_of(target_bucket, target_object)
+
+    # Reverse to get chronological order (origins first)
     lineage_chain.reverse()
     return lineage_chain
 
-def generate_data_quality_report():
-    """Generate a report of data quality checks."""
+def analyze_impact(source_object, source_bucket='raw-ingestion-zone'):
+    """List every dataset affected if ``source_bucket/source_object`` changes."""
+    graph = load_lineage_graph() or rebuild_lineage_graph()
+    return graph.impact(source_bucket, source_object)
+
+def generate_data_quality_report(start=None, end=None, datasets=None):
+    """Generate a report of data quality checks for a date range and set of datasets."""
     client = get_minio_client()
 
     if not client.bucket_exists('govern-zone-metadata'):
@@ -122,32 +76,12 @@ def generate_data_quality_report():
 
     print("Generating data quality report:")
 
-    # Find quality check objects
-    quality_objects = list(client.list_objects('govern-zone-metadata', prefix='quality/'))
-
-    # Collect quality check results
-    quality_results = []
-    for obj in quality_objects:
-        try:
-            response = client.get_object('govern-zone-metadata', obj.object_name)
-            quality_check = json.loads(response.read().decode('utf-8'))
-
-            # Process each individual check
-            for check in quality_check['checks']:
-                result = {
-                    'dataset': quality_check['dataset'],
-                    'timestamp': quality_check['timestamp'],
-                    'check_type': check['check'],
-                    'column': check['column'],
-                    'passed': check['passed'],
-                    'details': check['details']
-                }
-                quality_results.append(result)
-        except Exception as e:
-            print(f"Error reading quality check for {obj.object_name}: {e}")
-
-    # Convert to DataFrame
-    return pd.DataFrame(quality_results)
+    # Los resultados anteriores al histórico (solo en quality/) se importan una única vez
+    backfill_quality_history(client)
+
+    # Histórico columnar: solo se leen las particiones de las fechas y datasets pedidos
+    history = read_quality_history(start, end, datasets)
+    return history[['dataset', 'timestamp', 'check_type', 'column', 'passed', 'details']]
 
 def create_security_policy():
     """Create a sample security policy for the data lake zones."""
@@ -272,13 +206,15 @@ def create_security_policy():
         client.make_bucket('govern-zone-security')
 
     security_buffer = io.BytesIO(security_yaml.encode('utf-8'))
-    client.put_object(
-        'govern-zone-security',
-        'policies/data_lake_security_policy.yaml',
-        security_buffer,
-        length=len(security_yaml),
-        content_type='application/yaml'
-    )
+    with timed('governance_write') as op:
+        client.put_object(
+            'govern-zone-security',
+            'policies/data_lake_security_policy.yaml',
+            security_buffer,
+            length=len(security_yaml),
+            content_type='application/yaml'
+        )
+        op.add(bytes=len(security_yaml))
 
     print("Security policy created and stored in govern-zone-security")
     return security_policy
@@ -302,7 +238,7 @@ def main():
 
     # 2. Trace data lineage for an analytics dataset
     print("\n\n=== Data Lineage Tracing ===")
-    lineage = trace_data_lineage('analytics/customer_summary.parquet')
+    lineage = trace_data_lineage('facts/ocupacion_parkings.parquet')
 
     # Print lineage
     if lineage:
@@ -319,6 +255,11 @@ def main():
     else:
         print("No lineage information found.")
 
+    # Análisis de impacto: qué datasets se ven afectados si cambia el volcado SQL municipal
+    print("\nImpact analysis for raw-ingestion-zone/sql/dump-bbdd-municipal.sql:")
+    for dataset in analyze_impact('sql/dump-bbdd-municipal.sql'):
+        print(f"  - {dataset}")
+
     # 3. Generate data quality report
     print("\n\n=== Data Quality Report ===")
     quality_report = generate_data_quality_report()
@@ -344,6 +285,16 @@ def main():
             for _, check in failed_checks.iterrows():
                 print(f"  - {check['dataset']}: {check['check_type']} on column '{check['column']}' failed")
                 print(f"    Details: {check['details']}")
+
+        # Tendencias: tasa de aprobados por día, fallos persistentes y regresiones
+        history = quality_report.assign(passed=quality_report['passed'].astype(bool))
+        print("\nDaily pass rate:")
+        for _, row in pass_rate_trend(history).iterrows():
+            print(f"  {row['periodo'].date()} {row['dataset']} {row['check_type']}: {row['pass_rate']:.1f}%")
+        for _, row in first_failures(history).iterrows():
+            print(f"  Failing since {row['failing_since']}: {row['dataset']} {row['check_type']} on '{row['column']}' ({row['failed_runs']} runs)")
+        for _, row in regression_alerts(history).iterrows():
+            print(f"  REGRESSION: {row['dataset']} {row['check_type']} on '{row['column']}' failed at {row['timestamp']} ({row['details']})")
     else:
         print("No quality check results found.")
 
@@ -351,6 +302,11 @@ def main():
     print("\n\n=== Security Policy Creation ===")
     create_security_policy()
 
+    # 5. Retention: informe en modo simulación (el borrado real se lanza con retention.py --apply)
+    print("\n\n=== Retention Policy Enforcement (dry run) ===")
+    retention_report = enforce_retention(dry_run=True)
+    print(f"Total reclaimable: {retention_report['bytes_reclaimed'] / 1024 / 1024:.2f} MB")
+
     # Summary
     print("\n\n=== Govern Zone Summary ===")
     print("The Govern Zone provides:")
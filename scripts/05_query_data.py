@@ -1,35 +1,28 @@
 """
 This script demonstrates querying the data in the access zone using different methods:
-1. Direct Pandas querying from the access-zone for traffic data.
+1. In-process columnar aggregation over the access-zone traffic data (no Trino needed),
+   served from the lake query result cache while the inputs are unchanged.
+2. SQL over the access-zone Parquet datasets with DuckDB (optional).
 """
 
-from utils import (
-    download_dataframe_from_minio
-)
-import pandas as pd
+from query_cache import cached_aggregate, cached_sql
 
 def query_with_pandas():
-    """Demonstrate accessing and analyzing traffic data directly with pandas."""
-    print("\n=== Querying Access Zone with Pandas ===")
+    """Analyze traffic per hour, reading only the needed columns of the access-zone dataset."""
+    print("\n=== Querying Access Zone with the in-process lake engine ===")
 
     # Load traffic dataset from access zone
-    print("Loading traffic dataset from access-zone...")
-
-    traffic_data = download_dataframe_from_minio(
-        'access-zone',
-        'trafico/cleaned_traffic.parquet',
-        format='parquet'
-    )
+    print("Aggregating traffic dataset from access-zone...")
 
     # Agrupar los datos de tráfico por hora y sumar las diferentes categorías de vehículos
-    traffic_data = traffic_data.groupby('hora').agg({
-        'coches': 'sum',
-        'motos': 'sum',
-        'camiones': 'sum',
-        'buses': 'sum',
-        'total_vehiculos': 'sum',
-        'nivel_congestion': lambda x: x.mode()[0] if not x.mode().empty else None
-    }).reset_index()
+    traffic_data = cached_aggregate('trafico', ['hora'], {
+        'coches': ('coches', 'sum'),
+        'motos': ('motos', 'sum'),
+        'camiones': ('camiones', 'sum'),
+        'buses': ('buses', 'sum'),
+        'total_vehiculos': ('total_vehiculos', 'sum'),
+        'nivel_congestion': ('nivel_congestion', 'mode')
+    }).sort_values('hora').reset_index(drop=True)
 
     # 10 registros con mayor tráfico y tipos de vehículos predominantes
     n = 10
@@ -51,6 +44,25 @@ def query_with_pandas():
 
     return traffic_data
 
+def query_with_sql():
+    """Percentiles of hourly traffic per congestion level using SQL over the lake."""
+    print("\n=== Querying Access Zone with SQL ===")
+    try:
+        result = cached_sql("""
+            SELECT nivel_congestion,
+                   COUNT(*) AS mediciones,
+                   quantile_cont(total_vehiculos, 0.5) AS p50_vehiculos,
+                   quantile_cont(total_vehiculos, 0.95) AS p95_vehiculos
+            FROM trafico
+            GROUP BY nivel_congestion
+            ORDER BY p95_vehiculos DESC
+        """)
+    except ImportError as e:
+        print(f"Skipping SQL example: {e}")
+        return None
+    print(result)
+    return result
+
 
 def main():
     """Execute query examples focused on traffic data."""
@@ -59,6 +71,9 @@ def main():
     # 1. Query with Pandas - direct access to the traffic data
     traffic_data = query_with_pandas()
     print(traffic_data)
-    
+
+    # 2. SQL over the same Parquet datasets
+    query_with_sql()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,210 @@
+"""
+HTTP API with aggregated access-zone data for citizen-facing dashboards.
+
+A small asyncio server (standard library only) with JSON endpoints:
+
+    GET /health
+    GET /trafico/horario?fecha_inicio=YYYY-MM-DD&fecha_fin=YYYY-MM-DD
+    GET /parkings/ocupacion?fecha_inicio=...&fecha_fin=...&distrito_id=N&nivel=distrito|aparcamiento
+    GET /distritos/infraestructura?distrito_id=N
+
+MinIO reads run in worker threads so the event loop never blocks. Responses are kept in
+an in-memory LRU cache and carry a content ETag (``If-None-Match`` returns 304), and
+concurrent identical requests share a single computation.
+"""
+from rollups import read_cube
+from lake_query import scan
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+API_HOST = os.environ.get('API_HOST', '0.0.0.0')
+API_PORT = int(os.environ.get('API_PORT', '8080'))
+API_CACHE_ENTRIES = int(os.environ.get('API_CACHE_ENTRIES', '256'))
+API_CACHE_TTL = int(os.environ.get('API_CACHE_TTL', '60'))
+
+def _records(df):
+    """Serialize a DataFrame as a list of JSON records."""
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+def etag_matches(if_none_match, etag):
+    """True if an ``If-None-Match`` header matches ``etag`` (weak comparison, as for GET)."""
+    if if_none_match is None:
+        return False
+    # Lista de ETags separadas por comas, débiles (W/"...") o '*'
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or any(candidate.removeprefix('W/') == etag for candidate in candidates)
+
+def trafico_horario(params):
+    """Hourly traffic profile (mean vehicles and predominant congestion level) for a date range."""
+    cube = read_cube('trafico', 'hora', params.get('fecha_inicio'), params.get('fecha_fin'), by=['hora'])
+    if cube.empty:
+        return []
+    columns = ['hora', 'filas'] + [c for c in cube.columns if c.endswith('_mean')] + ['total_vehiculos_sum', 'nivel_congestion_moda']
+    return _records(cube[columns].sort_values('hora'))
+
+def parkings_ocupacion(params):
+    """Hourly parking occupancy per district or per car park for a date range."""
+    nivel = params.get('nivel', 'distrito')
+    if nivel == 'aparcamiento':
+        grain, by = 'aparcamiento_hora', ['distrito_id', 'aparcamiento_id', 'hora']
+    else:
+        grain, by = 'distrito_hora', ['distrito_id', 'hora']
+    cube = read_cube('ocupacion_parkings', grain, params.get('fecha_inicio'), params.get('fecha_fin'), by=by)
+    if cube.empty:
+        return []
+    if 'distrito_id' in params:
+        cube = cube[cube['distrito_id'] == int(params['distrito_id'])]
+    columns = by + ['filas', 'plazas_ocupadas_mean', 'porcentaje_ocupacion_mean',
+                    'porcentaje_ocupacion_min', 'porcentaje_ocupacion_max', 'nivel_congestion_moda']
+    return _records(cube[columns].sort_values(by))
+
+def distritos_infraestructura(params):
+    """Number of transport stations of each type per district."""
+    filters = [('distrito_id', '==', int(params['distrito_id']))] if 'distrito_id' in params else None
+    hechos = scan('fact_infraestructura', filters=filters).to_pandas()
+    distritos = scan('dim_distritos', columns=['id', 'nombre', 'densidad_poblacion']).to_pandas()
+    tipos = scan('dim_tipos_estacion', columns=['id', 'tipo_estacion']).to_pandas()
+    df = hechos.merge(distritos.rename(columns={'id': 'distrito_id', 'nombre': 'distrito'}), on='distrito_id', how='left') \
+               .merge(tipos.rename(columns={'id': 'tipo_estacion_id'}), on='tipo_estacion_id', how='left')
+    return _records(df[['distrito_id', 'distrito', 'densidad_poblacion', 'tipo_estacion', 'cantidad']]
+                    .sort_values(['distrito_id', 'tipo_estacion']))
+
+ROUTES = {
+    '/trafico/horario': trafico_horario,
+    '/parkings/ocupacion': parkings_ocupacion,
+    '/distritos/infraestructura': distritos_infraestructura,
+}
+
+class ResponseCache:
+    """LRU cache of serialized responses with request coalescing for identical in-flight requests."""
+
+    def __init__(self, max_entries=API_CACHE_ENTRIES, ttl=API_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, compute):
+        """Return ``(etag, body)`` for ``key``, running ``compute`` in a thread on a miss."""
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+        # Si ya hay una petición idéntica en curso esperamos su resultado
+        if key in self.in_flight:
+            self.hits += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            result = await asyncio.to_thread(compute)
+            body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            self.entries[key] = (time.monotonic(), etag, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            future.set_result((etag, body))
+            return etag, body
+        except Exception as e:
+            future.set_exception(e)
+            # Evita el aviso de excepción no recuperada si nadie más esperaba
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+
+CACHE = ResponseCache()
+
+async def _send(writer, status, body=b'', headers=None, keep_alive=True):
+    reasons = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+    lines = [f"HTTP/1.1 {status} {reasons.get(status, '')}"]
+    headers = dict(headers or {})
+    headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+    headers['Content-Length'] = str(len(body))
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+
+def _error(message):
+    return json.dumps({'error': message}).encode('utf-8')
+
+async def handle_request(method, target, headers):
+    """Route one request; returns ``(status, body, headers)``."""
+    url = urlsplit(target)
+    params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+    if method != 'GET':
+        return 400, _error('Only GET is supported'), {}
+    if url.path == '/health':
+        stats = {'status': 'ok', 'cache_entries': len(CACHE.entries), 'hits': CACHE.hits, 'misses': CACHE.misses}
+        return 200, json.dumps(stats).encode('utf-8'), {}
+    if url.path not in ROUTES:
+        return 404, _error(f'Unknown endpoint {url.path}'), {}
+
+    key = url.path + '?' + '&'.join(f"{k}={v}" for k, v in sorted(params.items()))
+    try:
+        etag, body = await CACHE.get(key, lambda: ROUTES[url.path](params))
+    except ValueError as e:
+        return 400, _error(str(e)), {}
+    except Exception as e:
+        print(f"Error serving {target}: {e}")
+        return 500, _error('Internal error'), {}
+
+    response_headers = {'ETag': etag, 'Cache-Control': f'public, max-age={CACHE.ttl}'}
+    if etag_matches(headers.get('if-none-match'), etag):
+        return 304, b'', response_headers
+    return 200, body, response_headers
+
+async def handle_connection(reader, writer):
+    """Serve HTTP/1.1 requests (with keep-alive) on one client connection."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            try:
+                method, target, version = request_line.decode('latin-1').split()
+            except ValueError:
+                await _send(writer, 400, _error('Malformed request line'), keep_alive=False)
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+            status, body, response_headers = await handle_request(method, target, headers)
+            await _send(writer, status, body, response_headers, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionResetError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host=API_HOST, port=API_PORT):
+    """Start the API server and serve forever."""
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f"Access zone API listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,200 @@
+"""
+End-to-end benchmark of the pipeline stages on synthetic data.
+
+Generates (or reuses) a synthetic dataset with ``synthetic_data.generate_dataset`` and runs
+the stages ``01``-``05`` against it, each one in its own process so that its peak memory is
+measured in isolation. For every stage it records the wall time, the source rows per second,
+the bytes read from and written to the lake and the peak resident memory, and writes the result
+as JSON so runs can be compared across commits:
+
+    python benchmark.py --scale 100000
+    python benchmark.py --scale 1000000 --stages ingest process --output bench.json
+    python benchmark.py --scale 100000 --storage local   # no network: compute cost only
+    python benchmark.py --compare benchmarks/old.json benchmarks/new.json
+"""
+from synthetic_data import generate_dataset
+from run_pipeline import DATA_STAGES, STAGES, STAGE_ORDER
+from storage import TRANSFER_STATS
+import metrics
+from minio import Minio
+import os
+import json
+import time
+import inspect
+import argparse
+import datetime
+import importlib
+import resource
+import secrets
+import subprocess
+import multiprocessing
+
+BENCHMARK_DIR = 'benchmarks'
+# Datasets cuyas filas cuentan como filas procesadas por el pipeline
+SOURCE_DATASETS = ['bicimad-usos.csv', 'trafico-horario.csv', 'parkings-rotacion.csv']
+
+def _count_lake_traffic():
+    """Count the bytes this process sends to and receives from MinIO."""
+    counter = {'requests': 0, 'bytes_written': 0, 'bytes_read': 0}
+    url_open = Minio._url_open
+
+    def counting_url_open(self, method, region, bucket_name=None, object_name=None, body=None, headers=None,
+                          query_params=None, preload_content=True, no_body_trace=False):
+        response = url_open(self, method, region, bucket_name=bucket_name, object_name=object_name, body=body,
+                            headers=headers, query_params=query_params, preload_content=preload_content,
+                            no_body_trace=no_body_trace)
+        counter['requests'] += 1
+        counter['bytes_written'] += len(body) if body else 0
+        if method == 'GET':
+            counter['bytes_read'] += int(response.headers.get('content-length') or 0)
+        return response
+
+    Minio._url_open = counting_url_open
+    return counter
+
+def _run_stage(stage, kwargs, results):
+    # Se ejecuta en un proceso hijo: la memoria máxima medida es solo la de esta etapa
+    counter = _count_lake_traffic()
+    module_name, function_name = STAGES[stage][:2]
+    error = None
+    started = time.perf_counter()
+    try:
+        stage_function = getattr(importlib.import_module(module_name), function_name)
+        if 'force' in inspect.signature(stage_function).parameters:
+            # Sin checkpoints: cada ejecución del benchmark hace todo el trabajo
+            kwargs = dict(kwargs, force=True)
+        with metrics.stage(stage):
+            if stage_function(**kwargs) is None and stage in DATA_STAGES:
+                error = 'stage returned no result'
+    except Exception as e:
+        error = repr(e)
+    wall_time = time.perf_counter() - started
+    # Tráfico de MinIO (cliente HTTP) más el de los backends local y en memoria
+    results.put({
+        'wall_time_s': wall_time,
+        'peak_memory_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,  # ru_maxrss en KB (Linux)
+        'lake_requests': counter['requests'] + TRANSFER_STATS['requests'],
+        'bytes_read': counter['bytes_read'] + TRANSFER_STATS['bytes_read'],
+        'bytes_written': counter['bytes_written'] + TRANSFER_STATS['bytes_written'],
+        'operations': metrics.summary()['operations'],
+        'error': error
+    })
+
+def benchmark_stage(stage, rows, kwargs=None):
+    """Run one stage in a separate process and return its measurements."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_stage, args=(stage, kwargs or {}, results))
+    process.start()
+    try:
+        measurements = results.get()
+    finally:
+        process.join()
+    measurements['rows'] = rows
+    measurements['rows_per_s'] = rows / measurements['wall_time_s'] if measurements['wall_time_s'] else None
+    measurements['status'] = 'failed' if measurements['error'] or process.exitcode else 'done'
+    return measurements
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmark(scale, data_dir, stages=None, seed=42, output=None, storage_backend=None):
+    """Benchmark the selected stages (all by default) on ``scale`` synthetic rows; returns the report.
+
+    ``storage_backend`` (``minio`` or ``local``) overrides ``STORAGE_BACKEND`` for the stage
+    processes; the in-memory backend does not outlive a stage process, so it cannot be used here.
+    """
+    if storage_backend:
+        # Los procesos de cada etapa heredan el entorno
+        os.environ['STORAGE_BACKEND'] = storage_backend
+    # Los usuarios sintéticos no identifican a nadie: basta un secreto de seudonimización desechable
+    os.environ.setdefault('PSEUDONYM_KEY', secrets.token_hex(32))
+    manifest = generate_dataset(data_dir, scale, seed)
+    rows = sum(manifest['files'][name]['rows'] for name in SOURCE_DATASETS)
+    report = {
+        'commit': _git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(),
+        'scale': scale,
+        'seed': seed,
+        'storage_backend': os.environ.get('STORAGE_BACKEND', 'minio'),
+        'source_rows': rows,
+        'dataset': manifest['files'],
+        'stages': {}
+    }
+
+    for stage in stages or STAGE_ORDER:
+        print(f"\n===== Benchmarking stage '{stage}' ({rows} source rows) =====")
+        kwargs = {'data_dir': data_dir} if stage == 'ingest' else {}
+        measurements = benchmark_stage(stage, rows, kwargs)
+        report['stages'][stage] = measurements
+        print(f"Stage '{stage}' {measurements['status']} in {measurements['wall_time_s']:.2f}s "
+              f"({measurements['rows_per_s'] or 0:.0f} rows/s, peak {measurements['peak_memory_bytes'] / 1024 / 1024:.0f} MB)")
+        if measurements['status'] != 'done':
+            # Las etapas siguientes dependen de esta: no tiene sentido medirlas
+            print(f"Stage '{stage}' failed: {measurements['error']}")
+            break
+    report['total_wall_time_s'] = sum(stage['wall_time_s'] for stage in report['stages'].values())
+
+    if output is None:
+        os.makedirs(BENCHMARK_DIR, exist_ok=True)
+        output = os.path.join(BENCHMARK_DIR, f"{datetime.datetime.now():%Y%m%d_%H%M%S}_{report['commit'] or 'local'}_{scale}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark report saved to {output}")
+    print_benchmark(report)
+    return report
+
+def print_benchmark(report):
+    """Print the per-stage measurements of a benchmark report."""
+    print(f"\nBenchmark (commit {report['commit']}, scale {report['scale']}, storage {report.get('storage_backend', 'minio')}):")
+    print(f"  {'stage':<10} {'wall (s)':>10} {'rows/s':>12} {'read (MB)':>10} {'written (MB)':>13} {'peak (MB)':>10}")
+    for stage, m in report['stages'].items():
+        print(f"  {stage:<10} {m['wall_time_s']:>10.2f} {m['rows_per_s'] or 0:>12.0f} {m['bytes_read'] / 1024 / 1024:>10.1f} "
+              f"{m['bytes_written'] / 1024 / 1024:>13.1f} {m['peak_memory_bytes'] / 1024 / 1024:>10.0f}")
+
+def compare_benchmarks(base_path, new_path):
+    """Print how every stage changed between two benchmark reports (ratios new / base)."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if base['scale'] != new['scale']:
+        print(f"Warning: comparing different scales ({base['scale']} vs {new['scale']})")
+    print(f"\nBenchmark comparison {base['commit']} -> {new['commit']} (scale {new['scale']}):")
+    print(f"  {'stage':<10} {'wall (s)':>20} {'rows/s x':>10} {'peak mem x':>11} {'bytes x':>9}")
+    comparison = {}
+    for stage in STAGE_ORDER:
+        if stage not in base['stages'] or stage not in new['stages']:
+            continue
+        b, n = base['stages'][stage], new['stages'][stage]
+        ratio = lambda key: n[key] / b[key] if b[key] else None
+        moved = lambda m: m['bytes_read'] + m['bytes_written']
+        comparison[stage] = {
+            'wall_time': ratio('wall_time_s'),
+            'rows_per_s': ratio('rows_per_s'),
+            'peak_memory': ratio('peak_memory_bytes'),
+            'bytes_moved': moved(n) / moved(b) if moved(b) else None
+        }
+        c = comparison[stage]
+        print(f"  {stage:<10} {b['wall_time_s']:>8.2f} -> {n['wall_time_s']:>8.2f} {c['rows_per_s'] or 0:>10.2f} "
+              f"{c['peak_memory'] or 0:>11.2f} {c['bytes_moved'] or 0:>9.2f}")
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the data lake pipeline on synthetic data.')
+    parser.add_argument('--scale', type=int, default=100_000, help='rows per synthetic dataset')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default='/data/synthetic', help='directory for the synthetic data')
+    parser.add_argument('--stages', nargs='+', choices=STAGE_ORDER, help='stages to benchmark (default: all)')
+    parser.add_argument('--storage', choices=['minio', 'local'], help='storage backend (default: STORAGE_BACKEND)')
+    parser.add_argument('--output', help='JSON report path (default: benchmarks/<timestamp>_<commit>_<scale>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two benchmark reports')
+    args = parser.parse_args()
+    if args.compare:
+        compare_benchmarks(*args.compare)
+    else:
+        run_benchmark(args.scale, args.data_dir, args.stages, args.seed, args.output, args.storage)
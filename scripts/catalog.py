@@ -0,0 +1,166 @@
+"""
+Compacted metadata catalog index for the govern zone.
+
+Every metadata document written under ``govern-zone-metadata/metadata/`` is also upserted
+into a single Parquet file, ``govern-zone-metadata/catalog/catalog.parquet``, holding one
+row per dataset (the latest metadata wins). Listing or searching the catalog therefore
+takes one read, whatever the number of datasets.
+
+Upserts are applied in batches (``utils.batched_index_updates`` collects the documents of a
+stage and writes the index once) under a lease, ``catalog/_catalog.lease``, shared by every
+process that writes the index. A missing index is rebuilt from ``metadata/`` before the batch
+is applied, so documents written while it did not exist are not lost.
+"""
+from utils import fetch_prefix_documents, get_minio_client
+from storage import object_lease
+from metrics import timed
+import pandas as pd
+import io
+import json
+import threading
+
+CATALOG_BUCKET = 'govern-zone-metadata'
+CATALOG_OBJECT = 'catalog/catalog.parquet'
+CATALOG_LEASE = 'catalog/_catalog.lease'
+CATALOG_COLUMNS = [
+    'source_bucket', 'object_name', 'metadata_object', 'uploaded_at',
+    'format', 'rows', 'description', 'columns', 'deleted_at', 'metadata_json'
+]
+
+_lock = threading.Lock()
+
+def catalog_entry(metadata_object, metadata):
+    """Catalog row for one metadata document."""
+    return {
+        'source_bucket': metadata.get('source_bucket', 'unknown'),
+        'object_name': metadata.get('object_name', 'unknown'),
+        'metadata_object': metadata_object,
+        'uploaded_at': metadata.get('uploaded_at'),
+        'format': metadata.get('format'),
+        'rows': metadata.get('rows'),
+        'description': metadata.get('description'),
+        'columns': [str(column) for column in metadata.get('columns', [])],
+        'deleted_at': metadata.get('deleted_at'),
+        'metadata_json': json.dumps(metadata, default=str)
+    }
+
+def read_catalog(client=None):
+    """Load the catalog index (one GET); returns None if it has not been built yet."""
+    client = client or get_minio_client()
+    try:
+        response = client.get_object(CATALOG_BUCKET, CATALOG_OBJECT)
+        try:
+            # Los índices antiguos pueden no tener todas las columnas (p. ej. deleted_at)
+            return pd.read_parquet(io.BytesIO(response.read())).reindex(columns=CATALOG_COLUMNS)
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return None
+
+def _write_catalog(client, catalog):
+    catalog = catalog.astype({'rows': 'Int64'}).sort_values(['source_bucket', 'object_name']).reset_index(drop=True)
+    buffer = io.BytesIO()
+    catalog[CATALOG_COLUMNS].to_parquet(buffer, index=False)
+    data = buffer.getvalue()
+    with timed('catalog_write') as op:
+        client.put_object(CATALOG_BUCKET, CATALOG_OBJECT, io.BytesIO(data), length=len(data),
+                          content_type='application/octet-stream')
+        op.add(bytes=len(data), rows=len(catalog))
+
+def _scan_catalog():
+    entries = []
+    for object_name, metadata, error in fetch_prefix_documents(CATALOG_BUCKET, 'metadata/'):
+        if error is not None:
+            print(f"Error reading metadata for {object_name}: {error}")
+            continue
+        entries.append(catalog_entry(object_name, metadata))
+    return pd.DataFrame(entries, columns=CATALOG_COLUMNS)
+
+def _ensure_bucket(client):
+    if not client.bucket_exists(CATALOG_BUCKET):
+        client.make_bucket(CATALOG_BUCKET)
+
+def upsert_catalog_entries(documents):
+    """Upsert the catalog rows of ``{metadata_object: metadata}`` with a single index write."""
+    if not documents:
+        return
+    client = get_minio_client()
+    _ensure_bucket(client)
+    new_rows = pd.DataFrame([catalog_entry(metadata_object, metadata) for metadata_object, metadata in documents.items()],
+                            columns=CATALOG_COLUMNS)
+    with _lock, object_lease(client, CATALOG_BUCKET, CATALOG_LEASE):
+        catalog = read_catalog(client)
+        if catalog is None:
+            # Sin índice (primera ejecución o borrado): se reconstruye para no perder los documentos ya escritos
+            catalog = _scan_catalog()
+            print(f"Metadata catalog missing, rebuilt from {len(catalog)} metadata documents")
+        # Compactación: una única fila por dataset, la última versión sustituye a la anterior
+        catalog = catalog[~catalog['metadata_object'].isin(new_rows['metadata_object'])]
+        catalog = new_rows if catalog.empty else pd.concat([catalog, new_rows], ignore_index=True)
+        _write_catalog(client, catalog)
+
+def update_catalog(metadata_object, metadata):
+    """Upsert the catalog row of one metadata document."""
+    upsert_catalog_entries({metadata_object: metadata})
+
+def rebuild_catalog():
+    """Rebuild the catalog index from every metadata document (fetched concurrently)."""
+    client = get_minio_client()
+    _ensure_bucket(client)
+    with _lock, object_lease(client, CATALOG_BUCKET, CATALOG_LEASE):
+        catalog = _scan_catalog()
+        _write_catalog(client, catalog)
+    print(f"Metadata catalog rebuilt with {len(catalog)} datasets")
+    return catalog
+
+def find_datasets(bucket=None, object_prefix=None, column=None, since=None, until=None, catalog=None,
+                  include_deleted=False):
+    """Search the catalog by bucket, object name prefix, column name and upload time range.
+
+    Datasets tombstoned by the retention engine are skipped unless ``include_deleted`` is set.
+    """
+    catalog = catalog if catalog is not None else read_catalog()
+    if catalog is None:
+        return pd.DataFrame(columns=CATALOG_COLUMNS)
+
+    mask = pd.Series(True, index=catalog.index)
+    if not include_deleted:
+        mask &= catalog['deleted_at'].isna()
+    if bucket is not None:
+        mask &= catalog['source_bucket'] == bucket
+    if object_prefix is not None:
+        mask &= catalog['object_name'].str.startswith(object_prefix)
+    if column is not None:
+        columns = catalog['columns'].explode()
+        mask &= pd.Series(catalog.index.isin(columns.index[columns == column]), index=catalog.index)
+    if since is not None or until is not None:
+        uploaded_at = pd.to_datetime(catalog['uploaded_at'], errors='coerce')
+        if since is not None:
+            mask &= uploaded_at >= pd.Timestamp(since)
+        if until is not None:
+            mask &= uploaded_at <= pd.Timestamp(until)
+    return catalog[mask].reset_index(drop=True)
+
+def file_statistics(bucket, object_name, catalog=None):
+    """Column statistics of the files of a dataset, ``{object_name: {column: stats}}`` (empty if unknown).
+
+    Single objects carry ``column_stats`` in their metadata; datasets made of several files
+    (e.g. rollup cubes) carry ``file_stats`` keyed by object name, which also serve any
+    sub-prefix of the dataset (one grain of a cube).
+    """
+    catalog = catalog if catalog is not None else read_catalog()
+    if catalog is None:
+        return {}
+    covering = catalog[(catalog['source_bucket'] == bucket) & catalog['deleted_at'].isna() & catalog['object_name'].map(
+        lambda name: name == object_name or (name.endswith('/') and object_name.startswith(name)))]
+
+    statistics = {}
+    for dataset_object, metadata_json in zip(covering['object_name'], covering['metadata_json']):
+        metadata = json.loads(metadata_json)
+        if metadata.get('file_stats'):
+            statistics.update({name: stats for name, stats in metadata['file_stats'].items()
+                               if name.startswith(object_name)})
+        elif dataset_object == object_name and metadata.get('column_stats'):
+            statistics[object_name] = metadata['column_stats']
+    return statistics
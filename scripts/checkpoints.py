@@ -0,0 +1,126 @@
+"""
+Durable checkpoints for resumable pipeline runs.
+
+A checkpoint stores, for one pipeline stage or for the steps inside a stage, a fingerprint
+of the inputs consumed and every step committed so far (with its row count):
+
+    govern-zone-metadata/checkpoints/<name>.json
+
+A rerun over the same inputs skips what was already committed, so recovering from a failure
+late in a run only redoes the remaining work. New inputs, or ``force``, start from scratch.
+"""
+from utils import get_minio_client
+from tables import load_pointer
+import pandas as pd
+import io
+import os
+import json
+import hashlib
+import datetime
+import threading
+
+CHECKPOINT_BUCKET = 'govern-zone-metadata'
+CHECKPOINT_PREFIX = 'checkpoints'
+
+def lake_fingerprint(objects):
+    """Current snapshot (tables) or ETag of each ``(bucket, object)`` (None if it does not exist)."""
+    client = get_minio_client()
+    fingerprint = {}
+    for bucket, object_name in objects:
+        pointer = load_pointer(bucket, object_name, client)
+        if pointer is not None:
+            fingerprint[f"{bucket}/{object_name}"] = f"snapshot:{pointer['current_snapshot']}"
+            continue
+        try:
+            fingerprint[f"{bucket}/{object_name}"] = client.stat_object(bucket, object_name).etag
+        except Exception:
+            fingerprint[f"{bucket}/{object_name}"] = None
+    return fingerprint
+
+def file_fingerprint(paths):
+    """Size and modification time of each local file (None if it does not exist)."""
+    return {
+        path: [os.path.getsize(path), os.path.getmtime(path)] if os.path.exists(path) else None
+        for path in paths
+    }
+
+def frame_fingerprint(frames):
+    """Content hash of a ``{name: DataFrame}`` dict, independent of where the frames were read from.
+
+    Covers the column names and dtypes and the rows in order, so a reordered, renamed or
+    retyped input changes the fingerprint.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(frames):
+        df = frames[name]
+        digest.update(name.encode('utf-8'))
+        digest.update(json.dumps([[str(column), str(dtype)] for column, dtype in df.dtypes.items()]).encode('utf-8'))
+        # Los hashes de fila se encadenan en orden (una suma no distingue el orden de las filas)
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _checkpoint_object(name):
+    return f"{CHECKPOINT_PREFIX}/{name}.json"
+
+def load_checkpoint(name):
+    """Stored state of a checkpoint, or None if there is none."""
+    client = get_minio_client()
+    try:
+        response = client.get_object(CHECKPOINT_BUCKET, _checkpoint_object(name))
+        try:
+            return json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return None
+
+class Checkpoint:
+    """Progress of one stage over one set of inputs; thread-safe, persisted on every commit."""
+
+    def __init__(self, name, inputs, force=False):
+        self.name = name
+        self._lock = threading.Lock()
+        state = None if force else load_checkpoint(name)
+        if state is None or state.get('inputs') != inputs:
+            # Entradas nuevas (o --force): lo comprometido en ejecuciones anteriores ya no vale
+            state = {
+                'name': name,
+                'inputs': inputs,
+                'status': 'running',
+                'started_at': datetime.datetime.now().isoformat(),
+                'steps': {}
+            }
+        self.state = state
+
+    @property
+    def done(self):
+        return self.state['status'] == 'done'
+
+    def completed_steps(self):
+        return set(self.state['steps'])
+
+    def commit_step(self, step, rows=None, **details):
+        """Record a committed step (and persist the checkpoint)."""
+        with self._lock:
+            self.state['steps'][step] = dict(details, committed_at=datetime.datetime.now().isoformat(), rows=rows)
+            self._save()
+
+    def complete(self, rows=None, outputs=None):
+        """Mark the whole stage as committed."""
+        with self._lock:
+            self.state.update({
+                'status': 'done',
+                'completed_at': datetime.datetime.now().isoformat(),
+                'rows': rows,
+                'outputs': outputs
+            })
+            self._save()
+
+    def _save(self):
+        client = get_minio_client()
+        if not client.bucket_exists(CHECKPOINT_BUCKET):
+            client.make_bucket(CHECKPOINT_BUCKET)
+        data = json.dumps(self.state, default=str).encode('utf-8')
+        client.put_object(CHECKPOINT_BUCKET, _checkpoint_object(self.name), io.BytesIO(data), length=len(data),
+                          content_type='application/json')
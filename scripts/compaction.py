@@ -0,0 +1,368 @@
+"""
+Small-file compaction of the lake.
+
+Append-style writers leave many small objects behind, and listing and reading them
+dominates scan time. The compaction job merges them into right-sized files
+(``COMPACTION_TARGET_BYTES``), sorted while merging so that the per-file statistics stay
+selective:
+
+- tables (``tables``): the small live data files are rewritten and committed as a
+  ``replace`` snapshot that swaps exactly those files, so readers switch atomically and
+  files appended in the meantime are kept;
+- hive partitions (``quality-history/fecha=.../dataset=.../``): the small files of each
+  partition are merged into one ``compacted_<id>.parquet`` in the same partition;
+- governance documents (``metadata/``, ``lineage/``, ``quality/``): the JSON objects of each
+  prefix are packed, with the ETag they had, into JSON-lines packs under ``_compacted/<prefix>``.
+  ``utils.fetch_prefix_documents`` reads the packs plus the loose objects that changed since.
+
+Objects replaced in partitions and prefixes are not deleted straight away: they are
+deleted by a later run once ``COMPACTION_GRACE_SECONDS`` have passed (and only if unchanged),
+so a reader that listed them before the swap can still read them. Readers of partitions
+drop the duplicate rows they may see in the meantime.
+
+Runs are incremental: ``govern-zone-metadata/_compacted/_state.json`` keeps the sequence
+of each table and the objects already packed, so only the tables, partitions and prefixes
+that have grown since the last compaction are read and rewritten. Every rewrite is recorded
+in the lineage.
+
+    python compaction.py
+    python compaction.py --grace 0 --min-files 2
+"""
+from utils import (COMPACTED_PREFIX, batched_index_updates, fetch_objects, get_minio_client, log_data_transformation,
+                   packs_prefix, parse_json, read_pack)
+from tables import (CommitConflict, commit_snapshot, data_file_entry, data_file_name, load_pointer, load_snapshot,
+                    new_snapshot_id, table_root)
+from column_stats import table_statistics
+from metrics import timed
+import pyarrow as pa
+import pyarrow.parquet as pq
+import io
+import os
+import json
+import argparse
+import datetime
+from minio.deleteobjects import DeleteObject
+
+TARGET_FILE_BYTES = int(os.environ.get('COMPACTION_TARGET_BYTES', str(128 * 1024 * 1024)))
+COMPACTION_GRACE_SECONDS = float(os.environ.get('COMPACTION_GRACE_SECONDS', '3600'))
+# Un fichero es pequeño por debajo de una cuarta parte del tamaño objetivo
+SMALL_FILE_RATIO = 0.25
+MIN_SMALL_FILES = 4
+
+STATE_BUCKET = 'govern-zone-metadata'
+STATE_OBJECT = f'{COMPACTED_PREFIX}/_state.json'
+
+# Orden de los ficheros compactados de cada tabla: las columnas por las que se filtra
+SORT_KEYS = {
+    ('process-zone', 'parkings/cleaned_parking_rotation.parquet'): ['fecha', 'hora', 'aparcamiento_id'],
+    ('raw-ingestion-zone', 'aparcamiento/parkings_stream.parquet'): ['fecha', 'hora', 'aparcamiento_id', 'lote'],
+    ('process-zone', 'trafico/cleaned_traffic.parquet'): ['fecha', 'hora', 'sensor_id'],
+    ('process-zone', 'bicimad/cleaned_bicimad.parquet'): ['fecha', 'hora'],
+    ('access-zone', 'trafico/cleaned_traffic.parquet'): ['fecha', 'hora', 'sensor_id'],
+    ('access-zone', 'facts/ocupacion_parkings.parquet'): ['date_time_id', 'aparcamiento_id'],
+    ('access-zone', 'facts/usos_bicimad.parquet'): ['tipo_usuario_id'],
+}
+# Datasets particionados: bucket -> (prefijo, columnas de orden)
+PARTITIONED_PREFIXES = [
+    ('govern-zone-metadata', 'quality-history/', ['timestamp']),
+]
+# Prefijos de documentos JSON de gobierno
+DOCUMENT_PREFIXES = [
+    ('govern-zone-metadata', 'metadata/'),
+    ('govern-zone-metadata', 'lineage/'),
+    ('govern-zone-metadata', 'quality/'),
+]
+
+def plan_bins(entries, target_bytes=None):
+    """Group the small files of a snapshot into bins of at most ``target_bytes`` to rewrite together.
+
+    Bins with a single file are dropped: rewriting them alone gains nothing.
+    """
+    target_bytes = target_bytes or TARGET_FILE_BYTES
+    small = sorted((entry for entry in entries if (entry['bytes'] or 0) < target_bytes * SMALL_FILE_RATIO),
+                   key=lambda entry: entry['path'])
+    bins, current, size = [], [], 0
+    for entry in small:
+        if current and size + (entry['bytes'] or 0) > target_bytes:
+            bins.append(current)
+            current, size = [], 0
+        current.append(entry)
+        size += entry['bytes'] or 0
+    if current:
+        bins.append(current)
+    return [group for group in bins if len(group) > 1]
+
+def _read_table(client, bucket, object_name):
+    response = client.get_object(bucket, object_name)
+    try:
+        return pq.read_table(io.BytesIO(response.read()))
+    finally:
+        response.close()
+        response.release_conn()
+
+def _merge_files(client, bucket, object_names, sort_by):
+    """Read several Parquet files as one table sorted by the ``sort_by`` columns it has."""
+    table = pa.concat_tables([_read_table(client, bucket, object_name) for object_name in object_names],
+                             promote_options='default')
+    sort_keys = [(column, 'ascending') for column in sort_by or [] if column in table.column_names]
+    return table.sort_by(sort_keys) if sort_keys else table
+
+def _put_table(client, bucket, object_name, table):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    size = buffer.getbuffer().nbytes
+    buffer.seek(0)
+    client.put_object(bucket, object_name, buffer, length=size, content_type='application/octet-stream')
+    return size
+
+def compact_table(bucket, name, sort_by=None, target_bytes=None, min_files=MIN_SMALL_FILES):
+    """Rewrite the small files of table ``name`` into right-sized sorted files.
+
+    ``sort_by`` defaults to the table's entry in ``SORT_KEYS``. Does nothing (returns None)
+    while fewer than ``min_files`` small files can be merged; otherwise returns the manifest
+    of the ``replace`` snapshot.
+    """
+    manifest = load_snapshot(bucket, name)
+    if manifest is None:
+        raise ValueError(f"{bucket}/{name} is not a table")
+    bins = plan_bins(manifest['files'], target_bytes)
+    if sum(len(group) for group in bins) < min_files:
+        return None
+
+    sort_by = sort_by if sort_by is not None else SORT_KEYS.get((bucket, name))
+    client = get_minio_client()
+    snapshot_id = new_snapshot_id()
+    files, replaced = [], []
+    try:
+        with timed('compaction_rewrite') as op:
+            for part, group in enumerate(bins):
+                table = _merge_files(client, bucket, [entry['path'] for entry in group], sort_by)
+                object_name = data_file_name(name, snapshot_id, part)
+                size = _put_table(client, bucket, object_name, table)
+                files.append(data_file_entry(object_name, table.num_rows, size, table_statistics(table)))
+                replaced += [entry['path'] for entry in group]
+                op.add(bytes=size, rows=table.num_rows)
+        compacted = commit_snapshot(bucket, name, snapshot_id, files, operation='replace', replaced=replaced,
+                                    summary={'rewritten_files': len(replaced)})
+    except CommitConflict:
+        # Los ficheros nuevos no llegan a ningún snapshot: se eliminan
+        for error in client.remove_objects(bucket, [DeleteObject(entry['path']) for entry in files]):
+            print(f"Error deleting {bucket}/{error.name}: {error.message}")
+        raise
+    print(f"Compacted {bucket}/{table_root(name)}: {len(replaced)} small files rewritten into {len(files)}")
+    try:
+        # Origen: el snapshot anterior (un arco de la tabla a sí misma sería un ciclo en el grafo)
+        log_data_transformation(
+            bucket, f"{table_root(name)}/_snapshots/{manifest['snapshot_id']}.json", bucket, name,
+            f"Compaction: {len(replaced)} small files rewritten into {len(files)}"
+            + (f" sorted by {', '.join(sort_by)}" if sort_by else ''),
+            target_snapshot=snapshot_id
+        )
+    except Exception as e:
+        print(f"Error logging the lineage of the compaction of {bucket}/{table_root(name)}: {e}")
+    return compacted
+
+# Estado de la compactación incremental y borrados diferidos
+def load_state(client=None):
+    client = client or get_minio_client()
+    try:
+        response = client.get_object(STATE_BUCKET, STATE_OBJECT)
+        try:
+            return json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return {'tables': {}, 'prefixes': {}, 'pending_deletes': []}
+
+def _save_state(client, state):
+    data = json.dumps(state, default=str).encode('utf-8')
+    if not client.bucket_exists(STATE_BUCKET):
+        client.make_bucket(STATE_BUCKET)
+    client.put_object(STATE_BUCKET, STATE_OBJECT, io.BytesIO(data), length=len(data), content_type='application/json')
+
+def _schedule_delete(state, bucket, objects, grace):
+    """Delete ``{object_name: etag}`` once ``grace`` seconds have passed, if still unchanged."""
+    after = (datetime.datetime.now() + datetime.timedelta(seconds=grace)).isoformat()
+    state['pending_deletes'] += [{'bucket': bucket, 'object': object_name, 'etag': etag, 'after': after}
+                                 for object_name, etag in objects.items()]
+
+def delete_expired(client, state):
+    """Delete the replaced objects whose grace period is over; returns how many were removed."""
+    now = datetime.datetime.now().isoformat()
+    due = [entry for entry in state['pending_deletes'] if entry['after'] <= now]
+    state['pending_deletes'] = [entry for entry in state['pending_deletes'] if entry['after'] > now]
+    by_bucket = {}
+    for entry in due:
+        try:
+            etag = client.stat_object(entry['bucket'], entry['object']).etag
+        except Exception:
+            continue
+        # Reescrito después de compactarse: la versión nueva se conserva
+        if etag == entry['etag']:
+            by_bucket.setdefault(entry['bucket'], []).append(entry['object'])
+    removed = 0
+    for bucket, object_names in by_bucket.items():
+        for error in client.remove_objects(bucket, [DeleteObject(object_name) for object_name in object_names]):
+            print(f"Error deleting {bucket}/{error.name}: {error.message}")
+            removed -= 1
+        removed += len(object_names)
+    return removed
+
+def _pending(state, bucket):
+    return {(entry['object'], entry['etag']) for entry in state['pending_deletes'] if entry['bucket'] == bucket}
+
+def _table_registry():
+    from run_pipeline import PROCESSED_OBJECTS
+    from lake_query import DATASETS
+    tables = list(PROCESSED_OBJECTS)
+    tables += [(bucket, path) for bucket, path in DATASETS.values() if not path.endswith('/')]
+    # Tablas que solo escriben otros procesos (p. ej. el archivo del stream de aparcamientos)
+    tables += list(SORT_KEYS)
+    return list(dict.fromkeys(tables))
+
+def compact_tables(state, min_files=MIN_SMALL_FILES):
+    """Compact the registered tables that have new snapshots since the last run."""
+    compacted = []
+    for bucket, name in _table_registry():
+        pointer = load_pointer(bucket, name)
+        key = f"{bucket}/{name}"
+        if pointer is None or state['tables'].get(key) == pointer['sequence']:
+            continue
+        try:
+            manifest = compact_table(bucket, name, min_files=min_files)
+        except Exception as e:
+            print(f"Error compacting {key}: {e}")
+            continue
+        state['tables'][key] = manifest['sequence'] if manifest else pointer['sequence']
+        if manifest:
+            compacted.append(key)
+    return compacted
+
+def compact_partitions(client, state, bucket, prefix, sort_by, grace, min_files=MIN_SMALL_FILES):
+    """Merge the small files of each hive partition under ``prefix`` that has grown since the last run."""
+    pending = _pending(state, bucket)
+    small_bytes = TARGET_FILE_BYTES * SMALL_FILE_RATIO
+    partitions = {}
+    # Un único listado: las particiones sin ficheros pequeños nuevos no se leen
+    for obj in client.list_objects(bucket, prefix=prefix, recursive=True):
+        if obj.object_name.endswith('.parquet') and (obj.object_name, obj.etag) not in pending \
+                and (obj.size or 0) < small_bytes:
+            partitions.setdefault(obj.object_name.rsplit('/', 1)[0] + '/', {})[obj.object_name] = obj.etag
+    compacted = []
+    for partition, objects in sorted(partitions.items()):
+        if len(objects) < min_files:
+            continue
+        with timed('compaction_rewrite') as op:
+            table = _merge_files(client, bucket, sorted(objects), sort_by)
+            object_name = f"{partition}compacted_{new_snapshot_id()}.parquet"
+            op.add(bytes=_put_table(client, bucket, object_name, table), rows=table.num_rows)
+        _schedule_delete(state, bucket, objects, grace)
+        try:
+            log_data_transformation(bucket, partition, bucket, object_name,
+                                    f"Compaction: {len(objects)} small files merged"
+                                    + (f" sorted by {', '.join(sort_by)}" if sort_by else ''))
+        except Exception as e:
+            print(f"Error logging the lineage of the compaction of {bucket}/{partition}: {e}")
+        print(f"Compacted {bucket}/{partition}: {len(objects)} small files merged into {object_name.rsplit('/', 1)[1]}")
+        compacted.append(partition)
+    return compacted
+
+def _write_packs(client, bucket, prefix, entries):
+    """Write ``entries`` as JSON-lines packs of at most ``TARGET_FILE_BYTES``; returns their names."""
+    pack_id = new_snapshot_id()
+    packs, lines, size = [], [], 0
+
+    def flush():
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        object_name = f"{packs_prefix(prefix)}pack-{pack_id}-{len(packs)}.jsonl"
+        client.put_object(bucket, object_name, io.BytesIO(data), length=len(data), content_type='application/x-ndjson')
+        packs.append(object_name)
+
+    for entry in sorted(entries, key=lambda entry: entry['object']):
+        line = json.dumps(entry, default=str)
+        if lines and size + len(line) > TARGET_FILE_BYTES:
+            flush()
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line) + 1
+    if lines:
+        flush()
+    return packs
+
+def compact_documents(client, state, bucket, prefix, grace, min_files=MIN_SMALL_FILES):
+    """Pack the JSON documents under ``prefix`` written since the last run, with the small packs."""
+    pending = _pending(state, bucket)
+    loose = {obj.object_name: obj.etag for obj in client.list_objects(bucket, prefix=prefix, recursive=True)
+             if obj.object_name.endswith('.json') and (obj.object_name, obj.etag) not in pending}
+    if len(loose) < min_files:
+        return 0
+
+    # Los packs pequeños se reescriben junto con los documentos nuevos
+    small_packs = {obj.object_name: obj.etag
+                   for obj in client.list_objects(bucket, prefix=packs_prefix(prefix), recursive=True)
+                   if (obj.object_name, obj.etag) not in pending and (obj.size or 0) < TARGET_FILE_BYTES * SMALL_FILE_RATIO}
+    with timed('compaction_rewrite') as op:
+        entries = {}
+        for pack in sorted(small_packs):
+            for entry in read_pack(client, bucket, pack):
+                entries[entry['object']] = entry
+        fetched = {}
+        for object_name, document, error in fetch_objects(bucket, sorted(loose), parse_json):
+            if error is not None:
+                print(f"Error reading {bucket}/{object_name} for compaction: {error}")
+                continue
+            entries[object_name] = {'object': object_name, 'etag': loose[object_name], 'document': document}
+            fetched[object_name] = loose[object_name]
+        if not fetched:
+            return 0
+        packs = _write_packs(client, bucket, prefix, entries.values())
+        op.add(rows=len(entries))
+    _schedule_delete(state, bucket, dict(fetched, **small_packs), grace)
+    state['prefixes'][f"{bucket}/{prefix}"] = {'compacted_at': datetime.datetime.now().isoformat(),
+                                               'documents': len(entries), 'packs': packs}
+    try:
+        log_data_transformation(bucket, prefix, bucket, packs_prefix(prefix),
+                                f"Compaction: {len(fetched)} documents packed into {len(packs)} packs "
+                                f"({len(entries)} documents in total)")
+    except Exception as e:
+        print(f"Error logging the lineage of the compaction of {bucket}/{prefix}: {e}")
+    print(f"Compacted {bucket}/{prefix}: {len(fetched)} documents packed ({len(packs)} packs, {len(entries)} documents)")
+    return len(fetched)
+
+def run_compaction(grace=COMPACTION_GRACE_SECONDS, min_files=MIN_SMALL_FILES):
+    """Compact the tables, partitions and document prefixes that have grown; returns a report."""
+    client = get_minio_client()
+    state = load_state(client)
+    report = {'deleted': delete_expired(client, state)}
+    report['tables'] = compact_tables(state, min_files)
+    report['partitions'] = []
+    for bucket, prefix, sort_by in PARTITIONED_PREFIXES:
+        try:
+            report['partitions'] += compact_partitions(client, state, bucket, prefix, sort_by, grace, min_files)
+        except Exception as e:
+            print(f"Error compacting the partitions of {bucket}/{prefix}: {e}")
+    report['documents'] = {}
+    for bucket, prefix in DOCUMENT_PREFIXES:
+        try:
+            report['documents'][prefix] = compact_documents(client, state, bucket, prefix, grace, min_files)
+        except Exception as e:
+            print(f"Error compacting the documents of {bucket}/{prefix}: {e}")
+    if grace <= 0:
+        # Sin periodo de gracia los objetos sustituidos se borran en esta misma ejecución
+        report['deleted'] += delete_expired(client, state)
+    state['last_run'] = datetime.datetime.now().isoformat()
+    _save_state(client, state)
+    print(f"Compaction complete: {len(report['tables'])} tables, {len(report['partitions'])} partitions, "
+          f"{sum(report['documents'].values())} documents packed, {report['deleted']} replaced objects deleted")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compact the small files of the data lake.')
+    parser.add_argument('--grace', type=float, default=COMPACTION_GRACE_SECONDS,
+                        help='seconds before replaced objects are deleted')
+    parser.add_argument('--min-files', type=int, default=MIN_SMALL_FILES,
+                        help='small files needed to compact a table, partition or prefix')
+    args = parser.parse_args()
+    with batched_index_updates():
+        run_compaction(args.grace, args.min_files)
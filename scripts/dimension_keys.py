@@ -0,0 +1,186 @@
+"""
+Surrogate-key service for the data warehouse dimensions.
+
+Keeps the natural key -> surrogate key map of each dimension cached on local disk and
+versioned against the warehouse (table OID, highest id and row count), so each run only
+fetches the members added since the cached version. Whole columns are resolved at once with a
+vectorized index lookup, and members that are not in the dimension yet are inserted
+inline (``ON CONFLICT DO NOTHING`` on the UNIQUE natural key) in the transaction of the task
+that needs them, instead of failing the fact load.
+"""
+from psycopg2.extras import execute_values
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+import threading
+
+DIMENSION_KEY_CACHE_DIR = os.environ.get(
+    'DIMENSION_KEY_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'dimension_keys')
+)
+
+class DimensionKeyCache:
+    """Natural-to-surrogate key map of one dimension table."""
+
+    def __init__(self, table, natural_key, member_builder=None, columns=None, cache_dir=None):
+        self.table = table
+        self.natural_key = natural_key
+        # Columnas a insertar para un miembro nuevo y función que calcula sus valores
+        self.columns = columns or [natural_key]
+        self.member_builder = member_builder or (lambda value: (value,))
+        self.cache_dir = cache_dir or DIMENSION_KEY_CACHE_DIR
+        self.keys = pd.Series(dtype='int64')
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _normalize(self, values):
+        values = pd.Series(values)
+        if pd.api.types.infer_dtype(values, skipna=True) in ('datetime', 'datetime64'):
+            return pd.to_datetime(values)
+        return values
+
+    def _add_keys(self, natural_values, ids):
+        new_keys = pd.Series(pd.Series(ids).to_numpy(), index=pd.Index(self._normalize(natural_values)))
+        keys = new_keys if self.keys.empty else pd.concat([self.keys, new_keys])
+        # Si el miembro aparece repetido nos quedamos con el primer id
+        self.keys = keys[~keys.index.duplicated(keep='first')]
+
+    def _cache_paths(self, conn):
+        params = conn.get_dsn_parameters()
+        warehouse = hashlib.sha256(
+            f"{params.get('host')}:{params.get('port')}/{params.get('dbname')}".encode('utf-8')
+        ).hexdigest()[:12]
+        base = os.path.join(self.cache_dir, warehouse, self.table)
+        return f"{base}.parquet", f"{base}.json"
+
+    def _save(self, conn):
+        keys_path, version_path = self._cache_paths(conn)
+        os.makedirs(os.path.dirname(keys_path), exist_ok=True)
+        pd.DataFrame({self.natural_key: self.keys.index, 'id': self.keys.values}).to_parquet(keys_path, index=False)
+        with open(version_path, 'w') as f:
+            json.dump(self.version, f)
+
+    def _reset(self, table_oid):
+        self.keys = pd.Series(dtype='int64')
+        self.version = {'oid': table_oid, 'max_id': 0, 'rows': 0}
+
+    def _fetch_since(self, conn, min_id):
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {self.natural_key}, id FROM {self.table} WHERE id > %s ORDER BY id", (min_id,))
+            return cur.fetchall()
+
+    def refresh(self, conn):
+        """Bring the cached map up to date with the warehouse, fetching only new members."""
+        keys_path, version_path = self._cache_paths(conn)
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT '{self.table}'::regclass::oid::bigint, COALESCE(MAX(id), 0), COUNT(*) FROM {self.table}")
+            table_oid, max_id, row_count = cur.fetchone()
+
+        if self.version is None and os.path.exists(keys_path) and os.path.exists(version_path):
+            with open(version_path) as f:
+                self.version = json.load(f)
+            cached = pd.read_parquet(keys_path)
+            self._add_keys(cached[self.natural_key], cached['id'])
+
+        # Tabla recreada o con filas borradas: la caché ya no es válida
+        if (self.version is None or 'rows' not in self.version or self.version['oid'] != table_oid
+                or self.version['max_id'] > max_id or self.version['rows'] > row_count):
+            self._reset(table_oid)
+
+        rows = self._fetch_since(conn, self.version['max_id']) if max_id > self.version['max_id'] else []
+        if self.version['rows'] + len(rows) != row_count:
+            # Filas borradas y otras nuevas después (p. ej. TRUNCATE sin RESTART IDENTITY):
+            # los miembros en caché no cuadran con el recuento, se recarga la dimensión entera
+            print(f"{self.table}: key cache out of sync with the warehouse, reloading it")
+            self._reset(table_oid)
+            rows = self._fetch_since(conn, 0)
+
+        if rows:
+            new_keys = pd.DataFrame(rows, columns=[self.natural_key, 'id'])
+            self._add_keys(new_keys[self.natural_key], new_keys['id'])
+            self.version['max_id'] = max(self.version['max_id'], int(new_keys['id'].max()))
+            self.version['rows'] += len(rows)
+            self._save(conn)
+            print(f"{self.table}: {len(rows)} new members fetched into the key cache")
+        return self
+
+    def ensure(self, conn, values):
+        """Insert the members of ``values`` missing from the dimension; returns how many this call added.
+
+        The rows go into the transaction of ``conn``: the task that loads them commits them.
+        """
+        with self._lock:
+            self.refresh(conn)
+            uniques = pd.Series(pd.unique(self._normalize(values).dropna()))
+            missing = uniques[self.keys.index.get_indexer(uniques) < 0]
+            if missing.empty:
+                return 0
+
+            columns = ', '.join(self.columns)
+            with conn.cursor() as cur:
+                # Otra tarea u otro proceso puede estar insertando el mismo miembro: la restricción
+                # UNIQUE de la clave natural lo impide y el id del suyo se lee después
+                rows = execute_values(
+                    cur,
+                    f"INSERT INTO {self.table} ({columns}) VALUES %s "
+                    f"ON CONFLICT ({self.natural_key}) DO NOTHING RETURNING {self.natural_key}, id",
+                    [self.member_builder(value) for value in missing],
+                    fetch=True
+                )
+                inserted = pd.DataFrame(rows, columns=[self.natural_key, 'id'])
+                conflicts = missing[~missing.isin(self._normalize(inserted[self.natural_key]))]
+                existing = []
+                if not conflicts.empty:
+                    cur.execute(f"SELECT {self.natural_key}, id FROM {self.table} WHERE {self.natural_key} = ANY(%s)",
+                                (list(conflicts),))
+                    existing = cur.fetchall()
+            if not inserted.empty:
+                self._add_keys(inserted[self.natural_key], inserted['id'])
+                self.version['max_id'] = max(self.version['max_id'], int(inserted['id'].max()))
+                self.version['rows'] += len(inserted)
+                print(f"{self.table}: {len(inserted)} late-arriving members inserted")
+            if existing:
+                existing = pd.DataFrame(existing, columns=[self.natural_key, 'id'])
+                self._add_keys(existing[self.natural_key], existing['id'])
+            # La caché en disco no se guarda aquí: solo refresh persiste miembros ya confirmados
+            return len(inserted)
+
+    def resolve(self, conn, values):
+        """Return the surrogate keys for a whole column, inserting unseen members first.
+
+        Null natural keys resolve to None (NULL in the warehouse).
+        """
+        self.ensure(conn, values)
+        values = self._normalize(values)
+        positions = self.keys.index.get_indexer(values)
+        # get_indexer devuelve -1 para los nulos: sin la máscara tomarían la última clave
+        found = positions >= 0
+        ids = np.full(len(positions), None, dtype=object)
+        ids[found] = self.keys.to_numpy()[positions[found]]
+        return pd.Series(ids, index=values.index, dtype=object)
+
+def date_time_member(fecha_hora):
+    """Attributes of a ``dim_date_time`` member derived from its timestamp."""
+    dt = pd.Timestamp(fecha_hora)
+    return (
+        dt.to_pydatetime(),
+        dt.date(),
+        dt.hour,
+        dt.day_name(),
+        dt.dayofweek,
+        False,  # es_festivo se establece como False por falta de datos
+        dt.month,
+        (dt.month - 1) // 3 + 1,
+        dt.year
+    )
+
+# Servicios de claves de las dimensiones con clave subrogada (SERIAL)
+TIPOS_USUARIO_KEYS = DimensionKeyCache('dim_tipos_usuario', 'tipo_usuario')
+TIPOS_ESTACION_KEYS = DimensionKeyCache('dim_tipos_estacion', 'tipo_estacion')
+DATE_TIME_KEYS = DimensionKeyCache(
+    'dim_date_time', 'fecha_hora',
+    member_builder=date_time_member,
+    columns=['fecha_hora', 'fecha', 'hora', 'dia_semana', 'numero_dia_semana', 'es_festivo', 'mes', 'trimestre', 'año']
+)
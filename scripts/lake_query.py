@@ -0,0 +1,224 @@
+"""
+In-process query layer over the access-zone Parquet datasets.
+
+Datasets are opened as pyarrow datasets directly on MinIO (S3 API), so only the requested
+columns, the matching hive partitions and the row groups whose statistics can satisfy the
+filter are read. Files whose column statistics in the metadata catalog rule the filter out
+are dropped before the scan, so their data is never fetched. Grouped aggregations (including mode and t-digest percentiles) run in Arrow's
+vectorized engine, and SQL queries run in DuckDB over the same datasets. Neither path
+needs the Trino service.
+
+Datasets stored as tables (``tables``) are read from the files of one snapshot, the current
+one or an older one (``snapshot_id``/``as_of``), so a scan never mixes files of two writes.
+"""
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from tables import load_snapshot
+import storage
+import re
+
+# Datasets de la access zone: nombre -> (bucket, ruta del objeto o prefijo)
+DATASETS = {
+    'trafico': ('access-zone', 'trafico/cleaned_traffic.parquet'),
+    'dim_distritos': ('access-zone', 'dimensions/distritos.parquet'),
+    'dim_tipos_usuario': ('access-zone', 'dimensions/tipos_usuario.parquet'),
+    'dim_tipos_estacion': ('access-zone', 'dimensions/tipos_estacion.parquet'),
+    'dim_aparcamientos': ('access-zone', 'dimensions/aparcamientos.parquet'),
+    'dim_date_time': ('access-zone', 'dimensions/date_time.parquet'),
+    'fact_usos_bicimad': ('access-zone', 'facts/usos_bicimad.parquet'),
+    'fact_infraestructura': ('access-zone', 'facts/infraestructura.parquet'),
+    'fact_ocupacion_parkings': ('access-zone', 'facts/ocupacion_parkings.parquet'),
+    'rollup_trafico_hora': ('access-zone', 'rollups/trafico/hora/'),
+    'rollup_trafico_sensor_hora': ('access-zone', 'rollups/trafico/sensor_hora/'),
+    'rollup_ocupacion_distrito_hora': ('access-zone', 'rollups/ocupacion_parkings/distrito_hora/'),
+    'rollup_ocupacion_aparcamiento_hora': ('access-zone', 'rollups/ocupacion_parkings/aparcamiento_hora/'),
+    'rollup_usos_tipo_usuario': ('access-zone', 'rollups/usos_bicimad/tipo_usuario/'),
+    'rollup_usos_tipo_usuario_estacion': ('access-zone', 'rollups/usos_bicimad/tipo_usuario_estacion/'),
+}
+
+def get_lake_filesystem():
+    """Return a pyarrow filesystem pointing at the data lake (MinIO or the configured storage backend)."""
+    return storage.get_lake_filesystem()
+
+def dataset_location(name):
+    """Return ``(bucket, object or prefix)`` of a registered dataset or a ``bucket/path`` string."""
+    if name in DATASETS:
+        return DATASETS[name]
+    bucket, _, path = name.partition('/')
+    return bucket, path
+
+def referenced_datasets(query):
+    """Names of the registered datasets referenced in a SQL query."""
+    return [name for name in DATASETS if re.search(rf'\b{name}\b', query)]
+
+def table_snapshot(name, snapshot_id=None, as_of=None):
+    """Manifest of the snapshot to read if the dataset is a table (None for plain objects and prefixes)."""
+    bucket, path = dataset_location(name)
+    manifest = None if path.endswith('/') else load_snapshot(bucket, path, snapshot_id, as_of)
+    if manifest is None and (snapshot_id is not None or as_of is not None):
+        raise ValueError(f"{name} is not a table: no snapshots to read")
+    return manifest
+
+def open_dataset(name, filesystem=None, snapshot_id=None, as_of=None, manifest=None):
+    """Open a registered access-zone dataset (or a ``bucket/path``) as a lazy pyarrow dataset.
+
+    Tables open the data files listed in the manifest of their current snapshot (or of
+    ``snapshot_id``/``as_of``) instead of listing the bucket.
+    """
+    bucket, path = dataset_location(name)
+    filesystem = filesystem or get_lake_filesystem()
+    manifest = manifest or table_snapshot(name, snapshot_id, as_of)
+    if manifest is not None:
+        return ds.dataset([f"{bucket}/{entry['path']}" for entry in manifest['files']],
+                          filesystem=filesystem, format='parquet')
+    source = f"{bucket}/{path}".rstrip('/')
+    try:
+        return ds.dataset(source, filesystem=filesystem, format='parquet', partitioning='hive')
+    except pa.ArrowTypeError:
+        # La columna de partición también está dentro de los ficheros con otro tipo de texto
+        # (large_string de pandas frente a string de la ruta): manda el esquema de los ficheros
+        file_schema = ds.dataset(source, filesystem=filesystem, format='parquet').schema
+        return ds.dataset(source, filesystem=filesystem, format='parquet', partitioning='hive', schema=file_schema)
+
+def _parse_filter(filters):
+    """Build a pyarrow expression from ``[(column, op, value), ...]`` tuples."""
+    if filters is None or isinstance(filters, ds.Expression):
+        return filters
+    operators = {
+        '==': lambda f, v: f == v, '=': lambda f, v: f == v, '!=': lambda f, v: f != v,
+        '<': lambda f, v: f < v, '<=': lambda f, v: f <= v,
+        '>': lambda f, v: f > v, '>=': lambda f, v: f >= v,
+        'in': lambda f, v: f.isin(v), 'not in': lambda f, v: ~f.isin(v),
+    }
+    expression = None
+    for column, op, value in filters:
+        term = operators[op](ds.field(column), value)
+        expression = term if expression is None else expression & term
+    return expression
+
+def excluded_files(name, filters):
+    """Paths (``bucket/object``) of the files that the catalog statistics prove cannot match ``filters``."""
+    if not filters or isinstance(filters, ds.Expression):
+        return set()
+    try:
+        from catalog import file_statistics
+        from column_stats import can_match
+        bucket, path = dataset_location(name)
+        statistics = file_statistics(bucket, path)
+    except Exception as e:
+        print(f"Column statistics unavailable for {name}: {e}")
+        return set()
+    return {f"{bucket}/{object_name}" for object_name, stats in statistics.items() if not can_match(stats, filters)}
+
+def _excluded_table_files(name, manifest, filters):
+    """Data files of a table snapshot whose statistics in the manifest cannot match ``filters``."""
+    if not filters or isinstance(filters, ds.Expression):
+        return set()
+    from column_stats import can_match
+    bucket, _ = dataset_location(name)
+    return {f"{bucket}/{entry['path']}" for entry in manifest['files']
+            if entry.get('column_stats') and not can_match(entry['column_stats'], filters)}
+
+def scan(name, columns=None, filters=None, filesystem=None, snapshot_id=None, as_of=None):
+    """Read a dataset with column projection and filter pushdown; returns a pyarrow Table.
+
+    For tables, ``snapshot_id`` or ``as_of`` read an older snapshot (time travel).
+    """
+    manifest = table_snapshot(name, snapshot_id, as_of)
+    dataset = open_dataset(name, filesystem, manifest=manifest)
+    if manifest is not None:
+        excluded = _excluded_table_files(name, manifest, filters)
+    else:
+        excluded = excluded_files(name, filters)
+    if excluded:
+        # Salto de datos: los ficheros descartados por sus estadísticas no se leen
+        fragments = [fragment for fragment in dataset.get_fragments() if fragment.path not in excluded]
+        dataset = ds.FileSystemDataset(fragments, dataset.schema, dataset.format, dataset.filesystem)
+    return dataset.to_table(columns=columns, filter=_parse_filter(filters))
+
+def _mode(table, by, column):
+    """Most frequent value of ``column`` per group (ties resolved by value order)."""
+    counts = table.group_by(by + [column]).aggregate([(column, 'count')])
+    counts = counts.filter(pc.is_valid(counts[column]))
+    order = [(key, 'ascending') for key in by] + [(f'{column}_count', 'descending'), (column, 'ascending')]
+    counts = counts.sort_by(order)
+    # La primera fila de cada grupo tras ordenar es la moda
+    if by:
+        keys = pa.Table.from_arrays([counts[key] for key in by], names=by).to_pandas()
+        first = ~keys.duplicated().to_numpy()
+    else:
+        first = [index == 0 for index in range(counts.num_rows)]
+    return counts.filter(pa.array(first)).select(by + [column])
+
+def _aggregate_column(table, column, function, options=None):
+    """Ungrouped aggregate of one column, as a one-row array."""
+    value = getattr(pc, function)(table[column], options=options)
+    # tdigest devuelve un array (un valor por cuantil), el resto de funciones un escalar
+    return pa.array([value.to_pylist() if isinstance(value, pa.Array) else value.as_py()])
+
+def aggregate(name, by, aggregations, filters=None, filesystem=None):
+    """Grouped aggregation over a lake dataset, dataframe style.
+
+    ``aggregations`` maps an output column to ``(column, function)``, where function is one
+    of ``sum``, ``mean``, ``min``, ``max``, ``count``, ``count_distinct``, ``mode`` or
+    ``('quantile', q)`` (t-digest estimate). Only the columns involved are read from the lake. Returns a
+    pandas DataFrame.
+    """
+    by = list(by)
+    columns = sorted(set(by) | {column for column, _ in aggregations.values()})
+    table = scan(name, columns=columns, filters=filters, filesystem=filesystem)
+
+    arrow_aggregations = []
+    outputs = []
+    modes = {}
+    for output, (column, function) in aggregations.items():
+        if function == 'mode':
+            modes[output] = column
+        elif isinstance(function, tuple) and function[0] == 'quantile':
+            arrow_aggregations.append((column, 'tdigest', pc.TDigestOptions(q=function[1])))
+            outputs.append(output)
+        else:
+            arrow_aggregations.append((column, function))
+            outputs.append(output)
+
+    # Los agregados se toman por posición: Arrow llama igual (columna_función) a dos salidas
+    # con la misma columna y función, o a dos cuantiles de la misma columna
+    if by:
+        grouped = table.group_by(by).aggregate(arrow_aggregations)
+        # Según la versión de pyarrow las claves van antes o después de los agregados
+        keys_first = grouped.column_names[:len(by)] == by
+        key_start, value_start = (0, len(by)) if keys_first else (len(arrow_aggregations), 0)
+        arrays = [grouped.column(key_start + i) for i in range(len(by))] + \
+            [grouped.column(value_start + i) for i in range(len(arrow_aggregations))]
+    else:
+        arrays = [_aggregate_column(table, column, function, *options)
+                  for column, function, *options in arrow_aggregations]
+    result = pa.Table.from_arrays(arrays, names=by + outputs)
+    df = result.to_pandas()
+
+    # Los cuantiles vienen como listas de un elemento (tdigest)
+    for output, (column, function) in aggregations.items():
+        if isinstance(function, tuple):
+            df[output] = df[output].str[0]
+
+    for output, column in modes.items():
+        mode_df = _mode(table, by, column).to_pandas().rename(columns={column: output})
+        df = df.merge(mode_df, on=by, how='left') if by else df.assign(**{output: mode_df[output].iloc[0]})
+    return df
+
+def sql(query, filesystem=None):
+    """Run a SQL query over the registered datasets with DuckDB.
+
+    Every registered dataset referenced in the query is exposed as a view over the lazy
+    pyarrow dataset, so DuckDB pushes column projections and filters down to the lake reads.
+    """
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError("SQL queries over the lake require the 'duckdb' package (pip install duckdb)")
+
+    con = duckdb.connect()
+    for name in referenced_datasets(query):
+        con.register(name, open_dataset(name, filesystem))
+    return con.execute(query).df()
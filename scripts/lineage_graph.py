@@ -0,0 +1,243 @@
+"""
+Persisted lineage graph index for the govern zone.
+
+Every lineage record written by ``log_data_transformation`` is folded into a single JSON
+document, ``govern-zone-metadata/catalog/lineage_graph.json``, holding the edges and the
+adjacency lists in both directions. Nodes are ``bucket/object`` strings and transformations
+with several inputs become one edge per source; nodes whose data was removed by the retention
+engine keep their edges and carry a tombstone. Once loaded, upstream and downstream
+traversals, impact analysis and cycle detection run entirely in memory.
+
+Records are folded in batches (``utils.batched_index_updates`` collects the records of a
+stage): one read, one write and one cycle check per batch, under a lease,
+``catalog/_lineage_graph.lease``, shared by every process that writes the graph. A missing
+graph is rebuilt from ``lineage/`` before the batch is added.
+"""
+from utils import fetch_prefix_documents, get_minio_client
+from storage import object_lease
+from metrics import timed
+from collections import deque
+import io
+import json
+import threading
+
+LINEAGE_BUCKET = 'govern-zone-metadata'
+LINEAGE_GRAPH_OBJECT = 'catalog/lineage_graph.json'
+LINEAGE_GRAPH_LEASE = 'catalog/_lineage_graph.lease'
+
+_lock = threading.Lock()
+
+def node_id(bucket, object_name):
+    return f"{bucket}/{object_name}"
+
+def lineage_sources(lineage):
+    """All ``{'bucket', 'object'}`` sources of a lineage record."""
+    if lineage.get('sources'):
+        return lineage['sources']
+    if lineage.get('source') in (None, 'multiple'):
+        return []
+    return [lineage['source']]
+
+class LineageGraph:
+    """Lineage edges with upstream and downstream adjacency lists."""
+
+    def __init__(self, edges=None):
+        self.edges = {}
+        self.upstream = {}
+        self.downstream = {}
+        self.tombstones = {}
+        for edge in (edges or {}).values():
+            self._add_edge(edge)
+
+    def _add_edge(self, edge):
+        source = node_id(edge['source']['bucket'], edge['source']['object'])
+        target = node_id(edge['target']['bucket'], edge['target']['object'])
+        self.edges[f"{source} -> {target}"] = edge
+        self.upstream.setdefault(target, [])
+        self.downstream.setdefault(source, [])
+        if source not in self.upstream[target]:
+            self.upstream[target].append(source)
+        if target not in self.downstream[source]:
+            self.downstream[source].append(target)
+
+    def add_lineage(self, lineage, lineage_object=None):
+        """Add (or refresh) the edges of one lineage record."""
+        for source in lineage_sources(lineage):
+            self._add_edge({
+                'source': {'bucket': source['bucket'], 'object': source['object']},
+                'target': lineage['target'],
+                'transformation': lineage.get('transformation'),
+                'timestamp': lineage.get('timestamp'),
+                'lineage_object': lineage_object
+            })
+
+    def mark_deleted(self, bucket, object_name, deleted_at, reason):
+        """Tombstone a node whose data was deleted; returns False if it is not in the graph."""
+        node = node_id(bucket, object_name)
+        if node not in self.upstream and node not in self.downstream:
+            return False
+        self.tombstones[node] = {'deleted_at': deleted_at, 'reason': reason}
+        return True
+
+    def is_deleted(self, bucket, object_name):
+        return node_id(bucket, object_name) in self.tombstones
+
+    def _traverse(self, start, adjacency, max_depth=None):
+        """Breadth-first edges reachable from ``start`` following ``adjacency`` (each edge once)."""
+        edges = []
+        seen = {start}
+        queue = deque([(start, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for neighbour in adjacency.get(node, []):
+                key = f"{neighbour} -> {node}" if adjacency is self.upstream else f"{node} -> {neighbour}"
+                edges.append(dict(self.edges[key], depth=depth + 1))
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append((neighbour, depth + 1))
+        return edges
+
+    def upstream_of(self, bucket, object_name, max_depth=None):
+        """Edges leading to a dataset, nearest first, across every source."""
+        return self._traverse(node_id(bucket, object_name), self.upstream, max_depth)
+
+    def downstream_of(self, bucket, object_name, max_depth=None):
+        """Edges derived from a dataset, nearest first."""
+        return self._traverse(node_id(bucket, object_name), self.downstream, max_depth)
+
+    def impact(self, bucket, object_name):
+        """Every dataset affected (directly or transitively) by a change in ``bucket/object_name``."""
+        targets = {node_id(e['target']['bucket'], e['target']['object']) for e in self.downstream_of(bucket, object_name)}
+        return sorted(targets)
+
+    def origins(self, bucket, object_name):
+        """Root datasets (without recorded sources) a dataset ultimately comes from."""
+        sources = {node_id(e['source']['bucket'], e['source']['object']) for e in self.upstream_of(bucket, object_name)}
+        return sorted(node for node in sources if not self.upstream.get(node))
+
+    def find_cycles(self):
+        """Return the cycles of the graph, each as a list of nodes (empty if it is a DAG)."""
+        WHITE, GREY, BLACK = 0, 1, 2
+        color = {}
+        cycles = []
+        for root in sorted(self.downstream):
+            if color.get(root, WHITE) != WHITE:
+                continue
+            # DFS iterativa: la pila guarda el nodo y el iterador de sus sucesores
+            path = [root]
+            color[root] = GREY
+            stack = [(root, iter(self.downstream.get(root, [])))]
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    color[node] = BLACK
+                    stack.pop()
+                    path.pop()
+                elif color.get(child, WHITE) == GREY:
+                    cycles.append(path[path.index(child):] + [child])
+                elif color.get(child, WHITE) == WHITE:
+                    color[child] = GREY
+                    path.append(child)
+                    stack.append((child, iter(self.downstream.get(child, []))))
+        return cycles
+
+    def to_json(self):
+        return json.dumps({'edges': self.edges, 'upstream': self.upstream, 'downstream': self.downstream,
+                           'tombstones': self.tombstones})
+
+    @classmethod
+    def from_json(cls, data):
+        state = json.loads(data)
+        graph = cls()
+        graph.edges = state['edges']
+        graph.upstream = state['upstream']
+        graph.downstream = state['downstream']
+        graph.tombstones = state.get('tombstones', {})
+        return graph
+
+def load_lineage_graph(client=None):
+    """Load the lineage graph index (one GET); returns None if it has not been built yet."""
+    client = client or get_minio_client()
+    try:
+        response = client.get_object(LINEAGE_BUCKET, LINEAGE_GRAPH_OBJECT)
+        try:
+            return LineageGraph.from_json(response.read().decode('utf-8'))
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return None
+
+def _save_lineage_graph(client, graph):
+    data = graph.to_json().encode('utf-8')
+    with timed('lineage_graph_write') as op:
+        client.put_object(LINEAGE_BUCKET, LINEAGE_GRAPH_OBJECT, io.BytesIO(data), length=len(data),
+                          content_type='application/json')
+        op.add(bytes=len(data))
+
+def _scan_lineage_graph(client):
+    graph = LineageGraph()
+    # Las lápidas no están en los registros de linaje: se conservan las del índice anterior
+    previous = load_lineage_graph(client)
+    if previous is not None:
+        graph.tombstones = previous.tombstones
+    # Registros compactados en packs más los escritos después de la última compactación
+    for object_name, lineage, error in fetch_prefix_documents(LINEAGE_BUCKET, 'lineage/'):
+        if error is not None:
+            print(f"Error reading lineage for {object_name}: {error}")
+            continue
+        graph.add_lineage(lineage, object_name)
+    return graph
+
+def _ensure_bucket(client):
+    if not client.bucket_exists(LINEAGE_BUCKET):
+        client.make_bucket(LINEAGE_BUCKET)
+
+def add_lineage_records(records):
+    """Fold ``(lineage, lineage_object)`` records into the persisted graph index with a single write."""
+    if not records:
+        return
+    client = get_minio_client()
+    _ensure_bucket(client)
+    with _lock, object_lease(client, LINEAGE_BUCKET, LINEAGE_GRAPH_LEASE):
+        graph = load_lineage_graph(client)
+        if graph is None:
+            # Sin índice (primera ejecución o borrado): se reconstruye para no perder los registros ya escritos
+            graph = _scan_lineage_graph(client)
+            print(f"Lineage graph missing, rebuilt with {len(graph.edges)} edges")
+        for lineage, lineage_object in records:
+            graph.add_lineage(lineage, lineage_object)
+        _save_lineage_graph(client, graph)
+    cycles = graph.find_cycles()
+    if cycles:
+        print(f"Warning: lineage graph contains cycles: {cycles}")
+
+def update_lineage_graph(lineage, lineage_object=None):
+    """Fold one lineage record into the persisted graph index."""
+    add_lineage_records([(lineage, lineage_object)])
+
+def tombstone_lineage(deleted, deleted_at, reason):
+    """Tombstone the graph nodes of the deleted ``(bucket, object)`` pairs; returns how many were marked."""
+    client = get_minio_client()
+    _ensure_bucket(client)
+    with _lock, object_lease(client, LINEAGE_BUCKET, LINEAGE_GRAPH_LEASE):
+        graph = load_lineage_graph(client)
+        if graph is None:
+            return 0
+        marked = sum(graph.mark_deleted(bucket, object_name, deleted_at, reason) for bucket, object_name in deleted)
+        if marked:
+            _save_lineage_graph(client, graph)
+    return marked
+
+def rebuild_lineage_graph():
+    """Rebuild the graph index from every ``lineage/`` record (fetched concurrently)."""
+    client = get_minio_client()
+    _ensure_bucket(client)
+    with _lock, object_lease(client, LINEAGE_BUCKET, LINEAGE_GRAPH_LEASE):
+        graph = _scan_lineage_graph(client)
+        _save_lineage_graph(client, graph)
+    print(f"Lineage graph rebuilt with {len(graph.edges)} edges")
+    return graph
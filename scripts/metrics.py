@@ -0,0 +1,277 @@
+"""
+Performance instrumentation for the pipeline.
+
+The hot operations (lake uploads and downloads, Parquet/CSV encoding and decoding, SQL dump
+parsing, warehouse loads and exports, governance writes) run inside ``timed``, which keeps,
+per stage and operation, the number of calls, the total and maximum duration, the bytes and
+rows moved, the retries and the errors:
+
+    with timed('minio_upload') as op:
+        client.put_object(...)
+        op.add(bytes=length)
+
+``stage`` labels everything recorded inside it with a pipeline stage and measures the
+stage's wall time and peak resident memory. ``write_run_summary`` stores the metrics of a
+run in ``govern-zone-metadata/runs/<run_id>/metrics.json`` and in a Prometheus text file
+(``PROMETHEUS_TEXTFILE_DIR``) that the node exporter's textfile collector scrapes.
+"""
+import io
+import os
+import json
+import time
+import datetime
+import resource
+import tempfile
+import threading
+import contextlib
+
+METRICS_BUCKET = 'govern-zone-metadata'
+RUNS_PREFIX = 'runs'
+PROMETHEUS_TEXTFILE_DIR = os.environ.get('PROMETHEUS_TEXTFILE_DIR', '/data/metrics')
+PROMETHEUS_FILE = 'datalake_pipeline.prom'
+MEMORY_SAMPLE_INTERVAL = 0.1  # segundos entre muestras de memoria residente
+
+_lock = threading.Lock()
+_operations = {}  # (etapa, operación) -> acumulados
+_stages = {}      # etapa -> duración, memoria máxima y estado
+_current_stage = None
+_thread_stage = threading.local()  # etapa de los trabajos lanzados en segundo plano
+
+def new_run_id():
+    """Identifier of a pipeline run (its start time)."""
+    return datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+
+def current_stage():
+    return getattr(_thread_stage, 'name', None) or _current_stage or 'standalone'
+
+def bind_stage(function):
+    """Wrap ``function`` so that, run later in another thread, it records under the current stage."""
+    stage_name = current_stage()
+
+    def run_in_stage(*args, **kwargs):
+        previous = getattr(_thread_stage, 'name', None)
+        _thread_stage.name = stage_name
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _thread_stage.name = previous
+    return run_in_stage
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Sin /proc: máximo del proceso hasta ahora (ru_maxrss en KB en Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class _MemorySampler(threading.Thread):
+    """Samples the resident memory of the process until stopped, keeping the peak."""
+
+    def __init__(self):
+        super().__init__(daemon=True, name='memory-sampler')
+        self.peak = _rss_bytes()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(MEMORY_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, _rss_bytes())
+        return self.peak
+
+class _Operation:
+    """Counters of one ``timed`` call, filled in by the caller."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.rows = 0
+        self.retries = 0
+
+    def add(self, bytes=0, rows=0, retries=0):
+        self.bytes += bytes or 0
+        self.rows += rows or 0
+        self.retries += retries or 0
+        return self
+
+@contextlib.contextmanager
+def timed(operation):
+    """Record the duration (and the bytes/rows/retries added by the caller) of ``operation``."""
+    op = _Operation()
+    stage_name = current_stage()
+    failed = False
+    started = time.perf_counter()
+    try:
+        yield op
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            stats = _operations.setdefault((stage_name, operation), {
+                'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0, 'rows': 0, 'retries': 0, 'errors': 0
+            })
+            stats['count'] += 1
+            stats['seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            stats['bytes'] += op.bytes
+            stats['rows'] += op.rows
+            stats['retries'] += op.retries
+            stats['errors'] += failed
+
+@contextlib.contextmanager
+def stage(name):
+    """Label the operations recorded inside with stage ``name``; records its duration and peak memory.
+
+    The stage counts as failed if the block raises; the caller can also set ``status`` on the
+    yielded record (e.g. for stages that report failure by returning nothing).
+    """
+    global _current_stage
+    previous = _current_stage
+    _current_stage = name
+    sampler = _MemorySampler()
+    sampler.start()
+    record = {'status': None}
+    failed = True
+    started = time.perf_counter()
+    try:
+        yield record
+        failed = False
+    finally:
+        duration = time.perf_counter() - started
+        peak = sampler.stop()
+        _current_stage = previous
+        with _lock:
+            _stages[name] = {
+                'duration_s': duration,
+                'peak_rss_bytes': peak,
+                'status': 'failed' if failed else record['status'] or 'done'
+            }
+
+def response_retries(response):
+    """Retries urllib3 made for a MinIO response (0 for other storage backends)."""
+    retries = getattr(response, 'retries', None)
+    return len(getattr(retries, 'history', None) or ())
+
+def response_size(response):
+    """Body size announced by a storage response, if known."""
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return int(headers.get('content-length'))
+    except (TypeError, ValueError):
+        return 0
+
+def summary():
+    """Snapshot of everything recorded so far."""
+    with _lock:
+        return {
+            'stages': {name: dict(values) for name, values in _stages.items()},
+            'operations': [
+                dict(values, stage=stage_name, operation=operation)
+                for (stage_name, operation), values in sorted(_operations.items())
+            ]
+        }
+
+def reset():
+    with _lock:
+        _operations.clear()
+        _stages.clear()
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_prometheus(run_summary):
+    """Prometheus text exposition of a run summary (gauges for the last run).
+
+    The run id only labels ``datalake_last_run_info``, so every run updates the same series.
+    """
+    lines = [
+        '# HELP datalake_last_run_info Identifier and status of the last pipeline run.',
+        '# TYPE datalake_last_run_info gauge',
+        f'datalake_last_run_info{{run_id="{_label(run_summary["run_id"])}",'
+        f'status="{_label(run_summary.get("status", "unknown"))}"}} 1',
+        '# HELP datalake_last_run_timestamp_seconds End time of the last pipeline run.',
+        '# TYPE datalake_last_run_timestamp_seconds gauge',
+        f'datalake_last_run_timestamp_seconds {run_summary["finished_at_epoch"]:.0f}',
+    ]
+    stage_metrics = [
+        ('datalake_stage_duration_seconds', 'Wall time of each stage in the last run.',
+         lambda values: values['duration_s']),
+        ('datalake_stage_peak_memory_bytes', 'Peak resident memory during each stage in the last run.',
+         lambda values: values['peak_rss_bytes']),
+        ('datalake_stage_success', 'Whether each stage of the last run succeeded.',
+         lambda values: int(values['status'] == 'done')),
+    ]
+    for name, help_text, value in stage_metrics:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for stage_name, values in run_summary['stages'].items():
+            lines.append(f'{name}{{stage="{_label(stage_name)}"}} {value(values)}')
+
+    operation_metrics = [
+        ('datalake_operation_calls', 'Calls of each instrumented operation in the last run.', 'count'),
+        ('datalake_operation_seconds', 'Total time spent in each operation in the last run.', 'seconds'),
+        ('datalake_operation_max_seconds', 'Slowest single call of each operation in the last run.', 'max_seconds'),
+        ('datalake_operation_bytes', 'Bytes moved by each operation in the last run.', 'bytes'),
+        ('datalake_operation_rows', 'Rows processed by each operation in the last run.', 'rows'),
+        ('datalake_operation_retries', 'Retries of each operation in the last run.', 'retries'),
+        ('datalake_operation_errors', 'Failed calls of each operation in the last run.', 'errors'),
+    ]
+    for name, help_text, key in operation_metrics:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for values in run_summary['operations']:
+            lines.append(f'{name}{{stage="{_label(values["stage"])}",operation="{_label(values["operation"])}"}} '
+                         f'{values[key]}')
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus_textfile(run_summary, directory=None):
+    """Write the run metrics for the node exporter textfile collector; returns the file path."""
+    directory = directory or PROMETHEUS_TEXTFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, PROMETHEUS_FILE)
+    # El collector puede leer en cualquier momento: escribimos aparte y renombramos
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.datalake_pipeline.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(format_prometheus(run_summary))
+    os.replace(temp_path, path)
+    return path
+
+def write_run_summary(run_id, **details):
+    """Store the metrics of run ``run_id`` in the govern zone and the Prometheus text file."""
+    from utils import get_minio_client
+
+    finished_at = datetime.datetime.now()
+    run_summary = dict(summary(), run_id=run_id, finished_at=finished_at.isoformat(),
+                       finished_at_epoch=finished_at.timestamp(), **details)
+    try:
+        client = get_minio_client()
+        if not client.bucket_exists(METRICS_BUCKET):
+            client.make_bucket(METRICS_BUCKET)
+        data = json.dumps(run_summary, default=str).encode('utf-8')
+        object_name = f"{RUNS_PREFIX}/{run_id}/metrics.json"
+        client.put_object(METRICS_BUCKET, object_name, io.BytesIO(data), length=len(data),
+                          content_type='application/json')
+        print(f"Run metrics stored in {METRICS_BUCKET}/{object_name}")
+    except Exception as e:
+        print(f"Error storing run metrics in {METRICS_BUCKET}: {e}")
+    try:
+        print(f"Prometheus metrics written to {write_prometheus_textfile(run_summary)}")
+    except Exception as e:
+        print(f"Error writing Prometheus metrics: {e}")
+    return run_summary
+
+def print_metrics_report(run_summary, top=10):
+    """Print the stage timings and the most expensive operations of a run."""
+    print("\nStage metrics:")
+    for stage_name, values in run_summary['stages'].items():
+        print(f"  {stage_name:<12} {values['status']:<7} {values['duration_s']:>8.2f}s  "
+              f"peak {values['peak_rss_bytes'] / 1024 / 1024:.0f} MB")
+    print(f"\nTop {top} operations by time:")
+    operations = sorted(run_summary['operations'], key=lambda values: values['seconds'], reverse=True)
+    for values in operations[:top]:
+        print(f"  {values['stage']:<12} {values['operation']:<24} {values['count']:>6} calls "
+              f"{values['seconds']:>8.2f}s  {values['bytes'] / 1024 / 1024:>8.1f} MB  {values['rows']:>10} rows"
+              + (f"  {values['errors']} errors" if values['errors'] else ''))
@@ -0,0 +1,261 @@
+"""
+Sparse origin-destination (OD) flow matrices for BiciMAD trips.
+
+For each time bucket (date + start hour) the trips are stored as a station x station CSR
+matrix with three value arrays: number of trips, summed duration and summed distance.
+Each array is published as a raw ``.npy`` object in the access zone, under a prefix named
+after the content of the bucket:
+
+    access-zone/od/fecha=YYYY-MM-DD/hora=HH/v=<version>/{indptr,indices,viajes,duracion_sum,distancia_sum}.npy
+
+so the loader can memory-map it locally and answer flow questions in O(nnz). A new version
+never overwrites the arrays a reader may be downloading: ``od/_manifest.json`` points every
+bucket at its current version, and its read-modify-write (here and in ``retention``) runs
+under the ``od/_manifest.lease`` object lease. Superseded versions age out with the zone.
+"""
+from utils import get_minio_client, log_data_transformation, store_object_metadata
+from storage import object_lease
+import numpy as np
+import pandas as pd
+import hashlib
+import io
+import json
+import os
+import re
+import datetime
+
+OD_BUCKET = 'access-zone'
+OD_PREFIX = 'od'
+OD_MANIFEST = f'{OD_PREFIX}/_manifest.json'
+OD_MANIFEST_LEASE = f'{OD_PREFIX}/_manifest.lease'
+OD_CACHE_DIR = os.environ.get(
+    'OD_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'od')
+)
+OD_ARRAYS = ['indptr', 'indices', 'viajes', 'duracion_sum', 'distancia_sum']
+
+def build_csr(origin, destination, duration, distance, n_stations):
+    """Build the CSR arrays of one OD matrix from trip-level columns."""
+    codes = origin.astype(np.int64) * n_stations + destination.astype(np.int64)
+    cells, inverse = np.unique(codes, return_inverse=True)
+    rows = cells // n_stations
+    indptr = np.zeros(n_stations + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=n_stations))
+    return {
+        'indptr': indptr,
+        'indices': (cells % n_stations).astype(np.int32),
+        'viajes': np.bincount(inverse).astype(np.int64),
+        'duracion_sum': np.bincount(inverse, weights=duration),
+        'distancia_sum': np.bincount(inverse, weights=distance)
+    }
+
+def build_od_matrices(df_bicimad):
+    """Build one CSR matrix per (fecha, hora) bucket; returns ``{(fecha, hora): arrays}`` and the station count."""
+    df = df_bicimad.dropna(subset=['estacion_origen', 'estacion_destino'])
+    n_stations = int(max(df['estacion_origen'].max(), df['estacion_destino'].max())) + 1
+    fechas = pd.to_datetime(df['fecha']).dt.strftime('%Y-%m-%d')
+
+    matrices = {}
+    for (fecha, hora), index in df.groupby([fechas, df['hora']]).indices.items():
+        trips = df.iloc[index]
+        matrices[(fecha, int(hora))] = build_csr(
+            trips['estacion_origen'].to_numpy(),
+            trips['estacion_destino'].to_numpy(),
+            trips['duracion_segundos'].to_numpy(dtype=float),
+            trips['distancia_km'].to_numpy(dtype=float),
+            n_stations
+        )
+    return matrices, n_stations
+
+def _bucket_prefix(fecha, hora, version=None):
+    prefix = f"{OD_PREFIX}/fecha={fecha}/hora={hora:02d}"
+    return f"{prefix}/v={version}" if version else prefix
+
+def _entry_prefix(key, entry):
+    """Prefix of the arrays of a manifest entry (manifests written before versioned prefixes have none)."""
+    fecha, hora = key.split('/')
+    return entry.get('prefix') or _bucket_prefix(fecha, int(hora))
+
+def _read_manifest(client):
+    try:
+        response = client.get_object(OD_BUCKET, OD_MANIFEST)
+        try:
+            return json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return {'buckets': {}}
+
+def _write_manifest(client, manifest):
+    manifest_json = json.dumps(manifest).encode('utf-8')
+    client.put_object(OD_BUCKET, OD_MANIFEST, io.BytesIO(manifest_json),
+                      length=len(manifest_json), content_type='application/json')
+
+def forget_buckets(client, bucket, deleted):
+    """Drop the manifest entries of the time buckets among the ``deleted`` objects; returns how many."""
+    if bucket != OD_BUCKET:
+        return 0
+    prefixes = {}
+    for object_name in deleted:
+        match = re.match(rf'{OD_PREFIX}/fecha=([^/]+)/hora=(\d+)/', object_name)
+        if match:
+            key = f"{match.group(1)}/{int(match.group(2)):02d}"
+            prefixes.setdefault(key, set()).add(object_name.rsplit('/', 1)[0])
+    if not prefixes:
+        return 0
+    with object_lease(client, OD_BUCKET, OD_MANIFEST_LEASE):
+        manifest = _read_manifest(client)
+        # Con un solo array borrado el bucket ya no se puede cargar; las versiones anteriores no cuentan
+        forgotten = [key for key, deleted_prefixes in prefixes.items()
+                     if key in manifest['buckets'] and _entry_prefix(key, manifest['buckets'][key]) in deleted_prefixes]
+        for key in forgotten:
+            del manifest['buckets'][key]
+        if forgotten:
+            _write_manifest(client, manifest)
+    return len(forgotten)
+
+def publish_od_matrices(df_bicimad, source_object='bicimad/cleaned_bicimad.parquet'):
+    """Build the OD matrices and upload the buckets whose content changed."""
+    client = get_minio_client()
+    if not client.bucket_exists(OD_BUCKET):
+        client.make_bucket(OD_BUCKET)
+
+    matrices, n_stations = build_od_matrices(df_bicimad)
+    manifest = _read_manifest(client)
+
+    entries = {}
+    for (fecha, hora), arrays in matrices.items():
+        buffers = {}
+        digest = hashlib.sha256()
+        for name in OD_ARRAYS:
+            buffer = io.BytesIO()
+            np.save(buffer, arrays[name], allow_pickle=False)
+            buffers[name] = buffer.getvalue()
+            digest.update(buffers[name])
+        version = digest.hexdigest()
+
+        key = f"{fecha}/{hora:02d}"
+        if manifest['buckets'].get(key, {}).get('version') == version:
+            continue
+        # Prefijo nuevo por versión: los lectores del manifiesto anterior siguen viendo sus arrays
+        prefix = _bucket_prefix(fecha, hora, version)
+        for name, data in buffers.items():
+            client.put_object(
+                OD_BUCKET, f"{prefix}/{name}.npy",
+                io.BytesIO(data), length=len(data),
+                content_type='application/octet-stream'
+            )
+        entries[key] = {
+            'version': version,
+            'prefix': prefix,
+            'n_stations': n_stations,
+            'nnz': int(len(arrays['indices'])),
+            'viajes': int(arrays['viajes'].sum())
+        }
+    published = len(entries)
+
+    # Los arrays ya están subidos: bajo el lease solo se relee el manifiesto y se apuntan los buckets nuevos
+    if entries:
+        with object_lease(client, OD_BUCKET, OD_MANIFEST_LEASE):
+            manifest = _read_manifest(client)
+            manifest['buckets'].update(entries)
+            _write_manifest(client, manifest)
+    print(f"OD matrices: {published} of {len(matrices)} time buckets published to {OD_BUCKET}/{OD_PREFIX}")
+
+    if published:
+        store_object_metadata(OD_BUCKET, f"{OD_PREFIX}/", {
+            'description': 'Sparse BiciMAD origin-destination matrices (CSR) per date and hour',
+            'uploaded_at': datetime.datetime.now().isoformat(),
+            'format': 'npy',
+            'arrays': OD_ARRAYS,
+            'buckets': sorted(manifest['buckets'])
+        })
+        log_data_transformation(
+            'process-zone', source_object,
+            OD_BUCKET, f"{OD_PREFIX}/",
+            'BiciMAD trips aggregated into sparse OD matrices per date and hour'
+        )
+    return published
+
+class ODMatrix:
+    """Memory-mapped CSR origin-destination matrix of one time bucket."""
+
+    def __init__(self, arrays, n_stations):
+        self.n_stations = n_stations
+        self.indptr = arrays['indptr']
+        self.indices = arrays['indices']
+        self.viajes = arrays['viajes']
+        self.duracion_sum = arrays['duracion_sum']
+        self.distancia_sum = arrays['distancia_sum']
+
+    def top_flows(self, origin, n=10):
+        """Top ``n`` destinations by number of trips from station ``origin``."""
+        if origin >= self.n_stations:
+            return pd.DataFrame(columns=['estacion_destino', 'viajes', 'duracion_media', 'distancia_media'])
+        start, end = self.indptr[origin], self.indptr[origin + 1]
+        viajes = np.asarray(self.viajes[start:end])
+        order = np.argsort(-viajes, kind='stable')[:n]
+        return pd.DataFrame({
+            'estacion_destino': np.asarray(self.indices[start:end])[order],
+            'viajes': viajes[order],
+            'duracion_media': np.asarray(self.duracion_sum[start:end])[order] / viajes[order],
+            'distancia_media': np.asarray(self.distancia_sum[start:end])[order] / viajes[order]
+        })
+
+    def outflow(self):
+        """Trips leaving each station."""
+        return np.diff(np.cumsum(np.concatenate([[0], self.viajes]))[self.indptr])
+
+    def inflow(self):
+        """Trips arriving at each station."""
+        return np.bincount(self.indices, weights=self.viajes, minlength=self.n_stations).astype(np.int64)
+
+    def net_inflow(self):
+        """Arrivals minus departures per station."""
+        return self.inflow() - self.outflow()
+
+def list_od_buckets():
+    """List the published ``(fecha, hora)`` buckets."""
+    manifest = _read_manifest(get_minio_client())
+    return sorted((key.split('/')[0], int(key.split('/')[1])) for key in manifest['buckets'])
+
+def load_od_matrix(fecha, hora, cache_dir=None, manifest=None):
+    """Download (if stale) and memory-map the OD matrix of one time bucket."""
+    client = get_minio_client()
+    manifest = manifest or _read_manifest(client)
+    key = f"{fecha}/{hora:02d}"
+    if key not in manifest['buckets']:
+        raise KeyError(f"No OD matrix published for {key}")
+    entry = manifest['buckets'][key]
+
+    local_dir = os.path.join(cache_dir or OD_CACHE_DIR, f"fecha={fecha}", f"hora={hora:02d}")
+    version_path = os.path.join(local_dir, 'version')
+    cached_version = open(version_path).read() if os.path.exists(version_path) else None
+    if cached_version != entry['version']:
+        os.makedirs(local_dir, exist_ok=True)
+        prefix = _entry_prefix(key, entry)
+        for name in OD_ARRAYS:
+            client.fget_object(OD_BUCKET, f"{prefix}/{name}.npy",
+                               os.path.join(local_dir, f"{name}.npy"))
+        with open(version_path, 'w') as f:
+            f.write(entry['version'])
+
+    arrays = {name: np.load(os.path.join(local_dir, f"{name}.npy"), mmap_mode='r') for name in OD_ARRAYS}
+    return ODMatrix(arrays, entry['n_stations'])
+
+def net_inflow_by_hour(fecha, cache_dir=None):
+    """Net inflow per station for every published hour of a date (rows: hours, columns: stations)."""
+    client = get_minio_client()
+    manifest = _read_manifest(client)
+    result = {}
+    for key in manifest['buckets']:
+        bucket_fecha, hora = key.split('/')
+        if bucket_fecha == fecha:
+            result[int(hora)] = load_od_matrix(fecha, int(hora), cache_dir, manifest).net_inflow()
+    if not result:
+        return pd.DataFrame()
+    n_stations = max(len(v) for v in result.values())
+    return pd.DataFrame(
+        {hora: np.pad(values, (0, n_stations - len(values))) for hora, values in result.items()}
+    ).T.sort_index()
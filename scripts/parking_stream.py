@@ -0,0 +1,436 @@
+"""
+Micro-batch ingestion of hourly parking occupancy.
+
+In production the car parks report their occupancy every hour, so instead of waiting for
+the next full ``parkings-rotacion.csv`` this long-running service ingests the updates as
+they arrive, from a local directory (CSV or JSON lines files, same columns as the raw file)
+and/or a TCP socket (one JSON record, or a list of records, per line):
+
+    python parking_stream.py --directory /data/stream/parkings
+    python parking_stream.py --port 9099 --max-latency 10
+    python parking_stream.py --directory /data/stream/parkings --drain   # process what is there and exit
+
+Every micro-batch is validated and typed, archived in the raw-zone table
+``aparcamiento/parkings_stream.parquet``, appended to the process-zone table
+``parkings/cleaned_parking_rotation.parquet`` (a new data file committed as an ``append``
+snapshot), upserted into ``fact_ocupacion_parkings`` and upserted into the ``ocupacion_parkings``
+rollup cube (cells keyed by car park, date and hour, so a corrected hour or a redelivered
+batch replaces the old value instead of adding to it). A batch is closed when it reaches ``STREAM_BATCH_ROWS`` rows or when its oldest
+update has waited ``STREAM_MAX_LATENCY`` seconds, which bounds the end-to-end latency.
+
+The sources feed a bounded queue: when the writer falls behind, the directory reader stops
+picking up files and the socket handlers stop reading, so TCP flow control pushes back on
+the senders. Files are moved to ``processed/`` only once their batch is in the lake (at
+least once); invalid records go to ``rejected/`` with the reason. Socket updates are taken
+as received (at most once). Every ``STREAM_COMPACT_INTERVAL`` seconds the small files of the
+table are compacted (``compaction``).
+
+The process-zone table keeps every received row, corrections included, until the next
+batch run of the process stage. That run replaces the table with the raw file plus the
+archived hours the raw file does not have yet (``02_process_data.fold_streamed_parkings``),
+so streamed updates are not lost when the batch pipeline runs.
+"""
+from utils import batched_index_updates, download_dataframe_from_minio, log_data_transformation, upload_dataframe_to_minio
+from tables import new_snapshot_id
+from checkpoints import lake_fingerprint
+from compaction import compact_table
+from rollups import update_cube
+from spatial import load_district_polygons
+from warehouse import get_connection_pool, pooled_connection
+from metrics import timed
+import pandas as pd
+import os
+import json
+import time
+import queue
+import shutil
+import signal
+import argparse
+import importlib
+import threading
+import socketserver
+
+STREAM_BATCH_ROWS = int(os.environ.get('STREAM_BATCH_ROWS', '5000'))
+STREAM_MAX_LATENCY = float(os.environ.get('STREAM_MAX_LATENCY', '30'))  # segundos
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', '1000'))    # ficheros o mensajes pendientes
+STREAM_POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', '1'))
+STREAM_COMPACT_INTERVAL = float(os.environ.get('STREAM_COMPACT_INTERVAL', '600'))
+
+TABLE_BUCKET = 'process-zone'
+TABLE_NAME = 'parkings/cleaned_parking_rotation.parquet'
+ARCHIVE_BUCKET = 'raw-ingestion-zone'
+ARCHIVE_NAME = 'aparcamiento/parkings_stream.parquet'
+REFERENCE_OBJECTS = [('process-zone', 'parkings/cleaned_parking_info.parquet'),
+                     ('process-zone', 'municipal/distritos.parquet')]
+REQUIRED_COLUMNS = ['aparcamiento_id', 'fecha', 'hora', 'plazas_ocupadas']
+# Ficheros que aún se están escribiendo (el emisor los renombra al terminar)
+PARTIAL_SUFFIXES = ('.tmp', '.part')
+
+_process = importlib.import_module('02_process_data')
+_access = importlib.import_module('03_access_zone')
+
+def read_updates_file(path):
+    """Read a file of occupancy updates (CSV, or JSON lines with the ``.json``/``.jsonl`` extension)."""
+    if path.endswith(('.json', '.jsonl')):
+        return pd.read_json(path, lines=True, dtype=False)
+    return pd.read_csv(path, dtype=str)
+
+def validate_updates(df, ext_enriched):
+    """Type the updates and split them into ``(valid, rejected)``; rejected rows carry a ``motivo``.
+
+    Valid rows have the raw file's columns and types, one row per car park and hour (the
+    last one wins).
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        return pd.DataFrame(columns=REQUIRED_COLUMNS), df.assign(motivo=f"missing columns: {', '.join(missing)}")
+
+    typed = pd.DataFrame({
+        'aparcamiento_id': pd.to_numeric(df['aparcamiento_id'], errors='coerce'),
+        'fecha': pd.to_datetime(df['fecha'], format='%Y-%m-%d', errors='coerce'),
+        'hora': pd.to_numeric(df['hora'], errors='coerce'),
+        'plazas_ocupadas': pd.to_numeric(df['plazas_ocupadas'], errors='coerce')
+    }, index=df.index)
+    capacity = typed['aparcamiento_id'].map(ext_enriched.set_index('aparcamiento_id')['capacidad_total'])
+    numbers = typed[['aparcamiento_id', 'hora', 'plazas_ocupadas']]
+
+    # Primer motivo de rechazo de cada fila (None si es válida)
+    reason = pd.Series(None, index=df.index, dtype=object)
+    checks = [
+        (typed.isna().any(axis=1), 'missing or malformed value'),
+        ((numbers % 1 != 0).any(axis=1), 'non-integer value'),
+        (~typed['hora'].between(0, 23), 'hora out of range'),
+        (typed['plazas_ocupadas'] < 0, 'negative occupancy'),
+        (capacity.isna(), 'unknown aparcamiento_id'),
+        (typed['plazas_ocupadas'] > capacity, 'occupancy above capacity')
+    ]
+    for failed, message in checks:
+        reason = reason.mask(reason.isna() & failed, message)
+
+    rejected = df[reason.notna()].assign(motivo=reason[reason.notna()])
+    valid = typed[reason.isna()].astype({'aparcamiento_id': 'int64', 'hora': 'int64', 'plazas_ocupadas': 'int64'})
+    # Mismas columnas y tipos que la carga por lotes (02_process_data)
+    valid = valid.assign(fecha=valid['fecha'].dt.strftime('%Y-%m-%d'))
+    valid = valid.drop_duplicates(['aparcamiento_id', 'fecha', 'hora'], keep='last').reset_index(drop=True)
+    _process.column_clean_parkings(valid)
+    return valid, rejected
+
+class _BoundedSource:
+    """Puts items in the shared bounded queue, blocking (backpressure) while it is full."""
+
+    def __init__(self, output, stop_event, label):
+        self.output = output
+        self.stop_event = stop_event
+        self.label = label
+
+    def put(self, item):
+        paused = False
+        while not self.stop_event.is_set():
+            try:
+                self.output.put(item, timeout=STREAM_POLL_INTERVAL)
+                if paused:
+                    print(f"Stream source {self.label} resumed")
+                return True
+            except queue.Full:
+                if not paused:
+                    print(f"Stream queue full: source {self.label} paused until the writer catches up")
+                    paused = True
+        return False
+
+class DirectorySource(_BoundedSource, threading.Thread):
+    """Picks up update files dropped in ``directory`` (oldest first)."""
+
+    def __init__(self, directory, output, stop_event):
+        _BoundedSource.__init__(self, output, stop_event, directory)
+        threading.Thread.__init__(self, daemon=True, name='stream-directory')
+        self.directory = directory
+        self.in_flight = set()
+        self.idle = False
+        for subdirectory in ('processed', 'rejected', 'failed'):
+            os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+    def _ready_files(self):
+        names = [name for name in os.listdir(self.directory)
+                 if not name.startswith('.') and not name.endswith(PARTIAL_SUFFIXES)
+                 and os.path.isfile(os.path.join(self.directory, name)) and name not in self.in_flight]
+        return sorted(names, key=lambda name: (os.path.getmtime(os.path.join(self.directory, name)), name))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            names = self._ready_files()
+            self.idle = not names and not self.in_flight
+            for name in names:
+                path = os.path.join(self.directory, name)
+                try:
+                    df = read_updates_file(path)
+                except Exception as e:
+                    print(f"Error reading stream file {path}: {e}")
+                    self._move(name, 'failed')
+                    continue
+                self.in_flight.add(name)
+                if not self.put((df, time.monotonic(), name, self)):
+                    return
+            self.stop_event.wait(STREAM_POLL_INTERVAL)
+
+    def _move(self, name, subdirectory):
+        shutil.move(os.path.join(self.directory, name), os.path.join(self.directory, subdirectory, name))
+
+    def ack(self, name, rejected=None):
+        """The updates of ``name`` are in the lake: archive the file (and its rejected rows)."""
+        if rejected is not None and len(rejected):
+            rejected.to_csv(os.path.join(self.directory, 'rejected', f"{name}.rejected.csv"), index=False)
+        self._move(name, 'processed')
+        self.in_flight.discard(name)
+
+    def retry(self, name):
+        """The batch of ``name`` could not be written: the file is read again on the next poll."""
+        self.in_flight.discard(name)
+
+class _UpdateHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        source = self.server.source
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records = json.loads(line)
+            except ValueError:
+                print(f"Invalid JSON update from {self.client_address[0]} ignored")
+                continue
+            records = records if isinstance(records, list) else [records]
+            # Mientras la cola esté llena no se lee más del socket
+            if not source.put((pd.DataFrame(records, dtype=str), time.monotonic(), None, None)):
+                return
+
+class SocketSource(_BoundedSource):
+    """TCP server receiving JSON updates, one per line."""
+
+    def __init__(self, host, port, output, stop_event):
+        super().__init__(output, stop_event, f"{host}:{port}")
+        self.server = socketserver.ThreadingTCPServer((host, port), _UpdateHandler)
+        self.server.daemon_threads = True
+        self.server.source = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='stream-socket')
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def load_reference_data():
+    """Car parks enriched with their district, and the districts (for the warehouse dimensions)."""
+    ext_df = download_dataframe_from_minio('process-zone', 'parkings/cleaned_parking_info.parquet', format='parquet')
+    df_distritos = download_dataframe_from_minio('process-zone', 'municipal/distritos.parquet', format='parquet')
+    return _access.columnas_adicionales_ext(ext_df, df_distritos, load_district_polygons()), df_distritos
+
+class ParkingStream:
+    """Writer side of the stream: turns micro-batches into lake, warehouse and rollup updates."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.reference_fingerprint = None
+        self.ext_enriched = None
+        self.df_distritos = None
+        # Lotes ya en el lake cuya carga en el warehouse o el cubo falló: se reintentan
+        self.unserved = []
+        self.stats = {'batches': 0, 'rows': 0, 'rejected': 0, 'max_latency': 0.0}
+
+    def refresh_reference_data(self):
+        """Reload the car parks when their process-zone snapshot changes, and sync the dimensions."""
+        fingerprint = lake_fingerprint(REFERENCE_OBJECTS)
+        if fingerprint == self.reference_fingerprint:
+            return
+        self.ext_enriched, self.df_distritos = load_reference_data()
+        with pooled_connection(self.pool) as conn:
+            _access.create_warehouse_tables(conn)
+            _access.load_dim_distritos(conn, self.df_distritos)
+            _access.load_dim_aparcamientos(conn, self.ext_enriched)
+        self.reference_fingerprint = fingerprint
+        print(f"Stream reference data loaded: {len(self.ext_enriched)} car parks")
+
+    def process_batch(self, items):
+        """Validate, append, upsert and roll up one micro-batch; returns the rejected rows per file."""
+        self.refresh_reference_data()
+        frames, rejected_by_file = [], {}
+        for df, _, name, _ in items:
+            valid, rejected = validate_updates(df, self.ext_enriched)
+            frames.append(valid)
+            rejected_by_file[name] = rejected
+            self.stats['rejected'] += len(rejected)
+        batch = pd.concat(frames, ignore_index=True)
+        batch = batch.drop_duplicates(['aparcamiento_id', 'fecha', 'hora'], keep='last').reset_index(drop=True)
+        if batch.empty:
+            return rejected_by_file
+
+        with timed('stream_batch') as op:
+            snapshot_id = new_snapshot_id()
+            # 1. Archivo en la raw zone: la siguiente carga por lotes lo incorpora a la tabla.
+            # La columna lote ordena las correcciones aunque la compactación reordene los ficheros
+            upload_dataframe_to_minio(batch.assign(lote=snapshot_id), ARCHIVE_BUCKET, ARCHIVE_NAME, format='parquet',
+                                      snapshot_id=snapshot_id, append=True, metadata={
+                                          'description': 'Hourly parking occupancy updates received by the stream',
+                                          'primary_keys': ['aparcamiento_id', 'fecha', 'hora', 'lote'],
+                                          'transformations': 'Validated and typed streamed updates'
+                                      })
+            # 2. Lake: un fichero de datos nuevo añadido al snapshot actual de la tabla
+            upload_dataframe_to_minio(batch, TABLE_BUCKET, TABLE_NAME, format='parquet', snapshot_id=snapshot_id,
+                                      append=True, metadata={
+                                          'description': 'Cleaned parking rotation data',
+                                          'primary_keys': [],
+                                          'transformations': 'Streamed hourly updates validated and typed'
+                                      })
+            op.add(rows=len(batch))
+        try:
+            log_data_transformation(
+                'stream', 'parkings/ocupacion', ARCHIVE_BUCKET, ARCHIVE_NAME,
+                f'Micro-batch of {len(batch)} hourly parking occupancy updates archived',
+                target_snapshot=snapshot_id
+            )
+            log_data_transformation(
+                'stream', 'parkings/ocupacion', TABLE_BUCKET, TABLE_NAME,
+                f'Micro-batch of {len(batch)} hourly parking occupancy updates appended',
+                target_snapshot=snapshot_id
+            )
+        except Exception as e:
+            print(f"Error logging the lineage of stream batch {snapshot_id}: {e}")
+        self.unserved.append((snapshot_id, _access.enrich_parking_occupancy(batch, self.ext_enriched)))
+        self.serve()
+        return rejected_by_file
+
+    def serve(self):
+        """Upsert the pending batches into the warehouse and the rollup cube."""
+        while self.unserved:
+            snapshot_id, parking_merge = self.unserved[0]
+            try:
+                with timed('stream_serve') as op:
+                    with pooled_connection(self.pool) as conn:
+                        _access.load_dim_date_time(conn, parking_merge)
+                        _access.load_fact_ocupacion_parkings(conn, parking_merge, upsert=True)
+                    # Celdas por aparcamiento, fecha y hora: una corrección o un lote reenviado sustituye
+                    # el valor anterior en lugar de sumarse
+                    update_cube('ocupacion_parkings', parking_merge, f"stream@{snapshot_id}", mode='upsert')
+                    op.add(rows=len(parking_merge))
+            except Exception as e:
+                print(f"Error serving stream batch {snapshot_id} (will retry): {e}")
+                return
+            self.unserved.pop(0)
+
+def run_stream(directory=None, host='0.0.0.0', port=None, batch_rows=STREAM_BATCH_ROWS,
+               max_latency=STREAM_MAX_LATENCY, compact_interval=STREAM_COMPACT_INTERVAL, drain=False):
+    """Run the micro-batch ingestion until interrupted (or, with ``drain``, until ``directory`` is empty)."""
+    if directory is None and port is None:
+        raise ValueError("A stream source is required: a directory and/or a port")
+    if drain and directory is None:
+        raise ValueError("--drain needs a directory source")
+
+    updates = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stop_event = threading.Event()
+    sources = []
+    if directory is not None:
+        sources.append(DirectorySource(directory, updates, stop_event))
+    if port is not None:
+        sources.append(SocketSource(host, port, updates, stop_event))
+
+    pool = get_connection_pool(1)
+    stream = ParkingStream(pool)
+    stream.refresh_reference_data()
+    log_data_transformation(
+        TABLE_BUCKET, TABLE_NAME, 'PostgreSQL', 'fact_ocupacion_parkings',
+        'Streamed parking occupancy upserted into the fact_ocupacion_parkings warehouse table',
+        additional_sources=REFERENCE_OBJECTS[:1]
+    )
+    for source in sources:
+        source.start()
+    print(f"Parking stream running ({', '.join(source.label for source in sources)}; "
+          f"batches of up to {batch_rows} rows or {max_latency:.0f}s)")
+
+    pending, rows = [], 0
+    last_compaction = time.monotonic()
+    try:
+        while True:
+            # Se espera como mucho hasta que venza la latencia máxima del lote abierto
+            timeout = STREAM_POLL_INTERVAL if not pending else max(0.0, pending[0][1] + max_latency - time.monotonic())
+            try:
+                item = updates.get(timeout=timeout)
+                pending.append(item)
+                rows += len(item[0])
+            except queue.Empty:
+                pass
+
+            if pending and (rows >= batch_rows or time.monotonic() >= pending[0][1] + max_latency
+                            or (drain and updates.empty())):
+                _flush(stream, pending)
+                pending, rows = [], 0
+            elif not pending:
+                stream.serve()
+
+            if time.monotonic() - last_compaction >= compact_interval:
+                for bucket, name in ((TABLE_BUCKET, TABLE_NAME), (ARCHIVE_BUCKET, ARCHIVE_NAME)):
+                    try:
+                        compact_table(bucket, name)
+                    except Exception as e:
+                        print(f"Error compacting {bucket}/{name}: {e}")
+                last_compaction = time.monotonic()
+
+            if drain and not pending and updates.empty() and sources[0].idle:
+                break
+    except KeyboardInterrupt:
+        print("Stopping parking stream...")
+        if pending:
+            _flush(stream, pending)
+    finally:
+        stop_event.set()
+        for source in sources:
+            if isinstance(source, SocketSource):
+                source.stop()
+        pool.closeall()
+
+    if stream.unserved:
+        print(f"{len(stream.unserved)} batches are in the lake but not yet in the warehouse; they are "
+              f"loaded by the next batch run")
+    print(f"Parking stream stopped: {stream.stats['batches']} batches, {stream.stats['rows']} rows, "
+          f"{stream.stats['rejected']} rejected, max latency {stream.stats['max_latency']:.2f}s")
+    return stream.stats
+
+def _flush(stream, items):
+    oldest = items[0][1]
+    try:
+        # Catálogo y grafo de linaje se escriben una vez por lote, no una por documento
+        with batched_index_updates():
+            rejected_by_file = stream.process_batch(items)
+    except Exception as e:
+        # Nada llegó al lake: los ficheros se vuelven a leer, las actualizaciones del socket se pierden
+        print(f"Error writing stream batch of {sum(len(item[0]) for item in items)} updates: {e}")
+        for _, _, name, source in items:
+            if source is not None:
+                source.retry(name)
+        return
+    for _, _, name, source in items:
+        if source is not None:
+            source.ack(name, rejected_by_file.get(name))
+    latency = time.monotonic() - oldest
+    rows = sum(len(item[0]) for item in items)
+    stream.stats['batches'] += 1
+    stream.stats['rows'] += rows
+    stream.stats['max_latency'] = max(stream.stats['max_latency'], latency)
+    print(f"Stream batch of {rows} updates committed ({latency:.2f}s after the oldest arrived)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Micro-batch ingestion of hourly parking occupancy.')
+    parser.add_argument('--directory', help='directory where update files are dropped')
+    parser.add_argument('--host', default='0.0.0.0', help='address of the socket source')
+    parser.add_argument('--port', type=int, help='port of the socket source (JSON lines)')
+    parser.add_argument('--batch-rows', type=int, default=STREAM_BATCH_ROWS, help='rows that close a micro-batch')
+    parser.add_argument('--max-latency', type=float, default=STREAM_MAX_LATENCY,
+                        help='seconds the oldest update of a batch may wait')
+    parser.add_argument('--compact-interval', type=float, default=STREAM_COMPACT_INTERVAL,
+                        help='seconds between compactions of the table')
+    parser.add_argument('--drain', action='store_true', help='process the files in the directory and exit')
+    args = parser.parse_args()
+    # docker stop envía SIGTERM: se trata como Ctrl+C para cerrar el lote abierto
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    run_stream(args.directory, args.host, args.port, args.batch_rows, args.max_latency,
+               args.compact_interval, args.drain)
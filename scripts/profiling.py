@@ -0,0 +1,211 @@
+"""
+Opt-in profiling of pipeline stages.
+
+Profiling is off by default. ``PIPELINE_PROFILE`` (or ``run_pipeline.py --profile``) lists
+the stages to profile, or ``all``; ``PIPELINE_PROFILERS`` (``--profilers``) chooses the
+profilers, all of them by default:
+
+    cpu    deterministic CPU profile (cProfile) of the stage's thread: cpu.pstats, cpu.txt
+    wall   sampling wall-clock profiler over every thread: wall.collapsed, wall.txt
+    alloc  allocation tracking (tracemalloc; Python and NumPy memory, not Arrow buffers): alloc.txt
+
+    PIPELINE_PROFILE=process,access python run_pipeline.py
+    python run_pipeline.py --profile access --profilers cpu alloc
+
+The artifacts are stored in the govern zone with the other records of the run:
+
+    govern-zone-metadata/runs/<run_id>/profiles/<stage>/<artifact>
+
+``wall.collapsed`` uses the folded-stack format of flamegraph.pl and speedscope; ``cpu.pstats``
+loads with ``pstats.Stats`` or snakeviz.
+"""
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import marshal
+import threading
+import tracemalloc
+import contextlib
+from collections import Counter
+
+PROFILE_BUCKET = 'govern-zone-metadata'
+RUNS_PREFIX = 'runs'
+PROFILERS = ['cpu', 'wall', 'alloc']
+WALL_SAMPLE_INTERVAL = 0.005  # segundos entre muestras del perfilador de tiempo real
+ALLOC_TRACEBACK_FRAMES = 10
+TOP_ENTRIES = 40
+# Marco superior de un hilo auxiliar ocioso (pool sin trabajo, cola vacía): no se muestrea
+IDLE_FRAMES = {('thread.py', '_worker'), ('threading.py', 'wait'), ('queue.py', 'get')}
+
+def _split(value):
+    if isinstance(value, str):
+        value = value.replace(',', ' ').split()
+    return [item.strip().lower() for item in value or [] if item.strip()]
+
+def profiled_stages(stages=None):
+    """Stages to profile: the given list or ``PIPELINE_PROFILE`` (``all`` for every stage)."""
+    return set(_split(stages if stages is not None else os.environ.get('PIPELINE_PROFILE', '')))
+
+def enabled_profilers(profilers=None):
+    """Profilers to run: the given list or ``PIPELINE_PROFILERS`` (all of them by default)."""
+    selected = _split(profilers if profilers is not None else os.environ.get('PIPELINE_PROFILERS', ''))
+    unknown = set(selected) - set(PROFILERS)
+    if unknown:
+        raise ValueError(f"Unknown profilers: {', '.join(sorted(unknown))} (expected {', '.join(PROFILERS)})")
+    return selected or list(PROFILERS)
+
+def is_profiled(stage, stages=None):
+    selected = profiled_stages(stages)
+    return 'all' in selected or stage in selected
+
+class _WallClockSampler(threading.Thread):
+    """Samples the Python stack of every thread at a fixed interval, counting identical stacks."""
+
+    def __init__(self, interval=WALL_SAMPLE_INTERVAL):
+        super().__init__(daemon=True, name='wall-profiler')
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            main_thread = threading.main_thread().ident
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident or names.get(thread_id) == 'memory-sampler':
+                    continue
+                if thread_id != main_thread and (os.path.basename(frame.f_code.co_filename),
+                                                 frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                # Formato "plegado": raíz primero, un hilo por raíz
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, top=TOP_ENTRIES):
+        """Functions by wall-clock samples where they are on top of the stack (self) and anywhere (total)."""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = [':'.join(frame.split(':')[:2]) for frame in stack.split(';')[1:]]
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        lines = [f"{self.samples} samples every {self.interval * 1000:.0f} ms (all threads, idle workers excluded)", '',
+                 f"{'self':>8} {'total':>8}  function"]
+        for frame, count in own.most_common(top):
+            lines.append(f"{count:>8} {total[frame]:>8}  {frame}")
+        lines += ['', f"{'total':>8}  function"]
+        for frame, count in total.most_common(top):
+            lines.append(f"{count:>8}  {frame}")
+        return '\n'.join(lines) + '\n'
+
+def _cpu_artifacts(profiler):
+    profiler.create_stats()
+    text = io.StringIO()
+    stats = pstats.Stats(profiler, stream=text)
+    stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+    stats.sort_stats('tottime').print_stats(TOP_ENTRIES)
+    # Mismo formato que Stats.dump_stats (Stats se queda con los datos del perfilador)
+    return {'cpu.pstats': marshal.dumps(stats.stats), 'cpu.txt': text.getvalue().encode('utf-8')}
+
+def _alloc_artifacts(snapshot, peak):
+    # Fuera las asignaciones de los propios perfiladores y de la importación de módulos
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, path) for path in
+        [tracemalloc.__file__, __file__, cProfile.__file__, pstats.__file__, '<frozen importlib._bootstrap*>']
+    ])
+    lines = [f"Peak traced memory: {peak / 1024 / 1024:.1f} MB", '', f"Top {TOP_ENTRIES} allocation sites still alive:"]
+    for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]:
+        lines.append(f"  {stat.size / 1024:>10.1f} KB {stat.count:>9} blocks  {stat.traceback[0]}")
+    lines += ['', "Top 10 allocation tracebacks:"]
+    for stat in snapshot.statistics('traceback')[:10]:
+        lines.append(f"  {stat.size / 1024:.1f} KB in {stat.count} blocks")
+        lines += [f"    {line}" for line in stat.traceback.format()]
+    return {'alloc.txt': ('\n'.join(lines) + '\n').encode('utf-8')}
+
+def store_profile_artifacts(run_id, stage, artifacts):
+    """Upload the profile artifacts of a stage; returns the object names written."""
+    from utils import get_minio_client
+
+    client = get_minio_client()
+    if not client.bucket_exists(PROFILE_BUCKET):
+        client.make_bucket(PROFILE_BUCKET)
+    stored = []
+    for name, data in artifacts.items():
+        object_name = f"{RUNS_PREFIX}/{run_id}/profiles/{stage}/{name}"
+        client.put_object(PROFILE_BUCKET, object_name, io.BytesIO(data), length=len(data),
+                          content_type='text/plain' if name.endswith(('.txt', '.collapsed')) else 'application/octet-stream')
+        stored.append(object_name)
+    return stored
+
+@contextlib.contextmanager
+def profile_stage(stage, run_id, profilers=None, stored=None):
+    """Profile the block with the selected profilers and store the artifacts of ``stage``.
+
+    The object names written are appended to ``stored`` (if given). Profiling or storage
+    errors are reported but never fail the stage.
+    """
+    profilers = enabled_profilers(profilers)
+    print(f"Profiling stage '{stage}' ({', '.join(profilers)})")
+    cpu = cProfile.Profile() if 'cpu' in profilers else None
+    wall = _WallClockSampler() if 'wall' in profilers else None
+    tracing = 'alloc' in profilers and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start(ALLOC_TRACEBACK_FRAMES)
+    if wall is not None:
+        wall.start()
+    started = time.perf_counter()
+    if cpu is not None:
+        cpu.enable()
+    try:
+        yield
+    finally:
+        if cpu is not None:
+            cpu.disable()
+        elapsed = time.perf_counter() - started
+        if wall is not None:
+            wall.stop()
+        artifacts = {}
+        try:
+            if tracing:
+                # Antes de construir los demás informes, que también asignan memoria
+                peak = tracemalloc.get_traced_memory()[1]
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                tracing = False
+                artifacts.update(_alloc_artifacts(snapshot, peak))
+            if cpu is not None:
+                artifacts.update(_cpu_artifacts(cpu))
+            if wall is not None:
+                artifacts['wall.collapsed'] = wall.collapsed().encode('utf-8')
+                artifacts['wall.txt'] = wall.report().encode('utf-8')
+        except Exception as e:
+            print(f"Error building the profile of stage '{stage}': {e}")
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        try:
+            objects = store_profile_artifacts(run_id, stage, artifacts)
+            if stored is not None:
+                stored.extend(objects)
+            print(f"Profile of stage '{stage}' ({elapsed:.2f}s) stored in "
+                  f"{PROFILE_BUCKET}/{RUNS_PREFIX}/{run_id}/profiles/{stage}/")
+        except Exception as e:
+            print(f"Error storing the profile of stage '{stage}': {e}")
@@ -0,0 +1,179 @@
+"""
+Columnar history of data quality results.
+
+Each quality run is appended as a small Parquet file to a hive-partitioned dataset in the
+govern zone:
+
+    govern-zone-metadata/quality-history/fecha=YYYY-MM-DD/dataset=<name>/run_<timestamp>_<id>.parquet
+
+so reports only read the partitions of the requested dates and datasets. The trend helpers
+(pass rate over time, first failure of the current failing streak and regression alerts)
+work on the resulting one-row-per-check table.
+
+Results stored before the history existed (only as ``quality/`` JSON documents) are imported
+once by ``backfill_quality_history``; the ``_backfill.json`` marker records the import.
+"""
+from utils import fetch_prefix_documents, get_minio_client
+from metrics import timed
+from lake_query import scan
+import pandas as pd
+import hashlib
+import io
+import json
+import uuid
+
+QUALITY_BUCKET = 'govern-zone-metadata'
+QUALITY_PREFIX = 'quality-history'
+BACKFILL_MARKER = f'{QUALITY_PREFIX}/_backfill.json'
+CHECK_KEY = ['dataset', 'check_type', 'column']
+
+def quality_rows(quality_results, run_id=None):
+    """One row per check of a ``validate_data_quality`` result."""
+    run_id = run_id or uuid.uuid4().hex[:12]
+    return pd.DataFrame([
+        {
+            'run_id': run_id,
+            'timestamp': pd.Timestamp(quality_results['timestamp']),
+            'row_count': int(quality_results['row_count']),
+            'check_type': check['check'],
+            'column': check['column'],
+            'passed': bool(check['passed']),
+            'details': check['details']
+        }
+        for check in quality_results['checks']
+    ], columns=['run_id', 'timestamp', 'row_count', 'check_type', 'column', 'passed', 'details'])
+
+def append_quality_results(quality_results):
+    """Append one quality run to the history dataset; returns the object written (or None)."""
+    rows = quality_rows(quality_results)
+    if rows.empty:
+        return None
+    timestamp = rows['timestamp'].iloc[0]
+    # Las columnas de partición (fecha, dataset) van en la ruta, no dentro del fichero
+    dataset = quality_results['dataset'].replace('/', '_')
+    object_name = (f"{QUALITY_PREFIX}/fecha={timestamp.strftime('%Y-%m-%d')}/dataset={dataset}/"
+                   f"run_{timestamp.strftime('%Y%m%d_%H%M%S')}_{rows['run_id'].iloc[0]}.parquet")
+
+    _write_rows(get_minio_client(), object_name, rows)
+    return object_name
+
+def _write_rows(client, object_name, rows):
+    buffer = io.BytesIO()
+    rows.to_parquet(buffer, index=False)
+    data = buffer.getvalue()
+    if not client.bucket_exists(QUALITY_BUCKET):
+        client.make_bucket(QUALITY_BUCKET)
+    with timed('quality_history_write') as op:
+        client.put_object(QUALITY_BUCKET, object_name, io.BytesIO(data), length=len(data),
+                          content_type='application/octet-stream')
+        op.add(bytes=len(data), rows=len(rows))
+
+def _backfill_done(client):
+    try:
+        client.stat_object(QUALITY_BUCKET, BACKFILL_MARKER)
+        return True
+    except Exception:
+        return False
+
+def backfill_quality_history(client=None):
+    """Import the ``quality/`` results older than the history, once; returns how many runs were imported.
+
+    Every run written since the history exists is already in it, so only the documents
+    older than its first run are imported. Their run ids derive from the document name and
+    the files are named after their content, so an interrupted import can simply be repeated.
+    """
+    client = client or get_minio_client()
+    if not client.bucket_exists(QUALITY_BUCKET) or _backfill_done(client):
+        return 0
+    history = read_quality_history()
+    first_run = pd.Timestamp(history['timestamp'].min()) if not history.empty else None
+
+    partitions = {}
+    imported = 0
+    for object_name, quality_check, error in fetch_prefix_documents(QUALITY_BUCKET, 'quality/'):
+        if error is not None:
+            print(f"Error reading quality check for {object_name}: {error}")
+            continue
+        try:
+            if first_run is not None and pd.Timestamp(quality_check['timestamp']) >= first_run:
+                continue
+            rows = quality_rows(quality_check, run_id=hashlib.sha256(object_name.encode('utf-8')).hexdigest()[:12])
+        except Exception as e:
+            print(f"Error reading quality check for {object_name}: {e}")
+            continue
+        if rows.empty:
+            continue
+        key = (rows['timestamp'].iloc[0].strftime('%Y-%m-%d'), quality_check['dataset'].replace('/', '_'))
+        partitions.setdefault(key, []).append(rows)
+        imported += 1
+
+    # Un fichero por partición en lugar de uno por ejecución
+    for (fecha, dataset), frames in sorted(partitions.items()):
+        rows = pd.concat(frames, ignore_index=True).sort_values('timestamp')
+        digest = hashlib.sha256(','.join(sorted(rows['run_id'].unique())).encode('utf-8')).hexdigest()[:12]
+        _write_rows(client, f"{QUALITY_PREFIX}/fecha={fecha}/dataset={dataset}/backfill_{digest}.parquet", rows)
+
+    marker = json.dumps({'imported_at': pd.Timestamp.now().isoformat(), 'runs': imported,
+                         'before': None if first_run is None else first_run.isoformat()}).encode('utf-8')
+    client.put_object(QUALITY_BUCKET, BACKFILL_MARKER, io.BytesIO(marker), length=len(marker),
+                      content_type='application/json')
+    print(f"Quality history backfilled with {imported} runs from quality/")
+    return imported
+
+def read_quality_history(start=None, end=None, datasets=None, filesystem=None):
+    """Read the checks of a date range and set of datasets, pruning the other partitions."""
+    filters = []
+    if start is not None:
+        filters.append(('fecha', '>=', str(start)))
+    if end is not None:
+        filters.append(('fecha', '<=', str(end)))
+    if datasets is not None:
+        filters.append(('dataset', 'in', [d.replace('/', '_') for d in datasets]))
+    try:
+        history = scan(f"{QUALITY_BUCKET}/{QUALITY_PREFIX}/", filters=filters or None, filesystem=filesystem).to_pandas()
+    except (FileNotFoundError, OSError):
+        return pd.DataFrame(columns=['run_id', 'timestamp', 'row_count', 'check_type', 'column',
+                                     'passed', 'details', 'fecha', 'dataset'])
+    for column in ('fecha', 'dataset'):
+        history[column] = history[column].astype(str)
+    # Durante el periodo de gracia de una compactación una ejecución puede estar en dos ficheros
+    history = history.drop_duplicates(['run_id', 'check_type', 'column'])
+    return history.sort_values('timestamp').reset_index(drop=True)
+
+def pass_rate_trend(history, freq='D'):
+    """Pass rate per dataset and check type for each period (``freq`` is a pandas offset alias)."""
+    if history.empty:
+        return pd.DataFrame(columns=['periodo', 'dataset', 'check_type', 'checks', 'passed', 'pass_rate'])
+    periodo = pd.to_datetime(history['timestamp']).dt.to_period(freq).dt.start_time.rename('periodo')
+    trend = history.groupby([periodo, 'dataset', 'check_type'])['passed'].agg(['size', 'sum']).reset_index()
+    trend.columns = ['periodo', 'dataset', 'check_type', 'checks', 'passed']
+    trend['pass_rate'] = trend['passed'] / trend['checks'] * 100
+    return trend
+
+def first_failures(history):
+    """Checks failing in their latest run, with the timestamp their current failing streak started."""
+    if history.empty:
+        return pd.DataFrame(columns=CHECK_KEY + ['failing_since', 'failed_runs', 'last_details'])
+    history = history.sort_values('timestamp')
+    # Cada aprobado abre un nuevo tramo; el tramo actual es el posterior al último aprobado
+    streak = history.groupby(CHECK_KEY)['passed'].cumsum()
+    latest_streak = streak.groupby([history[k] for k in CHECK_KEY]).transform('max')
+    current = history[(streak == latest_streak) & ~history['passed']]
+    failing = current.groupby(CHECK_KEY).agg(
+        failing_since=('timestamp', 'min'),
+        failed_runs=('timestamp', 'size'),
+        last_details=('details', 'last')
+    ).reset_index()
+    still_failing = history.groupby(CHECK_KEY)['passed'].last().reset_index()
+    still_failing = still_failing[~still_failing['passed']][CHECK_KEY]
+    return failing.merge(still_failing, on=CHECK_KEY)
+
+def regression_alerts(history):
+    """Checks that passed in their previous run and failed in the latest one."""
+    if history.empty:
+        return pd.DataFrame(columns=CHECK_KEY + ['timestamp', 'details'])
+    history = history.sort_values('timestamp')
+    previous = history.groupby(CHECK_KEY)['passed'].shift(1)
+    is_last = ~history.duplicated(CHECK_KEY, keep='last')
+    regressions = history[is_last & ~history['passed'] & (previous == True)]
+    return regressions[CHECK_KEY + ['timestamp', 'details']].reset_index(drop=True)
@@ -0,0 +1,229 @@
+"""
+Result cache for lake queries.
+
+A result is keyed by the normalized query plus the ETags of every object it reads (the
+current snapshot for tables), so a cached answer is only reused while its inputs are
+byte-for-byte the same. Results are
+stored as Parquet under ``access-zone/query-cache/`` with a JSON index, evicted by total
+size and age, and dropped as soon as ``log_data_transformation`` records a new write to
+one of their inputs. Every read-modify-write of the index runs under the
+``query-cache/_index.lease`` object lease, so concurrent processes do not drop each other's
+entries. Recent results are also kept in memory, so a warm query costs one object listing
+per input dataset.
+"""
+from utils import get_minio_client
+from lake_query import aggregate, dataset_location, referenced_datasets, sql
+from tables import load_pointer
+from storage import object_lease
+from collections import OrderedDict
+import pandas as pd
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+
+CACHE_BUCKET = 'access-zone'
+CACHE_PREFIX = 'query-cache'
+CACHE_INDEX_LEASE = f'{CACHE_PREFIX}/_index.lease'
+CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+CACHE_MAX_AGE = int(os.environ.get('QUERY_CACHE_MAX_AGE', str(24 * 3600)))
+CACHE_MEMORY_ENTRIES = int(os.environ.get('QUERY_CACHE_MEMORY_ENTRIES', '32'))
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+
+# Literales de texto e identificadores entre comillas (las comillas duplicadas son escapes)
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+def normalize_sql(query):
+    """Collapse whitespace and case outside quotes and drop the trailing semicolon.
+
+    String literals and quoted identifiers are kept as written.
+    """
+    parts = _QUOTED.split(query.strip().rstrip(';'))
+    # Las partes impares son texto entre comillas y se conservan tal cual
+    for index in range(0, len(parts), 2):
+        parts[index] = re.sub(r'\s+', ' ', parts[index]).lower()
+    return ''.join(parts).strip()
+
+def input_etags(client, datasets):
+    """ETags of every object read by the given datasets, as ``{bucket/object: etag}``."""
+    etags = {}
+    for name in sorted(set(datasets)):
+        bucket, path = dataset_location(name)
+        pointer = None if path.endswith('/') else load_pointer(bucket, path, client)
+        if pointer is not None:
+            # Tabla: el snapshot actual identifica todo su contenido, sin listar el bucket
+            etags[f"{bucket}/{path}"] = f"snapshot:{pointer['current_snapshot']}"
+            continue
+        for obj in client.list_objects(bucket, prefix=path, recursive=True):
+            if path.endswith('/') or obj.object_name == path:
+                etags[f"{bucket}/{obj.object_name}"] = obj.etag
+    return etags
+
+def _read_index(client):
+    try:
+        response = client.get_object(CACHE_BUCKET, f"{CACHE_PREFIX}/_index.json")
+        try:
+            return json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return {'entries': {}}
+
+def _write_index(client, index):
+    index_json = json.dumps(index).encode('utf-8')
+    client.put_object(CACHE_BUCKET, f"{CACHE_PREFIX}/_index.json", io.BytesIO(index_json),
+                      length=len(index_json), content_type='application/json')
+
+def _remember(key, df):
+    _memory[key] = df
+    _memory.move_to_end(key)
+    while len(_memory) > CACHE_MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+
+def _evict(client, index, now):
+    """Drop expired entries, then the least recently used ones until the cache fits its size budget."""
+    entries = index['entries']
+    expired = [key for key, entry in entries.items() if now - entry['created_at'] > CACHE_MAX_AGE]
+    by_access = sorted((key for key in entries if key not in expired), key=lambda key: entries[key]['last_access'])
+    total = sum(entries[key]['size'] for key in by_access)
+    while by_access and total > CACHE_MAX_BYTES:
+        key = by_access.pop(0)
+        total -= entries[key]['size']
+        expired.append(key)
+    _remove_entries(client, index, expired)
+    return expired
+
+def _remove_entries(client, index, keys):
+    for key in keys:
+        entry = index['entries'].pop(key, None)
+        _memory.pop(key, None)
+        if entry is not None:
+            try:
+                client.remove_object(CACHE_BUCKET, entry['object'])
+            except Exception as e:
+                print(f"Error removing cached result {entry['object']}: {e}")
+
+def cached_query(spec, datasets, compute):
+    """Return the cached result of ``spec`` over ``datasets``, or compute and store it.
+
+    ``spec`` is the normalized description of the query and ``compute`` the function that
+    produces the result DataFrame on a miss.
+    """
+    client = get_minio_client()
+    etags = input_etags(client, datasets)
+    key = hashlib.sha256(json.dumps({'query': spec, 'inputs': etags}, sort_keys=True).encode('utf-8')).hexdigest()
+
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key].copy()
+
+    index = _read_index(client)
+    entry = index['entries'].get(key)
+    now = time.time()
+    if entry is not None and now - entry['created_at'] <= CACHE_MAX_AGE:
+        try:
+            response = client.get_object(CACHE_BUCKET, entry['object'])
+            try:
+                df = pd.read_parquet(io.BytesIO(response.read()))
+            finally:
+                response.close()
+                response.release_conn()
+            with _lock:
+                _remember(key, df)
+            # Solo persistimos el último acceso si ha pasado un rato, para no escribir el índice en cada acierto
+            if now - entry['last_access'] > 60:
+                with object_lease(client, CACHE_BUCKET, CACHE_INDEX_LEASE):
+                    index = _read_index(client)
+                    if key in index['entries']:
+                        index['entries'][key]['last_access'] = now
+                        _write_index(client, index)
+            return df.copy()
+        except Exception as e:
+            print(f"Error reading cached result {entry['object']}, recomputing: {e}")
+
+    df = compute()
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    data = buffer.getvalue()
+    object_name = f"{CACHE_PREFIX}/{key}.parquet"
+    client.put_object(CACHE_BUCKET, object_name, io.BytesIO(data), length=len(data),
+                      content_type='application/octet-stream')
+
+    with object_lease(client, CACHE_BUCKET, CACHE_INDEX_LEASE):
+        index = _read_index(client)
+        index['entries'][key] = {
+            'object': object_name,
+            'query': spec,
+            'inputs': sorted(etags),
+            'size': len(data),
+            'created_at': now,
+            'last_access': now
+        }
+        with _lock:
+            _evict(client, index, now)
+        _write_index(client, index)
+    with _lock:
+        _remember(key, df)
+    return df.copy()
+
+def cached_sql(query, filesystem=None):
+    """``lake_query.sql`` through the result cache."""
+    return cached_query(
+        {'sql': normalize_sql(query)},
+        referenced_datasets(query),
+        lambda: sql(query, filesystem)
+    )
+
+def cached_aggregate(name, by, aggregations, filters=None, filesystem=None):
+    """``lake_query.aggregate`` through the result cache."""
+    spec = json.loads(json.dumps({
+        'aggregate': name,
+        'by': list(by),
+        'aggregations': aggregations,
+        'filters': filters
+    }, sort_keys=True, default=str))
+    return cached_query(spec, [name], lambda: aggregate(name, by, aggregations, filters, filesystem))
+
+def invalidate_targets(targets):
+    """Drop every cached result that reads one of the ``(bucket, object_name)`` targets (objects or prefixes).
+
+    The index is read and written once, whatever the number of targets.
+    """
+    targets = sorted({f"{bucket}/{object_name}" for bucket, object_name in targets})
+    if not targets:
+        return 0
+    client = get_minio_client()
+    with object_lease(client, CACHE_BUCKET, CACHE_INDEX_LEASE):
+        index = _read_index(client)
+        stale = [
+            key for key, entry in index['entries'].items()
+            if any(path == target or path.startswith(target.rstrip('/') + '/')
+                   for path in entry['inputs'] for target in targets)
+        ]
+        if stale:
+            with _lock:
+                _remove_entries(client, index, stale)
+            _write_index(client, index)
+    if stale:
+        print(f"Query cache: {len(stale)} results invalidated by writes to {', '.join(targets)}")
+    return len(stale)
+
+def invalidate_inputs(bucket, object_name):
+    """Drop every cached result that reads ``bucket/object_name`` (an object or a prefix)."""
+    return invalidate_targets([(bucket, object_name)])
+
+def clear_cache():
+    """Remove every cached result."""
+    client = get_minio_client()
+    with object_lease(client, CACHE_BUCKET, CACHE_INDEX_LEASE):
+        index = _read_index(client)
+        with _lock:
+            _remove_entries(client, index, list(index['entries']))
+        _write_index(client, index)
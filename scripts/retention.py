@@ -0,0 +1,223 @@
+"""
+Retention enforcement for the data lake zones.
+
+Reads the retention periods published by ``04_govern_zone.create_security_policy`` in
+``govern-zone-security/policies/data_lake_security_policy.yaml`` and removes the objects
+that outlived them. An object ages from its last modification time (also inside
+``fecha=YYYY-MM-DD`` partitions: a partition of old dates loaded today is fresh data).
+
+The pseudonymization secret (``secrets/``) is never removed either.
+
+Tables (``tables``) are never cut from under their readers: their pointer, lease, retained
+manifests and every data file a retained snapshot references are kept, and their data goes
+when the snapshots that use it expire. Only orphaned table files age out here.
+
+Deletes go out in batched multi-object requests. The derived datasets forget the partitions
+they lost (rollup state, sketch and OD manifests), so their next run rebuilds them instead of
+trusting the old fingerprints. The catalog entries and lineage nodes of
+the removed datasets are tombstoned (not dropped), and every enforcement run is written to
+``govern-zone-security/audit/``. ``dry_run`` only reports what would be removed and the
+bytes it would reclaim.
+"""
+from utils import batched_index_updates, get_minio_client, store_object_metadata
+from catalog import read_catalog
+from lineage_graph import tombstone_lineage
+from tables import POINTER_OBJECT, referenced_objects
+from rollups import forget_partitions as forget_rollup_partitions
+from sketches import forget_partitions as forget_sketch_partitions
+from od_matrix import forget_buckets as forget_od_buckets
+from minio.deleteobjects import DeleteObject
+import io
+import re
+import json
+import datetime
+import argparse
+import yaml
+
+POLICY_BUCKET = 'govern-zone-security'
+POLICY_OBJECT = 'policies/data_lake_security_policy.yaml'
+AUDIT_PREFIX = 'audit'
+DELETE_BATCH_SIZE = 1000  # máximo de claves por petición DeleteObjects de S3
+
+# Objetos que nunca se borran, aunque su zona tenga caducidad
+PROTECTED_PREFIXES = {
+    # secrets/: el secreto de la seudonimización (si caducara cambiarían todos los hashes de usuario)
+    POLICY_BUCKET: ('policies/', f'{AUDIT_PREFIX}/', 'secrets/'),
+}
+
+PERIOD_UNITS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+
+def parse_retention(value):
+    """``'90 days'`` -> ``timedelta(days=90)``; ``'permanent'`` (or anything unparseable) -> None."""
+    match = re.fullmatch(r'\s*(\d+)\s*(day|week|month|year)s?\s*', str(value).lower())
+    if not match:
+        return None
+    return datetime.timedelta(days=int(match.group(1)) * PERIOD_UNITS[match.group(2)])
+
+def load_retention_policy(client=None):
+    """Retention period per bucket from the published security policy (None = keep forever)."""
+    client = client or get_minio_client()
+    response = client.get_object(POLICY_BUCKET, POLICY_OBJECT)
+    try:
+        policy = yaml.safe_load(response.read().decode('utf-8'))
+    finally:
+        response.close()
+        response.release_conn()
+    return {
+        bucket: parse_retention(zone.get('retention_policy', 'permanent'))
+        for bucket, zone in policy.get('zones', {}).items()
+    }
+
+def object_date(obj):
+    """Date an object ages from: its last modification time."""
+    return obj.last_modified
+
+def table_objects(client, bucket, object_names):
+    """Objects of the tables found among ``object_names`` that their retained snapshots still need."""
+    in_use = set()
+    for object_name in object_names:
+        if object_name == POINTER_OBJECT or object_name.endswith(f'/{POINTER_OBJECT}'):
+            in_use |= referenced_objects(bucket, object_name[:-len(POINTER_OBJECT)], client)
+    return in_use
+
+def find_expired(client, bucket, retention, now):
+    """``(object_name, size, date)`` of every object of ``bucket`` older than ``retention``.
+
+    Objects that a table still references are never returned.
+    """
+    cutoff = now - retention
+    protected = PROTECTED_PREFIXES.get(bucket, ())
+    objects = [obj for obj in client.list_objects(bucket, recursive=True) if not obj.is_dir]
+    in_use = table_objects(client, bucket, [obj.object_name for obj in objects])
+    expired = []
+    for obj in objects:
+        if obj.object_name.startswith(protected) or obj.object_name in in_use:
+            continue
+        date = object_date(obj)
+        if date is not None and date < cutoff:
+            expired.append((obj.object_name, obj.size or 0, date))
+    return expired
+
+def delete_objects(client, bucket, object_names):
+    """Remove objects in batches of ``DELETE_BATCH_SIZE``; returns the names that failed."""
+    failed = []
+    for start in range(0, len(object_names), DELETE_BATCH_SIZE):
+        batch = [DeleteObject(name) for name in object_names[start:start + DELETE_BATCH_SIZE]]
+        # remove_objects es perezoso: hay que consumir el iterador para que se envíe la petición
+        for error in client.remove_objects(bucket, batch):
+            print(f"Error deleting {bucket}/{error.name}: {error.message}")
+            failed.append(error.name)
+    return failed
+
+def forget_derived_partitions(client, bucket, deleted):
+    """Remove the deleted partitions from the state of the derived datasets; returns how many were dropped."""
+    forgotten = 0
+    for forget in (forget_rollup_partitions, forget_sketch_partitions, forget_od_buckets):
+        try:
+            forgotten += forget(client, bucket, deleted)
+        except Exception as e:
+            print(f"Error updating the state of the derived datasets of {bucket} ({forget.__module__}): {e}")
+    return forgotten
+
+def retired_datasets(client, catalog, deleted):
+    """Catalog datasets left without data: deleted objects, or prefixes with no object left."""
+    retired = set(deleted)
+    if catalog is not None:
+        live = catalog[catalog['deleted_at'].isna()]
+        for bucket, object_name in zip(live['source_bucket'], live['object_name']):
+            if not object_name.endswith('/') or (bucket, object_name) in retired:
+                continue
+            touched = any(b == bucket and o.startswith(object_name) for b, o in deleted)
+            if touched and next(iter(client.list_objects(bucket, prefix=object_name, recursive=True)), None) is None:
+                retired.add((bucket, object_name))
+    return retired
+
+def tombstone_catalog(catalog, datasets, deleted_at, reason):
+    """Mark the metadata (and catalog rows) of deleted datasets; returns how many were marked."""
+    if catalog is None:
+        return 0
+    marked = 0
+    with batched_index_updates():
+        for bucket, object_name, metadata_json in zip(catalog['source_bucket'], catalog['object_name'],
+                                                      catalog['metadata_json']):
+            if (bucket, object_name) not in datasets:
+                continue
+            metadata = json.loads(metadata_json)
+            if metadata.get('deleted_at'):
+                continue
+            metadata.update({'deleted_at': deleted_at, 'deletion_reason': reason})
+            store_object_metadata(bucket, object_name, metadata)
+            marked += 1
+    return marked
+
+def _write_audit(client, report):
+    data = json.dumps(report, default=str).encode('utf-8')
+    audit_object = f"{AUDIT_PREFIX}/retention_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    client.put_object(POLICY_BUCKET, audit_object, io.BytesIO(data), length=len(data),
+                      content_type='application/json')
+    return audit_object
+
+def enforce_retention(dry_run=True, now=None, buckets=None):
+    """Apply the retention policy to every zone (or ``buckets``); returns a per-bucket report."""
+    client = get_minio_client()
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    policy = load_retention_policy(client)
+    report = {'timestamp': now.isoformat(), 'dry_run': dry_run, 'buckets': {}, 'bytes_reclaimed': 0}
+    deleted = []
+
+    for bucket, retention in policy.items():
+        if buckets is not None and bucket not in buckets:
+            continue
+        if retention is None:
+            print(f"{bucket}: permanent retention, skipped")
+            continue
+        if not client.bucket_exists(bucket):
+            continue
+        expired = find_expired(client, bucket, retention, now)
+        expired_bytes = sum(size for _, size, _ in expired)
+        failed = set()
+        forgotten = 0
+        if expired and not dry_run:
+            failed = set(delete_objects(client, bucket, [name for name, _, _ in expired]))
+            deleted += [(bucket, name) for name, _, _ in expired if name not in failed]
+            forgotten = forget_derived_partitions(client, bucket, [name for name, _, _ in expired if name not in failed])
+        reclaimed = sum(size for name, size, _ in expired if name not in failed)
+        report['buckets'][bucket] = {
+            'retention_days': retention.days,
+            'cutoff': (now - retention).isoformat(),
+            'expired_objects': len(expired),
+            'failed_objects': len(failed),
+            'forgotten_partitions': forgotten,
+            'bytes': reclaimed
+        }
+        report['bytes_reclaimed'] += reclaimed
+        action = 'would reclaim' if dry_run else 'reclaimed'
+        print(f"{bucket}: {len(expired)} objects older than {retention.days} days, "
+              f"{action} {reclaimed / 1024 / 1024:.2f} MB")
+        if dry_run:
+            for name, size, date in expired[:10]:
+                print(f"  - {name} ({size} bytes, {date:%Y-%m-%d})")
+            if len(expired) > 10:
+                print(f"  ... and {len(expired) - 10} more")
+
+    if dry_run or not deleted:
+        return report
+
+    # Lápidas en el catálogo y el linaje para los datasets que se han quedado sin datos
+    reason = 'retention policy expired'
+    catalog = read_catalog(client)
+    datasets = retired_datasets(client, catalog, deleted)
+    deleted_at = now.isoformat()
+    report['catalog_tombstones'] = tombstone_catalog(catalog, datasets, deleted_at, reason)
+    report['lineage_tombstones'] = tombstone_lineage(sorted(datasets), deleted_at, reason)
+    report['audit_object'] = _write_audit(client, report)
+    print(f"Tombstoned {report['catalog_tombstones']} catalog entries and "
+          f"{report['lineage_tombstones']} lineage nodes; audit log in {POLICY_BUCKET}/{report['audit_object']}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Enforce the data lake retention policy.')
+    parser.add_argument('--apply', action='store_true', help='delete the expired objects (default: dry run)')
+    parser.add_argument('--bucket', action='append', help='limit enforcement to this bucket (repeatable)')
+    args = parser.parse_args()
+    enforce_retention(dry_run=not args.apply, buckets=args.bucket)
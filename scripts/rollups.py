@@ -0,0 +1,293 @@
+"""
+Pre-aggregated rollup cubes for the access zone.
+
+Each cube is stored at one or more grains as a small Parquet dataset partitioned by date:
+
+    access-zone/rollups/<cube>/<grain>/fecha=YYYY-MM-DD/part.parquet
+
+Measures are kept as mergeable partials (sum, count, min, max and per-category counts),
+so coarser answers are obtained by re-aggregating the partials and new data can be folded
+into the affected cells without recomputing the whole cube.
+"""
+from utils import get_minio_client, log_data_transformation, store_object_metadata
+from column_stats import table_statistics
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import io
+import re
+import json
+import datetime
+
+ROLLUPS_BUCKET = 'access-zone'
+ROLLUPS_PREFIX = 'rollups'
+
+def _traffic_hour(df):
+    df = df.copy()
+    df['hora'] = [t.hour if t is not None else None for t in df['hora']]
+    return df
+
+# Definición de los cubos: dimensiones de cada grano, medidas numéricas y columnas categóricas
+CUBES = {
+    'trafico': {
+        'partition': 'fecha',
+        'prepare': _traffic_hour,
+        'grains': {
+            'sensor_hora': ['fecha', 'hora', 'sensor_id'],
+            'hora': ['fecha', 'hora'],
+        },
+        'measures': ['total_vehiculos', 'coches', 'motos', 'camiones', 'buses'],
+        'categories': ['nivel_congestion'],
+    },
+    'ocupacion_parkings': {
+        'partition': 'fecha',
+        'prepare': None,
+        'grains': {
+            'aparcamiento_hora': ['fecha', 'hora', 'distrito_id', 'aparcamiento_id'],
+            'distrito_hora': ['fecha', 'hora', 'distrito_id'],
+        },
+        'measures': ['plazas_ocupadas', 'porcentaje_ocupacion'],
+        'categories': ['nivel_congestion'],
+    },
+    'usos_bicimad': {
+        'partition': 'fecha',
+        'prepare': None,
+        'grains': {
+            'tipo_usuario_estacion': ['fecha', 'tipo_usuario', 'estacion_origen'],
+            'tipo_usuario': ['fecha', 'tipo_usuario'],
+        },
+        'measures': ['duracion_segundos', 'distancia_km', 'calorias_estimadas', 'co2_evitado_gramos'],
+        'categories': [],
+    },
+}
+
+def _partition_object(cube_name, grain, partition_value):
+    return f"{ROLLUPS_PREFIX}/{cube_name}/{grain}/fecha={partition_value}/part.parquet"
+
+def _state_object(cube_name):
+    return f"{ROLLUPS_PREFIX}/{cube_name}/_state.json"
+
+def forget_partitions(client, bucket, deleted):
+    """Drop the state of the cube partitions among the ``deleted`` objects; returns how many were dropped.
+
+    Called by the retention engine, so a later run rebuilds those dates instead of trusting
+    their old fingerprints.
+    """
+    if bucket != ROLLUPS_BUCKET:
+        return 0
+    forgotten = 0
+    for cube_name in CUBES:
+        gone = [name for name in deleted if name.startswith(f"{ROLLUPS_PREFIX}/{cube_name}/")]
+        if not gone:
+            continue
+        state = _read_json(client, _state_object(cube_name), None)
+        if state is None:
+            continue
+        for object_name in gone:
+            state.get('stats', {}).pop(object_name, None)
+            match = re.search(r'/fecha=([^/]+)/', object_name)
+            # Basta con que falte un grano para que la partición deba recalcularse entera
+            if match and match.group(1) in state['partitions']:
+                del state['partitions'][match.group(1)]
+                forgotten += 1
+        _put(client, _state_object(cube_name), json.dumps(state).encode('utf-8'), 'application/json')
+    return forgotten
+
+def _read_json(client, object_name, default):
+    try:
+        response = client.get_object(ROLLUPS_BUCKET, object_name)
+        try:
+            return json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return default
+
+def _read_parquet(client, object_name):
+    try:
+        response = client.get_object(ROLLUPS_BUCKET, object_name)
+        try:
+            return pd.read_parquet(io.BytesIO(response.read()))
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return None
+
+def _put(client, object_name, data, content_type):
+    client.put_object(ROLLUPS_BUCKET, object_name, io.BytesIO(data), length=len(data), content_type=content_type)
+
+def aggregate_partials(df, dimensions, measures, categories):
+    """Aggregate row-level data into mergeable partials at the given grain."""
+    aggregations = {'filas': (measures[0] if measures else dimensions[0], 'size')}
+    for measure in measures:
+        aggregations[f'{measure}_sum'] = (measure, 'sum')
+        aggregations[f'{measure}_count'] = (measure, 'count')
+        aggregations[f'{measure}_min'] = (measure, 'min')
+        aggregations[f'{measure}_max'] = (measure, 'max')
+    partials = df.groupby(dimensions, dropna=False).agg(**aggregations).reset_index()
+
+    # Recuento por categoría: permite calcular la moda sobre cualquier combinación de celdas
+    for category in categories:
+        counts = pd.crosstab([df[d] for d in dimensions], df[category].fillna('N/A'))
+        counts.columns = [f'{category}__{value}' for value in counts.columns]
+        partials = partials.merge(counts.reset_index(), on=dimensions, how='left')
+    return partials
+
+def merge_partials(partials, dimensions):
+    """Merge partial aggregates that share the same cells (sum/count/min/max are mergeable)."""
+    aggregations = {}
+    for column in partials.columns:
+        if column in dimensions:
+            continue
+        if column.endswith('_min'):
+            aggregations[column] = 'min'
+        elif column.endswith('_max'):
+            aggregations[column] = 'max'
+        else:
+            aggregations[column] = 'sum'
+    merged = partials.groupby(dimensions, dropna=False).agg(aggregations).reset_index()
+    count_columns = [c for c in merged.columns if '__' in c]
+    merged[count_columns] = merged[count_columns].fillna(0)
+    return merged
+
+def _upsert_cells(client, object_name, df, dimensions, spec):
+    """Finest-grain partials of a partition with the cells of ``df`` replaced by its new values."""
+    partials = aggregate_partials(df, dimensions, spec['measures'], spec['categories'])
+    existing = _read_parquet(client, object_name)
+    if existing is None or existing.empty:
+        return partials
+    keys = pd.MultiIndex.from_frame(partials[dimensions])
+    kept = existing[~pd.MultiIndex.from_frame(existing[dimensions]).isin(keys)]
+    cells = pd.concat([kept, partials], ignore_index=True)
+    count_columns = [c for c in cells.columns if '__' in c]
+    cells[count_columns] = cells[count_columns].fillna(0)
+    return cells.sort_values(dimensions).reset_index(drop=True)
+
+def _fingerprint(df):
+    return str(int(pd.util.hash_pandas_object(df, index=False).sum()))
+
+def update_cube(cube_name, df, batch_id, mode='replace'):
+    """Fold a batch of row-level data into the cube, rewriting only the affected partitions.
+
+    ``mode='replace'`` treats the batch as the full content of the dates it contains (the
+    current pipeline uploads whole snapshots), so partitions whose data did not change are
+    skipped. ``mode='merge'`` adds the batch to the existing cells (append-only micro-batches).
+    ``mode='upsert'`` replaces the cells of the finest grain (the first one) that the batch
+    contains and derives the coarser grains from it, so a corrected or redelivered row
+    counts once. A batch already applied to the cube is ignored.
+    """
+    spec = CUBES[cube_name]
+    client = get_minio_client()
+    if not client.bucket_exists(ROLLUPS_BUCKET):
+        client.make_bucket(ROLLUPS_BUCKET)
+
+    state = _read_json(client, _state_object(cube_name), {'batches': {}, 'partitions': {}})
+    if batch_id in state['batches']:
+        print(f"Rollup {cube_name}: batch {batch_id} already applied, skipping")
+        return []
+
+    if spec['prepare'] is not None:
+        df = spec['prepare'](df)
+    partition_column = spec['partition']
+    # La fecha de partición se guarda como texto 'YYYY-MM-DD' en todas las fuentes
+    df = df.assign(**{partition_column: pd.to_datetime(df[partition_column]).dt.strftime('%Y-%m-%d')})
+
+    updated = []
+    finest = next(iter(spec['grains'].values()))
+    for partition, partition_df in df.groupby(partition_column):
+        partition_value = partition
+        fingerprint = _fingerprint(partition_df)
+        if mode == 'replace' and state['partitions'].get(partition_value) == fingerprint:
+            continue
+
+        cells = None
+        for grain, dimensions in spec['grains'].items():
+            object_name = _partition_object(cube_name, grain, partition_value)
+            if mode == 'upsert':
+                if cells is None:
+                    cells = _upsert_cells(client, object_name, partition_df, finest, spec)
+                # Los granos más gruesos se recalculan desde las celdas finas: se fusionan sin repetir filas
+                partials = cells if dimensions == finest else merge_partials(
+                    cells.drop(columns=[d for d in finest if d not in dimensions]), dimensions)
+            else:
+                partials = aggregate_partials(partition_df, dimensions, spec['measures'], spec['categories'])
+            if mode == 'merge':
+                existing = _read_parquet(client, object_name)
+                if existing is not None:
+                    partials = merge_partials(pd.concat([existing, partials], ignore_index=True), dimensions)
+            table = pa.Table.from_pandas(partials, preserve_index=False)
+            buffer = io.BytesIO()
+            pq.write_table(table, buffer)
+            _put(client, object_name, buffer.getvalue(), 'application/octet-stream')
+            # Estadísticas por fichero para que los lectores descarten particiones sin abrirlas
+            state.setdefault('stats', {})[object_name] = table_statistics(table)
+
+        # En modo merge la partición ya no corresponde a un único snapshot
+        state['partitions'][partition_value] = fingerprint if mode == 'replace' else None
+        updated.append(partition_value)
+
+    state['batches'][batch_id] = {
+        'applied_at': datetime.datetime.now().isoformat(),
+        'mode': mode,
+        'rows': len(df),
+        'partitions': updated
+    }
+    state_json = json.dumps(state).encode('utf-8')
+    _put(client, _state_object(cube_name), state_json, 'application/json')
+
+    print(f"Rollup {cube_name}: {len(updated)} partitions updated ({', '.join(updated) or 'none'})")
+    if updated:
+        store_object_metadata(ROLLUPS_BUCKET, f"{ROLLUPS_PREFIX}/{cube_name}/", {
+            'description': f'Rollup cube {cube_name}',
+            'uploaded_at': datetime.datetime.now().isoformat(),
+            'format': 'parquet',
+            'grains': spec['grains'],
+            'measures': spec['measures'],
+            'categories': spec['categories'],
+            'partitions': sorted(p for p in state['partitions']),
+            'file_stats': state.get('stats', {})
+        })
+    return updated
+
+def read_cube(cube_name, grain, start=None, end=None, by=None):
+    """Read a cube grain for a date range, optionally rolled up to the dimensions in ``by``.
+
+    Adds ``<measure>_mean`` columns and, for categorical columns, ``<category>_moda``.
+    """
+    spec = CUBES[cube_name]
+    client = get_minio_client()
+    prefix = f"{ROLLUPS_PREFIX}/{cube_name}/{grain}/"
+
+    frames = []
+    for obj in client.list_objects(ROLLUPS_BUCKET, prefix=prefix):
+        partition_value = obj.object_name[len(prefix):].strip('/').split('=', 1)[-1]
+        # Poda de particiones por rango de fechas
+        if (start and partition_value < str(start)) or (end and partition_value > str(end)):
+            continue
+        partials = _read_parquet(client, _partition_object(cube_name, grain, partition_value))
+        if partials is not None:
+            frames.append(partials)
+    if not frames:
+        return pd.DataFrame()
+
+    cube = pd.concat(frames, ignore_index=True)
+    dimensions = spec['grains'][grain]
+    by = by or dimensions
+    cube = merge_partials(cube.drop(columns=[d for d in dimensions if d not in by]), by)
+    for measure in spec['measures']:
+        cube[f'{measure}_mean'] = cube[f'{measure}_sum'] / cube[f'{measure}_count']
+    for category in spec['categories']:
+        count_columns = [c for c in cube.columns if c.startswith(f'{category}__')]
+        if count_columns:
+            cube[f'{category}_moda'] = cube[count_columns].idxmax(axis=1).str.split('__').str[1]
+    return cube
+
+def log_rollup_lineage(cube_name, source_bucket, source_object):
+    """Record the lineage from a source dataset to a rollup cube."""
+    log_data_transformation(
+        source_bucket, source_object,
+        ROLLUPS_BUCKET, f"{ROLLUPS_PREFIX}/{cube_name}/",
+        f'Incremental rollup of {source_object} into cube {cube_name}'
+    )
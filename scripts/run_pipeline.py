@@ -0,0 +1,211 @@
+"""
+Single-process runner for the data lake pipeline.
+
+Runs the stages in order in one process:
+
+    ingest (01) -> process (02) -> access (03) -> govern (04) -> query (05)
+
+When two consecutive stages run together, the DataFrames produced by one are handed to the
+next in memory instead of being downloaded again from MinIO. Lake writes still happen for
+durability, but in background threads (``utils.deferred_lake_writes``), and they are only
+awaited before a stage that reads the lake and at the end of the run.
+
+    python run_pipeline.py                          # every stage
+    python run_pipeline.py --from process --to access
+    python run_pipeline.py --stages ingest process
+    python run_pipeline.py --force                  # ignore the checkpoints
+
+Every data stage records a checkpoint (``checkpoints.Checkpoint``) once its outputs are in
+the lake: the fingerprint of the inputs it consumed and the rows it produced. A stage that
+reads the lake and whose inputs have not changed since its last completed run is skipped,
+and the access stage also resumes from the first warehouse task that was not committed.
+
+Each run gets a ``run_id``; the metrics of its stages and instrumented operations
+(``metrics``) are stored in ``govern-zone-metadata/runs/<run_id>/metrics.json`` and in the
+Prometheus text file, also when the run fails. ``--profile`` (or ``PIPELINE_PROFILE``) profiles
+the given stages and stores the profiles under the same run (``profiling``).
+"""
+from utils import batched_index_updates, deferred_lake_writes, flush_lake_writes
+from checkpoints import Checkpoint, file_fingerprint, lake_fingerprint, load_checkpoint
+import metrics
+from profiling import PROFILERS, enabled_profilers, is_profiled, profile_stage
+import os
+import argparse
+import contextlib
+import importlib
+import inspect
+import time
+import pandas as pd
+
+# Etapa -> (módulo, función, etapa cuya salida recibe en memoria y argumento con el que la recibe)
+STAGES = {
+    'ingest': ('01_ingest_data', 'main', None, None),
+    'process': ('02_process_data', 'main_process_zone', 'ingest', 'raw'),
+    'access': ('03_access_zone', 'main_access_zone', 'process', 'processed'),
+    'govern': ('04_govern_zone', 'main', None, None),
+    'query': ('05_query_data', 'main', None, None),
+}
+STAGE_ORDER = list(STAGES)
+
+# Etapas que devuelven datos: si no devuelven nada es que han fallado
+DATA_STAGES = {'ingest', 'process', 'access'}
+
+# Objetos del lake que escribe cada etapa y lee la siguiente
+RAW_OBJECTS = [('raw-ingestion-zone', name) for name in [
+    'trafico/trafico-horario.csv',
+    'bicimad/bicimad-usos.csv',
+    'aparcamiento/parkings_rotacion.csv',
+    'aparcamiento/ext_aparcamientos_info.csv',
+    'sql/dump-bbdd-municipal.sql'
+]]
+PROCESSED_OBJECTS = [('process-zone', name) for name in [
+    'trafico/cleaned_traffic.parquet',
+    'bicimad/cleaned_bicimad.parquet',
+    'parkings/cleaned_parking_rotation.parquet',
+    'parkings/cleaned_parking_info.parquet',
+    'municipal/distritos.parquet',
+    'municipal/estaciones_transporte.parquet'
+]]
+
+def _ingest_inputs():
+    ingest = importlib.import_module('01_ingest_data')
+    return file_fingerprint([os.path.join(ingest.DATA_DIR, name) for name in ingest.SOURCE_FILES])
+
+# Huella de las entradas de cada etapa con checkpoint
+STAGE_INPUTS = {
+    'ingest': _ingest_inputs,
+    'process': lambda: lake_fingerprint(RAW_OBJECTS),
+    'access': lambda: lake_fingerprint(PROCESSED_OBJECTS),
+}
+STAGE_OUTPUTS = {
+    'ingest': RAW_OBJECTS,
+    'process': PROCESSED_OBJECTS,
+}
+
+def stage_checkpoint_name(stage):
+    return f"pipeline/{stage}"
+
+def stage_is_complete(stage):
+    """True if the stage's last run completed over the inputs currently in the lake."""
+    state = load_checkpoint(stage_checkpoint_name(stage))
+    return state is not None and state['status'] == 'done' and state['inputs'] == STAGE_INPUTS[stage]()
+
+def _output_rows(result):
+    if isinstance(result, dict):
+        return {name: len(value) for name, value in result.items() if isinstance(value, pd.DataFrame)} or None
+    return None
+
+def commit_stage_checkpoints(completed, force=False):
+    """Checkpoint the stages whose outputs are now in the lake (call after flushing the writes)."""
+    for stage, rows in completed:
+        checkpoint = Checkpoint(stage_checkpoint_name(stage), STAGE_INPUTS[stage](), force=force)
+        outputs = STAGE_OUTPUTS.get(stage)
+        checkpoint.complete(rows=rows, outputs=lake_fingerprint(outputs) if outputs else None)
+    completed.clear()
+
+def select_stages(stages=None, start=None, end=None):
+    """Stages to run, in pipeline order, from an explicit list and/or a ``start``..``end`` range."""
+    selected = STAGE_ORDER[STAGE_ORDER.index(start) if start else 0:STAGE_ORDER.index(end) + 1 if end else None]
+    if stages:
+        selected = [stage for stage in selected if stage in stages]
+    return selected
+
+def run_pipeline(stages=None, start=None, end=None, defer_writes=True, force=False, run_id=None,
+                 profile=None, profilers=None):
+    """Run the selected stages in one process; returns ``{stage: elapsed seconds}``.
+
+    Stages already completed over the same inputs are skipped unless ``force`` is set.
+    ``profile`` lists the stages to profile (default: ``PIPELINE_PROFILE``) and ``profilers``
+    the profilers to use (default: ``PIPELINE_PROFILERS``, or all).
+    """
+    selected = select_stages(stages, start, end)
+    if any(is_profiled(stage, profile) for stage in selected):
+        # Un perfilador desconocido se detecta antes de empezar, no al final de una etapa
+        profilers = enabled_profilers(profilers)
+    run_id = run_id or metrics.new_run_id()
+    print(f"Running pipeline stages: {', '.join(selected)} (run {run_id})")
+    metrics.reset()
+    status = 'failed'
+    profiles = []
+    try:
+        timings = _run_stages(selected, defer_writes, force, run_id, profile, profilers, profiles)
+        status = 'done'
+        return timings
+    finally:
+        run_summary = metrics.write_run_summary(run_id, status=status, stages_selected=selected, profiles=profiles)
+        metrics.print_metrics_report(run_summary)
+
+def _run_stages(selected, defer_writes, force, run_id, profile, profilers, profiles):
+    outputs = {}
+    timings = {}
+    # Etapas terminadas cuyas salidas pueden seguir pendientes de escribir en el lake
+    completed = []
+    # Sin escrituras diferidas el catálogo se sigue actualizando por lotes
+    with deferred_lake_writes() if defer_writes else batched_index_updates():
+        try:
+            for stage in selected:
+                module_name, function_name, input_stage, input_argument = STAGES[stage]
+                kwargs = {}
+                if input_stage in outputs:
+                    kwargs[input_argument] = outputs[input_stage]
+                else:
+                    # La etapa lee del lake: esperamos a que terminen las escrituras pendientes
+                    flushed = flush_lake_writes()
+                    if flushed:
+                        print(f"{flushed} pending lake writes completed before stage '{stage}'")
+                    commit_stage_checkpoints(completed, force)
+                    if stage in STAGE_INPUTS and not force and stage_is_complete(stage):
+                        print(f"\n===== Stage '{stage}' already completed over the same inputs, skipped =====")
+                        outputs = {}
+                        continue
+
+                print(f"\n===== Stage '{stage}' ({module_name}.{function_name}) =====")
+                stage_function = getattr(importlib.import_module(module_name), function_name)
+                if 'force' in inspect.signature(stage_function).parameters:
+                    kwargs['force'] = force
+                profiling = (profile_stage(stage, run_id, profilers, profiles) if is_profiled(stage, profile)
+                             else contextlib.nullcontext())
+                started = time.perf_counter()
+                with metrics.stage(stage) as stage_record, profiling:
+                    result = stage_function(**kwargs)
+                    if stage in DATA_STAGES and result is None:
+                        stage_record['status'] = 'failed'
+                timings[stage] = time.perf_counter() - started
+
+                if stage in DATA_STAGES and result is None:
+                    raise RuntimeError(f"Pipeline stage '{stage}' failed")
+                if stage in STAGE_INPUTS:
+                    completed.append((stage, _output_rows(result)))
+                # Solo se conserva en memoria la salida que necesita la etapa siguiente
+                outputs = {stage: result}
+        except Exception:
+            # Las etapas ya terminadas conservan su checkpoint si sus escrituras llegan al lake
+            flush_lake_writes()
+            commit_stage_checkpoints(completed, force)
+            raise
+
+        # Al salir del bloque se esperan las escrituras que quedan en segundo plano
+        started = time.perf_counter()
+    timings['lake_writes_flush'] = time.perf_counter() - started
+    commit_stage_checkpoints(completed, force)
+
+    print("\nPipeline run summary:")
+    for name, elapsed in timings.items():
+        print(f"  {name}: {elapsed:.2f}s")
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the data lake pipeline in a single process.')
+    parser.add_argument('--stages', nargs='+', choices=STAGE_ORDER, help='run only these stages')
+    parser.add_argument('--from', dest='start', choices=STAGE_ORDER, help='first stage to run')
+    parser.add_argument('--to', dest='end', choices=STAGE_ORDER, help='last stage to run')
+    parser.add_argument('--sync-writes', action='store_true', help='write to the lake synchronously')
+    parser.add_argument('--force', action='store_true', help='ignore the checkpoints and rerun every step')
+    parser.add_argument('--run-id', help='identifier of the run in the metrics (default: start time)')
+    parser.add_argument('--profile', nargs='+', choices=STAGE_ORDER + ['all'],
+                        help='profile these stages (default: PIPELINE_PROFILE)')
+    parser.add_argument('--profilers', nargs='+', choices=PROFILERS,
+                        help='profilers to use (default: PIPELINE_PROFILERS, or all)')
+    args = parser.parse_args()
+    run_pipeline(args.stages, args.start, args.end, defer_writes=not args.sync_writes, force=args.force,
+                 run_id=args.run_id, profile=args.profile, profilers=args.profilers)
@@ -0,0 +1,331 @@
+"""
+Mergeable approximate sketches published alongside the fact tables.
+
+For every date partition and every value of the key dimensions of a fact, the access stage
+stores a HyperLogLog sketch per distinct-count column and a relative-error quantile sketch
+per measure:
+
+    access-zone/sketches/<fact>/fecha=YYYY-MM-DD/part.parquet
+
+Both sketch types merge losslessly (register max / bucket sum), so distinct counts and
+percentiles over any date range are answered by merging a handful of small sketches
+instead of scanning the fact table.
+"""
+from utils import get_minio_client, log_data_transformation, store_object_metadata
+import numpy as np
+import pandas as pd
+import io
+import json
+import datetime
+
+SKETCHES_BUCKET = 'access-zone'
+SKETCHES_PREFIX = 'sketches'
+ALL_KEY = '__all__'
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with ``2**p`` registers (p=14: ~0.8% standard error)."""
+
+    def __init__(self, p=14, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+
+    def add(self, values):
+        """Add a column of values (vectorized).
+
+        Values are hashed as they are (texts hash the same as before; mixed object columns
+        fall back to their string form inside pandas), without a string copy of numbers.
+        """
+        values = pd.Series(values).dropna()
+        if values.empty:
+            return self
+        return self.add_hashes(pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64))
+
+    def add_hashes(self, hashes):
+        """Add 64-bit hashes of the values (``pandas.util.hash_array``)."""
+        if len(hashes) == 0:
+            return self
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        # Posición del primer bit a 1 en los 64-p bits restantes (rango HLL)
+        if 64 - self.p <= 53:
+            # Caben en la mantisa de un float64: frexp da el número de bits de una vez
+            bit_length = np.frexp(rest.astype(np.float64))[1].astype(np.int64)
+        else:
+            bit_length = np.zeros(len(rest), dtype=np.int64)
+            remaining = rest.copy()
+            for shift in (32, 16, 8, 4, 2, 1):
+                mask = remaining >= (np.uint64(1) << np.uint64(shift))
+                bit_length[mask] += shift
+                remaining[mask] >>= np.uint64(shift)
+            bit_length += (remaining > 0)
+        rank = (64 - self.p) - bit_length + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+        return self
+
+    def merge(self, other):
+        self.registers = np.maximum(self.registers, other.registers)
+        return self
+
+    def count(self):
+        """Estimated number of distinct values."""
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Corrección para cardinalidades pequeñas (linear counting)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * np.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.p]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data[0], np.frombuffer(data[1:], dtype=np.uint8).copy())
+
+class QuantileSketch:
+    """Logarithmic-bucket quantile sketch with bounded relative error (DDSketch-style).
+
+    Every quantile estimate is within ``relative_accuracy`` of the true value, and two
+    sketches with the same accuracy merge exactly by adding their bucket counts.
+    """
+
+    def __init__(self, relative_accuracy=0.01, positive=None, negative=None, zero_count=0):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive = positive if positive is not None else {}
+        self.negative = negative if negative is not None else {}
+        self.zero_count = zero_count
+
+    def _bucket_counts(self, values):
+        if len(values) == 0:
+            return {}
+        buckets = np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64)
+        # Los buckets son un rango corto de enteros: bincount evita ordenar los valores
+        low = buckets.min()
+        counts = np.bincount(buckets - low)
+        keys = np.flatnonzero(counts)
+        return dict(zip((keys + low).tolist(), counts[keys].tolist()))
+
+    @staticmethod
+    def _merge_counts(target, counts):
+        for key, count in counts.items():
+            target[key] = target.get(key, 0) + count
+
+    def add(self, values):
+        """Add a column of values (vectorized)."""
+        if isinstance(values, np.ndarray) and values.dtype.kind in 'iuf':
+            values = values.astype(np.float64, copy=False)
+            values = values[~np.isnan(values)]
+        else:
+            values = pd.to_numeric(pd.Series(values), errors='coerce').dropna().to_numpy(dtype=np.float64)
+        self.zero_count += int(np.count_nonzero(values == 0))
+        self._merge_counts(self.positive, self._bucket_counts(values[values > 0]))
+        self._merge_counts(self.negative, self._bucket_counts(-values[values < 0]))
+        return self
+
+    def merge(self, other):
+        self._merge_counts(self.positive, other.positive)
+        self._merge_counts(self.negative, other.negative)
+        self.zero_count += other.zero_count
+        return self
+
+    def count(self):
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zero_count
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Estimated ``q``-quantile (0 <= q <= 1), or None for an empty sketch."""
+        total = self.count()
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        # Recorremos los buckets de menor a mayor valor: negativos, cero y positivos
+        ordered = [(-self._value(key), count) for key, count in sorted(self.negative.items(), reverse=True)]
+        ordered.append((0.0, self.zero_count))
+        ordered += [(self._value(key), count) for key, count in sorted(self.positive.items())]
+        seen = 0
+        for value, count in ordered:
+            seen += count
+            if seen > rank:
+                return value
+        return ordered[-1][0]
+
+    def to_bytes(self):
+        return json.dumps({
+            'relative_accuracy': self.relative_accuracy,
+            'positive': self.positive,
+            'negative': self.negative,
+            'zero_count': self.zero_count
+        }).encode('utf-8')
+
+    @classmethod
+    def from_bytes(cls, data):
+        state = json.loads(data.decode('utf-8'))
+        return cls(
+            state['relative_accuracy'],
+            {int(k): v for k, v in state['positive'].items()},
+            {int(k): v for k, v in state['negative'].items()},
+            state['zero_count']
+        )
+
+SKETCH_TYPES = {'hll': HyperLogLog, 'quantile': QuantileSketch}
+
+# Sketches de cada hecho: dimensiones clave, columnas de conteo distinto y medidas con cuantiles
+SKETCHES = {
+    'usos_bicimad': {
+        'partition': 'fecha',
+        'dimensions': ['tipo_usuario', 'estacion_origen'],
+        'distinct': ['usuario_hash'],
+        'quantiles': ['duracion_segundos', 'distancia_km'],
+    },
+    'ocupacion_parkings': {
+        'partition': 'fecha',
+        'dimensions': ['distrito_id', 'aparcamiento_id'],
+        'distinct': [],
+        'quantiles': ['porcentaje_ocupacion'],
+    },
+}
+
+def _partition_object(fact_name, partition_value):
+    return f"{SKETCHES_PREFIX}/{fact_name}/fecha={partition_value}/part.parquet"
+
+def _manifest_object(fact_name):
+    return f"{SKETCHES_PREFIX}/{fact_name}/_manifest.json"
+
+def _read_object(client, object_name):
+    try:
+        response = client.get_object(SKETCHES_BUCKET, object_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception:
+        return None
+
+def forget_partitions(client, bucket, deleted):
+    """Drop the manifest entries of the sketch partitions among the ``deleted`` objects; returns how many."""
+    if bucket != SKETCHES_BUCKET:
+        return 0
+    forgotten = 0
+    for fact_name in SKETCHES:
+        gone = [name for name in deleted if name.startswith(f"{SKETCHES_PREFIX}/{fact_name}/fecha=")]
+        manifest_data = _read_object(client, _manifest_object(fact_name)) if gone else None
+        if not manifest_data:
+            continue
+        manifest = json.loads(manifest_data.decode('utf-8'))
+        for object_name in gone:
+            partition_value = object_name.split('fecha=', 1)[1].split('/', 1)[0]
+            if manifest['partitions'].pop(partition_value, None) is not None:
+                forgotten += 1
+        manifest_json = json.dumps(manifest).encode('utf-8')
+        client.put_object(SKETCHES_BUCKET, _manifest_object(fact_name), io.BytesIO(manifest_json),
+                          length=len(manifest_json), content_type='application/json')
+    return forgotten
+
+def build_partition_sketches(df, spec):
+    """Sketch rows (dimension, key, metric, kind, payload) of one partition."""
+    rows = []
+    groups = [(ALL_KEY, None)] + [(dimension, dimension) for dimension in spec['dimensions']]
+    for dimension, column in groups:
+        grouped = [('', df)] if column is None else df.groupby(column)
+        for key, group in grouped:
+            for metric in spec['distinct']:
+                rows.append((dimension, str(key), metric, 'hll', HyperLogLog().add(group[metric]).to_bytes()))
+            for metric in spec['quantiles']:
+                rows.append((dimension, str(key), metric, 'quantile', QuantileSketch().add(group[metric]).to_bytes()))
+    return pd.DataFrame(rows, columns=['dimension', 'key', 'metric', 'kind', 'payload'])
+
+def publish_sketches(fact_name, df, source_object):
+    """Compute and upload the sketches of every date partition whose data changed."""
+    spec = SKETCHES[fact_name]
+    client = get_minio_client()
+    if not client.bucket_exists(SKETCHES_BUCKET):
+        client.make_bucket(SKETCHES_BUCKET)
+
+    manifest_data = _read_object(client, _manifest_object(fact_name))
+    manifest = json.loads(manifest_data.decode('utf-8')) if manifest_data else {'partitions': {}}
+
+    partition_column = spec['partition']
+    df = df.assign(**{partition_column: pd.to_datetime(df[partition_column]).dt.strftime('%Y-%m-%d')})
+    updated = []
+    for partition_value, partition_df in df.groupby(partition_column):
+        fingerprint = str(int(pd.util.hash_pandas_object(partition_df, index=False).sum()))
+        if manifest['partitions'].get(partition_value) == fingerprint:
+            continue
+        buffer = io.BytesIO()
+        build_partition_sketches(partition_df, spec).to_parquet(buffer, index=False)
+        data = buffer.getvalue()
+        client.put_object(SKETCHES_BUCKET, _partition_object(fact_name, partition_value), io.BytesIO(data),
+                          length=len(data), content_type='application/octet-stream')
+        manifest['partitions'][partition_value] = fingerprint
+        updated.append(partition_value)
+
+    manifest_json = json.dumps(manifest).encode('utf-8')
+    client.put_object(SKETCHES_BUCKET, _manifest_object(fact_name), io.BytesIO(manifest_json),
+                      length=len(manifest_json), content_type='application/json')
+    print(f"Sketches {fact_name}: {len(updated)} partitions updated")
+
+    if updated:
+        store_object_metadata(SKETCHES_BUCKET, f"{SKETCHES_PREFIX}/{fact_name}/", {
+            'description': f'Mergeable HyperLogLog and quantile sketches for {fact_name}',
+            'uploaded_at': datetime.datetime.now().isoformat(),
+            'format': 'parquet',
+            'dimensions': spec['dimensions'],
+            'distinct': spec['distinct'],
+            'quantiles': spec['quantiles'],
+            'partitions': sorted(manifest['partitions'])
+        })
+        log_data_transformation(
+            'process-zone', source_object,
+            SKETCHES_BUCKET, f"{SKETCHES_PREFIX}/{fact_name}/",
+            f'Approximate sketches of {fact_name} per date and key dimension'
+        )
+    return updated
+
+def merge_sketches(fact_name, metric, start=None, end=None, dimension=ALL_KEY):
+    """Merge the sketches of ``metric`` over a date range; returns ``{key: sketch}`` for ``dimension``."""
+    client = get_minio_client()
+    manifest_data = _read_object(client, _manifest_object(fact_name))
+    if not manifest_data:
+        return {}
+    partitions = json.loads(manifest_data.decode('utf-8'))['partitions']
+
+    merged = {}
+    for partition_value in sorted(partitions):
+        # Poda de particiones por rango de fechas
+        if (start and partition_value < str(start)) or (end and partition_value > str(end)):
+            continue
+        data = _read_object(client, _partition_object(fact_name, partition_value))
+        if data is None:
+            continue
+        rows = pd.read_parquet(io.BytesIO(data))
+        rows = rows[(rows['dimension'] == dimension) & (rows['metric'] == metric)]
+        for key, kind, payload in zip(rows['key'], rows['kind'], rows['payload']):
+            sketch = SKETCH_TYPES[kind].from_bytes(payload)
+            merged[key] = merged[key].merge(sketch) if key in merged else sketch
+    return merged
+
+def approx_distinct(fact_name, metric, start=None, end=None, dimension=ALL_KEY):
+    """Approximate distinct count of ``metric`` per value of ``dimension`` over a date range."""
+    sketches = merge_sketches(fact_name, metric, start, end, dimension)
+    return pd.DataFrame(
+        [(key, sketch.count()) for key, sketch in sketches.items()],
+        columns=[dimension, f'{metric}_distintos']
+    )
+
+def approx_quantiles(fact_name, metric, quantiles=(0.5, 0.9, 0.99), start=None, end=None, dimension=ALL_KEY):
+    """Approximate quantiles of ``metric`` per value of ``dimension`` over a date range."""
+    # p50, p99_9, ...: q * 100 sin truncar, para que 0.999 no se convierta en p99
+    names = [f"p{q * 100:g}".replace('.', '_') for q in quantiles]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate quantiles: {list(quantiles)}")
+    sketches = merge_sketches(fact_name, metric, start, end, dimension)
+    return pd.DataFrame(
+        [[key, sketch.count()] + [sketch.quantile(q) for q in quantiles] for key, sketch in sketches.items()],
+        columns=[dimension, 'n'] + names
+    )
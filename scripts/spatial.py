@@ -0,0 +1,169 @@
+"""
+Spatial enrichment helpers for geolocated data (parkings, avisamadrid incidents, ...).
+
+Assigns a district to every point with a vectorized point-in-polygon join over the
+district boundaries, using a uniform grid as spatial index so each point is only
+tested against the polygons whose bounding box overlaps its cell. The repository ships
+simplified boundaries of the central districts in ``data/raw-ingestion-zone/distritos.geojson``
+(uploaded by ``01_ingest_data``); points outside them go to the nearest centroid of the
+districts without boundaries.
+"""
+from utils import get_minio_client
+import json
+import numpy as np
+
+DISTRICT_BOUNDARIES_BUCKET = 'raw-ingestion-zone'
+DISTRICT_BOUNDARIES_OBJECT = 'geo/distritos.geojson'
+
+def load_district_polygons(bucket_name=DISTRICT_BOUNDARIES_BUCKET, object_name=DISTRICT_BOUNDARIES_OBJECT):
+    """Load district boundary polygons from a GeoJSON FeatureCollection stored in MinIO.
+
+    Returns a list of ``{'id', 'nombre', 'rings'}`` dicts, where ``rings`` holds every ring
+    (outer boundaries and holes) as an ``(n, 2)`` array of lon/lat pairs, or ``None`` when
+    the boundaries object is not available.
+    """
+    client = get_minio_client()
+    try:
+        response = client.get_object(bucket_name, object_name)
+        try:
+            geojson = json.loads(response.read().decode('utf-8'))
+        finally:
+            response.close()
+            response.release_conn()
+    except Exception as e:
+        print(f"District boundaries not available in {bucket_name}/{object_name}: {e}")
+        return None
+
+    polygons = []
+    for feature in geojson.get('features', []):
+        properties = feature.get('properties', {})
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') == 'Polygon':
+            parts = [geometry['coordinates']]
+        elif geometry.get('type') == 'MultiPolygon':
+            parts = geometry['coordinates']
+        else:
+            continue
+        rings = [np.asarray(ring, dtype=float)[:, :2] for part in parts for ring in part]
+        polygons.append({
+            'id': int(properties.get('id', properties.get('codigo'))),
+            'nombre': properties.get('nombre'),
+            'rings': rings
+        })
+    return polygons
+
+def points_in_polygon(lon, lat, rings):
+    """Vectorized even-odd ray casting of many points against one (multi)polygon."""
+    inside = np.zeros(len(lon), dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        # Un bucle por arista, vectorizado sobre todos los puntos
+        for ax, ay, bx, by in zip(x1, y1, x2, y2):
+            if ay == by:
+                continue
+            crosses = (ay > lat) != (by > lat)
+            x_cross = ax + (lat - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (lon < x_cross)
+    return inside
+
+class DistrictGridIndex:
+    """Uniform grid spatial index over district polygons."""
+
+    def __init__(self, polygons, cells_per_axis=64):
+        self.polygons = polygons
+        self.ids = np.array([p['id'] for p in polygons])
+
+        bounds = np.array([
+            [min(r[:, 0].min() for r in p['rings']), min(r[:, 1].min() for r in p['rings']),
+             max(r[:, 0].max() for r in p['rings']), max(r[:, 1].max() for r in p['rings'])]
+            for p in polygons
+        ])
+        self.bounds = bounds
+        self.min_lon, self.min_lat = bounds[:, 0].min(), bounds[:, 1].min()
+        self.max_lon, self.max_lat = bounds[:, 2].max(), bounds[:, 3].max()
+        self.cells_per_axis = cells_per_axis
+        self.cell_width = (self.max_lon - self.min_lon) / cells_per_axis
+        self.cell_height = (self.max_lat - self.min_lat) / cells_per_axis
+
+        # Matriz celda x polígono: True si el bbox del polígono solapa la celda
+        n = cells_per_axis
+        col_min = np.floor((bounds[:, 0] - self.min_lon) / self.cell_width).clip(0, n - 1).astype(int)
+        col_max = np.floor((bounds[:, 2] - self.min_lon) / self.cell_width).clip(0, n - 1).astype(int)
+        row_min = np.floor((bounds[:, 1] - self.min_lat) / self.cell_height).clip(0, n - 1).astype(int)
+        row_max = np.floor((bounds[:, 3] - self.min_lat) / self.cell_height).clip(0, n - 1).astype(int)
+        self.candidates = np.zeros((n * n, len(polygons)), dtype=bool)
+        for index in range(len(polygons)):
+            rows = np.arange(row_min[index], row_max[index] + 1)
+            cols = np.arange(col_min[index], col_max[index] + 1)
+            self.candidates[(rows[:, None] * n + cols[None, :]).ravel(), index] = True
+
+    def lookup(self, lat, lon):
+        """Return the position in ``self.polygons`` containing each point, or -1 if none does."""
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        result = np.full(len(lat), -1, dtype=int)
+
+        n = self.cells_per_axis
+        in_grid = ((lon >= self.min_lon) & (lon <= self.max_lon) &
+                   (lat >= self.min_lat) & (lat <= self.max_lat))
+        cols = np.floor((lon - self.min_lon) / self.cell_width).clip(0, n - 1)
+        rows = np.floor((lat - self.min_lat) / self.cell_height).clip(0, n - 1)
+        cells = np.where(in_grid, rows * n + cols, 0).astype(int)
+
+        for index, polygon in enumerate(self.polygons):
+            pending = np.flatnonzero(in_grid & (result == -1) & self.candidates[cells, index])
+            if len(pending) == 0:
+                continue
+            inside = points_in_polygon(lon[pending], lat[pending], polygon['rings'])
+            result[pending[inside]] = index
+        return result
+
+def nearest_district(lat, lon, df_distritos, chunk_size=1_000_000):
+    """Assign each point to the district with the nearest centroid (Voronoi cells).
+
+    Fallback used when no boundary polygons are available; ``df_distritos`` must have
+    ``id``, ``latitud`` and ``longitud`` columns.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    centroid_lat = df_distritos['latitud'].to_numpy(dtype=float)
+    centroid_lon = df_distritos['longitud'].to_numpy(dtype=float)
+    # Proyección equirectangular: escalamos la longitud por el coseno de la latitud media
+    scale = np.cos(np.radians(centroid_lat.mean()))
+
+    result = np.empty(len(lat), dtype=int)
+    for start in range(0, len(lat), chunk_size):
+        end = start + chunk_size
+        d_lat = lat[start:end, None] - centroid_lat[None, :]
+        d_lon = (lon[start:end, None] - centroid_lon[None, :]) * scale
+        result[start:end] = np.argmin(d_lat ** 2 + d_lon ** 2, axis=1)
+    return result
+
+def assign_districts(df, df_distritos, polygons=None, lat_col='latitud', lon_col='longitud'):
+    """Add ``distrito_id`` and ``nombre_distrito`` columns to a geolocated DataFrame."""
+    df = df.copy()
+    lat = df[lat_col].to_numpy(dtype=float)
+    lon = df[lon_col].to_numpy(dtype=float)
+
+    district_ids = df_distritos['id'].to_numpy()
+    if polygons:
+        index = DistrictGridIndex(polygons)
+        positions = index.lookup(lat, lon)
+        found = positions >= 0
+        ids = np.where(found, index.ids[positions.clip(0)], 0)
+        missing = int((~found).sum())
+        if missing:
+            # Puntos fuera de todos los límites: distrito más cercano entre los que no tienen
+            # límites (un punto fuera de un polígono no está en ese distrito); con todos los
+            # límites disponibles, entre todos (puntos en el borde)
+            print(f"{missing} points fall outside every district boundary, using nearest district")
+            unbounded = df_distritos[~df_distritos['id'].isin(index.ids)]
+            candidates = unbounded if len(unbounded) else df_distritos
+            ids[~found] = candidates['id'].to_numpy()[nearest_district(lat[~found], lon[~found], candidates)]
+    else:
+        ids = district_ids[nearest_district(lat, lon, df_distritos)]
+
+    df['distrito_id'] = ids
+    df['nombre_distrito'] = df['distrito_id'].map(df_distritos.set_index('id')['nombre'])
+    return df
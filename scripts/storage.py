@@ -0,0 +1,593 @@
+"""
+Storage backends for the data lake.
+
+The pipeline talks to the lake through the MinIO client API (``put_object``, ``get_object``,
+``list_objects``, ...). ``utils.get_minio_client`` returns the backend selected with the
+``STORAGE_BACKEND`` environment variable:
+
+- ``minio`` (default): the MinIO service of docker-compose;
+- ``local``: a directory tree, ``<STORAGE_ROOT>/<bucket>/<object>``;
+- ``memory``: a dict shared by the whole process, for tests and single-process benchmarks.
+
+Both start with the zone buckets that docker-compose creates in MinIO.
+
+The local and in-memory backends implement the part of the MinIO client API the pipeline
+uses, returning the same object types (``minio.datatypes.Object``) and raising the same
+errors (``S3Error`` with code ``NoSuchKey``), so no caller needs to know which one is in use.
+``get_lake_filesystem`` returns the matching pyarrow filesystem for the dataset readers, with
+``bucket/object`` paths in every backend.
+
+``object_lease`` serializes writers of the same lake object across processes. The lease is
+an object that is never deleted: it is taken by compare-and-swap on its ETag (``If-None-Match: *``
+to create it, ``If-Match: <etag>`` to take over a released or expired one) and released by a
+conditional overwrite with ``owner: null``. The local and in-memory backends compare the ETag
+under a lock. Older MinIO releases accept conditional PUTs without enforcing them, so
+``object_lease`` checks once per bucket that the server rejects a failed precondition and
+raises ``ConditionalWritesUnsupported`` otherwise (docker-compose pins a release that enforces them).
+"""
+from minio import Minio
+from minio.datatypes import Object
+from minio.deleteobjects import DeleteError
+from minio.error import S3Error
+import urllib3
+from pyarrow import fs
+import pyarrow as pa
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import hashlib
+import datetime
+import tempfile
+import fcntl
+import threading
+import contextlib
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'minio')
+STORAGE_ROOT = os.environ.get('STORAGE_ROOT', '/data/lake')
+BACKENDS = ('minio', 'local', 'memory')
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Buckets que el servicio createbuckets de docker-compose crea en MinIO
+ZONE_BUCKETS = ['raw-ingestion-zone', 'process-zone', 'access-zone', 'govern-zone',
+                'govern-zone-metadata', 'govern-zone-security']
+
+# Duración de un lease y espera máxima para conseguirlo (segundos)
+LAKE_LEASE_TTL = float(os.environ.get('LAKE_LEASE_TTL', '60'))
+LAKE_LEASE_TIMEOUT = float(os.environ.get('LAKE_LEASE_TIMEOUT', '120'))
+LEASE_POLL_INTERVAL = 0.2
+# Objeto con el que se comprueba que el servidor respeta las escrituras condicionales
+LEASE_PROBE_OBJECT = '_lease_probe.json'
+
+# Bytes que mueven los backends local y en memoria (en MinIO los cuenta el propio cliente HTTP)
+TRANSFER_STATS = {'requests': 0, 'bytes_read': 0, 'bytes_written': 0}
+_stats_lock = threading.Lock()
+
+def _count(read=0, written=0):
+    with _stats_lock:
+        TRANSFER_STATS['requests'] += 1
+        TRANSFER_STATS['bytes_read'] += read
+        TRANSFER_STATS['bytes_written'] += written
+
+def _no_such_key(bucket_name, object_name):
+    return S3Error(None, 'NoSuchKey', 'Object does not exist', f"/{bucket_name}/{object_name}", None, None,
+                   bucket_name, object_name)
+
+def _no_such_bucket(bucket_name):
+    return S3Error(None, 'NoSuchBucket', 'Bucket does not exist', f"/{bucket_name}", None, None, bucket_name)
+
+def _read_all(data, length):
+    if length is not None and length >= 0:
+        return data.read(length)
+    # Longitud desconocida (subidas en streaming): leemos hasta el final
+    chunks = []
+    while True:
+        chunk = data.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+class _Response(io.BufferedReader):
+    """Object body with the interface of the urllib3 response returned by ``Minio.get_object``."""
+
+    def __init__(self, raw, size):
+        super().__init__(raw)
+        self.headers = {'content-length': str(size)}
+
+    def release_conn(self):
+        pass
+
+    def stream(self, amt=64 * 1024):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                return
+            yield chunk
+
+class _ObjectStore:
+    """MinIO client API on top of a few storage primitives implemented by each backend."""
+
+    def bucket_exists(self, bucket_name):
+        return self._has_bucket(bucket_name)
+
+    def make_bucket(self, bucket_name, *args, **kwargs):
+        self._create_bucket(bucket_name)
+
+    def put_object(self, bucket_name, object_name, data, length=-1, content_type='application/octet-stream',
+                   metadata=None, part_size=0, **kwargs):
+        if not self._has_bucket(bucket_name):
+            raise _no_such_bucket(bucket_name)
+        payload = _read_all(data, length)
+        self._write(bucket_name, object_name, payload, content_type)
+        _count(written=len(payload))
+        return self.stat_object(bucket_name, object_name)
+
+    def put_object_if_match(self, bucket_name, object_name, payload, content_type='application/octet-stream',
+                            etag=None):
+        """Write an object only if its ETag is ``etag`` (or, with ``etag=None``, if it does not exist).
+
+        Returns the new ETag, or None if the precondition failed.
+        """
+        if not self._has_bucket(bucket_name):
+            raise _no_such_bucket(bucket_name)
+        new_etag = self._write_if(bucket_name, object_name, payload, content_type, etag)
+        if new_etag is not None:
+            _count(written=len(payload))
+        return new_etag
+
+    def fput_object(self, bucket_name, object_name, file_path, content_type='application/octet-stream', **kwargs):
+        with open(file_path, 'rb') as f:
+            return self.put_object(bucket_name, object_name, f, os.path.getsize(file_path), content_type)
+
+    def get_object(self, bucket_name, object_name, **kwargs):
+        stream, size = self._open(bucket_name, object_name)
+        _count(read=size)
+        return _Response(stream, size)
+
+    def fget_object(self, bucket_name, object_name, file_path, **kwargs):
+        response = self.get_object(bucket_name, object_name)
+        try:
+            directory = os.path.dirname(file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(file_path, 'wb') as f:
+                shutil.copyfileobj(response, f, COPY_CHUNK_SIZE)
+        finally:
+            response.close()
+        return self.stat_object(bucket_name, object_name)
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        size, last_modified, etag, content_type = self._info(bucket_name, object_name)
+        return Object(bucket_name, object_name, last_modified=last_modified, etag=etag, size=size,
+                      content_type=content_type)
+
+    def list_objects(self, bucket_name, prefix=None, recursive=False, **kwargs):
+        prefix = prefix or ''
+        if not self._has_bucket(bucket_name):
+            raise _no_such_bucket(bucket_name)
+        directories = set()
+        for object_name in self._keys(bucket_name, prefix):
+            if not recursive:
+                # Como en S3: sin recursive, lo que hay bajo un subprefijo se agrupa en un directorio
+                slash = object_name.find('/', len(prefix))
+                if slash >= 0:
+                    directory = object_name[:slash + 1]
+                    if directory not in directories:
+                        directories.add(directory)
+                        yield Object(bucket_name, directory)
+                    continue
+            try:
+                yield self.stat_object(bucket_name, object_name)
+            except S3Error:
+                # Borrado mientras se listaba
+                continue
+
+    def remove_object(self, bucket_name, object_name, **kwargs):
+        self._delete(bucket_name, object_name)
+
+    def remove_objects(self, bucket_name, delete_object_list, **kwargs):
+        # Igual que en minio, el borrado se hace al consumir el iterador de errores
+        for delete_object in delete_object_list:
+            try:
+                self._delete(bucket_name, delete_object.name)
+            except Exception as e:
+                yield DeleteError('InternalError', str(e), delete_object.name, None)
+
+class MemoryStorage(_ObjectStore):
+    """Objects kept in a dict; every client of the process shares ``MEMORY_STORAGE``."""
+
+    def __init__(self):
+        self.buckets = {bucket_name: {} for bucket_name in ZONE_BUCKETS}
+        self._lock = threading.Lock()
+
+    def _has_bucket(self, bucket_name):
+        return bucket_name in self.buckets
+
+    def _create_bucket(self, bucket_name):
+        with self._lock:
+            self.buckets.setdefault(bucket_name, {})
+
+    def _entry(self, bucket_name, object_name):
+        try:
+            return self.buckets[bucket_name][object_name]
+        except KeyError:
+            raise _no_such_key(bucket_name, object_name)
+
+    def _write(self, bucket_name, object_name, payload, content_type):
+        entry = (payload, datetime.datetime.now(datetime.timezone.utc), hashlib.md5(payload).hexdigest(), content_type)
+        with self._lock:
+            self.buckets[bucket_name][object_name] = entry
+
+    def _write_if(self, bucket_name, object_name, payload, content_type, etag):
+        entry = (payload, datetime.datetime.now(datetime.timezone.utc), hashlib.md5(payload).hexdigest(), content_type)
+        with self._lock:
+            current = self.buckets[bucket_name].get(object_name)
+            if (current[2] if current is not None else None) != etag:
+                return None
+            self.buckets[bucket_name][object_name] = entry
+            return entry[2]
+
+    def _open(self, bucket_name, object_name):
+        payload = self._entry(bucket_name, object_name)[0]
+        return io.BytesIO(payload), len(payload)
+
+    def _info(self, bucket_name, object_name):
+        payload, last_modified, etag, content_type = self._entry(bucket_name, object_name)
+        return len(payload), last_modified, etag, content_type
+
+    def _keys(self, bucket_name, prefix):
+        with self._lock:
+            names = sorted(self.buckets[bucket_name])
+        return [name for name in names if name.startswith(prefix)]
+
+    def _delete(self, bucket_name, object_name):
+        with self._lock:
+            self.buckets.get(bucket_name, {}).pop(object_name, None)
+
+class LocalStorage(_ObjectStore):
+    """Objects stored as files under ``root/<bucket>/``."""
+
+    def __init__(self, root=None):
+        self.root = root or STORAGE_ROOT
+        for bucket_name in ZONE_BUCKETS:
+            self._create_bucket(bucket_name)
+
+    def _path(self, bucket_name, object_name=''):
+        return os.path.join(self.root, bucket_name, *object_name.split('/'))
+
+    def _has_bucket(self, bucket_name):
+        return os.path.isdir(self._path(bucket_name))
+
+    def _create_bucket(self, bucket_name):
+        os.makedirs(self._path(bucket_name), exist_ok=True)
+
+    def _write(self, bucket_name, object_name, payload, content_type):
+        path = self._path(bucket_name, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Escritura atómica: los lectores nunca ven un objeto a medias
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def _write_if(self, bucket_name, object_name, payload, content_type, etag):
+        path = self._path(bucket_name, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # El cerrojo es un fichero .tmp- junto al objeto (los listados lo ignoran)
+        lock_path = os.path.join(os.path.dirname(path), f".tmp-lock-{os.path.basename(path)}")
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = self._info(bucket_name, object_name)[2]
+            except S3Error:
+                current = None
+            if current != etag:
+                return None
+            self._write(bucket_name, object_name, payload, content_type)
+            return self._info(bucket_name, object_name)[2]
+
+    def _open(self, bucket_name, object_name):
+        path = self._path(bucket_name, object_name)
+        if not os.path.isfile(path):
+            raise _no_such_key(bucket_name, object_name)
+        return open(path, 'rb'), os.path.getsize(path)
+
+    def _info(self, bucket_name, object_name):
+        path = self._path(bucket_name, object_name)
+        if not os.path.isfile(path):
+            raise _no_such_key(bucket_name, object_name)
+        st = os.stat(path)
+        # ETag a partir del tamaño, la fecha de modificación y el inodo (cada reescritura crea un fichero
+        # nuevo): cambia con cada reescritura sin leer el fichero
+        etag = f"{st.st_size:x}-{st.st_mtime_ns:x}-{st.st_ino:x}"
+        return st.st_size, datetime.datetime.fromtimestamp(st.st_mtime, datetime.timezone.utc), etag, None
+
+    def _keys(self, bucket_name, prefix):
+        bucket_path = self._path(bucket_name)
+        names = []
+        for directory, _, files in os.walk(bucket_path):
+            relative = os.path.relpath(directory, bucket_path).replace(os.sep, '/')
+            for file_name in files:
+                if file_name.startswith('.tmp-'):
+                    continue
+                name = file_name if relative == '.' else f"{relative}/{file_name}"
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
+
+    def _delete(self, bucket_name, object_name):
+        path = self._path(bucket_name, object_name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+class _MemoryFileSystemHandler(fs.FileSystemHandler):
+    """pyarrow filesystem over a ``MemoryStorage`` (paths are ``bucket/object``)."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __eq__(self, other):
+        return isinstance(other, _MemoryFileSystemHandler) and other.storage is self.storage
+
+    def __ne__(self, other):
+        return not self == other
+
+    def get_type_name(self):
+        return 'lake-memory'
+
+    def normalize_path(self, path):
+        return path.strip('/')
+
+    def _split(self, path):
+        bucket_name, _, object_name = path.strip('/').partition('/')
+        return bucket_name, object_name
+
+    def _file_info(self, path):
+        bucket_name, object_name = self._split(path)
+        if not object_name:
+            return fs.FileInfo(path, fs.FileType.Directory if self.storage._has_bucket(bucket_name) else fs.FileType.NotFound)
+        if self.storage._has_bucket(bucket_name):
+            objects = self.storage.buckets[bucket_name]
+            if object_name in objects:
+                payload, last_modified = objects[object_name][:2]
+                return fs.FileInfo(path, fs.FileType.File, size=len(payload), mtime=last_modified)
+            if self.storage._keys(bucket_name, object_name.rstrip('/') + '/'):
+                return fs.FileInfo(path, fs.FileType.Directory)
+        return fs.FileInfo(path, fs.FileType.NotFound)
+
+    def get_file_info(self, paths):
+        return [self._file_info(path) for path in paths]
+
+    def get_file_info_selector(self, selector):
+        base = selector.base_dir.strip('/')
+        bucket_name, object_name = self._split(base)
+        if self._file_info(base).type != fs.FileType.Directory:
+            if selector.allow_not_found:
+                return []
+            raise FileNotFoundError(base)
+        prefix = f"{object_name}/" if object_name else ''
+        infos, directories = [], set()
+        for name in self.storage._keys(bucket_name, prefix):
+            parts = name[len(prefix):].split('/')
+            # Directorios intermedios (implícitos en un almacén de objetos)
+            for depth in range(1, len(parts) if selector.recursive else min(len(parts), 2)):
+                directory = f"{bucket_name}/{prefix}{'/'.join(parts[:depth])}"
+                if directory not in directories:
+                    directories.add(directory)
+                    infos.append(fs.FileInfo(directory, fs.FileType.Directory))
+            if selector.recursive or len(parts) == 1:
+                infos.append(self._file_info(f"{bucket_name}/{name}"))
+        return infos
+
+    def create_dir(self, path, recursive):
+        bucket_name, _ = self._split(path)
+        self.storage._create_bucket(bucket_name)
+
+    def delete_dir(self, path):
+        self.delete_dir_contents(path, missing_dir_ok=True)
+
+    def delete_dir_contents(self, path, missing_dir_ok=False):
+        bucket_name, object_name = self._split(path)
+        if not self.storage._has_bucket(bucket_name):
+            if missing_dir_ok:
+                return
+            raise FileNotFoundError(path)
+        for name in self.storage._keys(bucket_name, f"{object_name}/" if object_name else ''):
+            self.storage._delete(bucket_name, name)
+
+    def delete_root_dir_contents(self):
+        self.storage.buckets.clear()
+
+    def delete_file(self, path):
+        self.storage._delete(*self._split(path))
+
+    def move(self, src, dest):
+        self.copy_file(src, dest)
+        self.delete_file(src)
+
+    def copy_file(self, src, dest):
+        stream, _ = self.storage._open(*self._split(src))
+        bucket_name, object_name = self._split(dest)
+        self.storage._create_bucket(bucket_name)
+        self.storage._write(bucket_name, object_name, stream.read(), None)
+
+    def open_input_stream(self, path):
+        return self.open_input_file(path)
+
+    def open_input_file(self, path):
+        bucket_name, object_name = self._split(path)
+        try:
+            payload = self.storage._entry(bucket_name, object_name)[0]
+        except S3Error:
+            raise FileNotFoundError(path)
+        _count(read=len(payload))
+        return pa.BufferReader(payload)
+
+    def open_output_stream(self, path, metadata):
+        bucket_name, object_name = self._split(path)
+        storage = self.storage
+
+        class _Writer(io.BytesIO):
+            def close(self):
+                if not self.closed:
+                    storage._create_bucket(bucket_name)
+                    storage._write(bucket_name, object_name, self.getvalue(), None)
+                    _count(written=len(self.getvalue()))
+                super().close()
+
+        return pa.PythonFile(_Writer(), mode='w')
+
+    def open_append_stream(self, path, metadata):
+        raise NotImplementedError('append is not supported by the in-memory lake')
+
+MEMORY_STORAGE = MemoryStorage()
+
+class LeaseTimeout(Exception):
+    """Another process held the lease for longer than the allowed wait."""
+
+class ConditionalWritesUnsupported(Exception):
+    """The object store accepts conditional PUTs without enforcing them."""
+
+_http = urllib3.PoolManager()
+_checked_buckets = set()
+_checked_lock = threading.Lock()
+
+def put_object_if_match(client, bucket_name, object_name, payload, content_type='application/octet-stream', etag=None):
+    """Conditional PUT: write only if the object's ETag is ``etag`` (``etag=None``: only if it does not exist).
+
+    Returns the new ETag, or None if the precondition failed.
+    """
+    if isinstance(client, _ObjectStore):
+        return client.put_object_if_match(bucket_name, object_name, payload, content_type, etag)
+    # put_object no deja pasar cabeceras condicionales: firmamos la URL con la API pública
+    # (get_presigned_url) y enviamos el PUT con las cabeceras If-Match / If-None-Match
+    url = client.get_presigned_url('PUT', bucket_name, object_name, expires=datetime.timedelta(minutes=5))
+    headers = {'Content-Type': content_type}
+    if etag is None:
+        headers['If-None-Match'] = '*'
+    else:
+        headers['If-Match'] = f'"{etag}"'
+    response = _http.request('PUT', url, body=payload, headers=headers)
+    if response.status in (409, 412):
+        # PreconditionFailed, o ConditionalRequestConflict si otra escritura condicional va a la vez
+        return None
+    if response.status != 200:
+        raise S3Error(None, 'ConditionalPutFailed', f"HTTP {response.status}: {response.data[:200]!r}",
+                      f"/{bucket_name}/{object_name}", None, None, bucket_name, object_name)
+    return response.headers.get('ETag', '').strip('"')
+
+def _check_conditional_writes(client, bucket_name):
+    """Fail loudly if the server of ``bucket_name`` ignores ``If-None-Match`` / ``If-Match``."""
+    if isinstance(client, _ObjectStore) or bucket_name in _checked_buckets:
+        return
+    with _checked_lock:
+        if bucket_name in _checked_buckets:
+            return
+        payload = json.dumps({'probe': uuid.uuid4().hex}).encode('utf-8')
+        client.put_object(bucket_name, LEASE_PROBE_OBJECT, io.BytesIO(payload), len(payload),
+                          content_type='application/json')
+        # El objeto existe: ni crearlo de nuevo ni sobrescribirlo con un ETag falso puede funcionar
+        if (put_object_if_match(client, bucket_name, LEASE_PROBE_OBJECT, payload, 'application/json') is not None
+                or put_object_if_match(client, bucket_name, LEASE_PROBE_OBJECT, payload, 'application/json',
+                                       etag='0' * 32) is not None):
+            raise ConditionalWritesUnsupported(
+                f"The object store ignores conditional writes on {bucket_name}; leases would not be exclusive. "
+                "Use a MinIO release with If-Match/If-None-Match support (see docker-compose.yml).")
+        _checked_buckets.add(bucket_name)
+
+def _read_lease(client, bucket_name, lease_object):
+    """``(document, etag)`` of a lease object, or ``(None, None)`` if it does not exist."""
+    try:
+        # Primero el ETag y después el contenido: si cambia entre medias, el CAS con ese ETag falla
+        etag = client.stat_object(bucket_name, lease_object).etag
+        response = client.get_object(bucket_name, lease_object)
+        try:
+            return json.loads(response.read().decode('utf-8')), etag
+        finally:
+            response.close()
+            response.release_conn()
+    except S3Error as e:
+        if e.code == 'NoSuchKey':
+            return None, None
+        raise
+
+@contextlib.contextmanager
+def object_lease(client, bucket_name, lease_object, ttl=None, timeout=None):
+    """Hold the lease ``lease_object`` (exclusive across processes) while the block runs.
+
+    Waits up to ``timeout`` seconds for the current holder and raises ``LeaseTimeout``
+    after that. The block should finish well within ``ttl``.
+    """
+    _check_conditional_writes(client, bucket_name)
+    ttl = ttl or LAKE_LEASE_TTL
+    deadline = time.monotonic() + (timeout or LAKE_LEASE_TIMEOUT)
+    token = uuid.uuid4().hex
+    waiting = False
+    while True:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        document = {'owner': token, 'host': socket.gethostname(), 'pid': os.getpid(),
+                    'acquired_at': now.isoformat(), 'expires_at': (now + datetime.timedelta(seconds=ttl)).isoformat()}
+        payload = json.dumps(document).encode('utf-8')
+        holder, etag = _read_lease(client, bucket_name, lease_object)
+        if holder is None or holder.get('owner') is None or holder['expires_at'] < now.isoformat():
+            if holder is not None and holder.get('owner') is not None:
+                # El titular no lo liberó (proceso caído): el CAS sobre su ETag lo rompe y lo toma a la vez
+                print(f"Breaking expired lease {bucket_name}/{lease_object} held by "
+                      f"{holder.get('host')}:{holder.get('pid')}")
+            held_etag = put_object_if_match(client, bucket_name, lease_object, payload, 'application/json', etag)
+            if held_etag is not None:
+                break
+        if time.monotonic() > deadline:
+            raise LeaseTimeout(f"Lease {bucket_name}/{lease_object} still held after "
+                               f"{timeout or LAKE_LEASE_TIMEOUT:.0f}s")
+        if not waiting:
+            print(f"Waiting for lease {bucket_name}/{lease_object}")
+            waiting = True
+        time.sleep(LEASE_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        # Se libera sobrescribiéndolo solo si sigue siendo nuestro (mismo ETag que al tomarlo)
+        released = json.dumps({'owner': None,
+                               'released_at': datetime.datetime.now(datetime.timezone.utc).isoformat()}).encode('utf-8')
+        if put_object_if_match(client, bucket_name, lease_object, released, 'application/json', held_etag) is None:
+            print(f"Lease {bucket_name}/{lease_object} expired and was taken by another process before release")
+
+def get_storage_client(backend=None):
+    """Client of the configured storage backend (``STORAGE_BACKEND``) with the MinIO client API."""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'minio':
+        return Minio(
+            "minio:9000",
+            access_key="minioadmin",
+            secret_key="minioadmin",
+            secure=False
+        )
+    if backend == 'local':
+        return LocalStorage()
+    if backend == 'memory':
+        return MEMORY_STORAGE
+    raise ValueError(f"Unknown storage backend: {backend} (expected one of {', '.join(BACKENDS)})")
+
+def get_lake_filesystem(backend=None):
+    """pyarrow filesystem over the configured storage backend (paths are ``bucket/object``)."""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'minio':
+        return fs.S3FileSystem(
+            endpoint_override="minio:9000",
+            access_key="minioadmin",
+            secret_key="minioadmin",
+            scheme="http"
+        )
+    if backend == 'local':
+        os.makedirs(STORAGE_ROOT, exist_ok=True)
+        return fs.SubTreeFileSystem(STORAGE_ROOT, fs.LocalFileSystem())
+    if backend == 'memory':
+        return fs.PyFileSystem(_MemoryFileSystemHandler(MEMORY_STORAGE))
+    raise ValueError(f"Unknown storage backend: {backend} (expected one of {', '.join(BACKENDS)})")
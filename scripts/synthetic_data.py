@@ -0,0 +1,538 @@
+"""
+Deterministic synthetic data for the raw ingestion zone.
+
+Writes the same files (and columns) as the sample data in ``data/raw-ingestion-zone`` at any
+scale, so the pipeline can be exercised with 10^3 to 10^8 rows per dataset:
+
+    trafico-horario.csv, bicimad-usos.csv, parkings-rotacion.csv, ext_aparcamientos_info.csv,
+    avisamadrid.json, dump-bbdd-municipal.sql
+
+The values follow the shapes of the real data (commuting peaks in BiciMAD trips and traffic,
+daytime parking occupancy, parkings and stations placed around the district centroids). Rows
+are generated and written in chunks of ``CHUNK_ROWS``, each chunk with its own random stream
+derived from ``seed``, so memory stays bounded and the same ``scale``/``seed`` always produce
+the same files.
+
+    python synthetic_data.py --scale 1000000 --output /data/synthetic
+"""
+import os
+import json
+import math
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 1_000_000
+START_DATE = datetime.date(2024, 12, 1)
+TRIPS_PER_DAY = 30_000  # viajes de BiciMAD en un día laborable típico
+MANIFEST_FILE = '_synthetic.json'
+
+# Distritos de Madrid: (nombre, población, superficie km2, latitud, longitud, código postal)
+DISTRITOS = [
+    ('Centro', 134881, 5.23, 40.4167, -3.7033, 28013),
+    ('Arganzuela', 154432, 6.85, 40.4000, -3.6933, 28045),
+    ('Retiro', 118376, 5.38, 40.4142, -3.6824, 28009),
+    ('Salamanca', 146755, 5.41, 40.4267, -3.6761, 28006),
+    ('Chamartín', 145934, 9.19, 40.4462, -3.6784, 28016),
+    ('Tetuán', 155649, 5.36, 40.4599, -3.6996, 28020),
+    ('Chamberí', 138418, 4.69, 40.4356, -3.7005, 28015),
+    ('Fuencarral-El Pardo', 240917, 43.82, 40.4893, -3.7305, 28049),
+    ('Moncloa-Aravaca', 116884, 46.49, 40.4447, -3.7350, 28008),
+    ('Latina', 237434, 25.85, 40.3845, -3.7547, 28047),
+    ('Carabanchel', 248220, 14.05, 40.3850, -3.7320, 28025),
+    ('Usera', 136978, 7.71, 40.3853, -3.7008, 28026),
+    ('Puente de Vallecas', 227595, 14.87, 40.3889, -3.6650, 28038),
+    ('Moratalaz', 93217, 6.35, 40.4078, -3.6453, 28030),
+    ('Ciudad Lineal', 212529, 11.31, 40.4389, -3.6392, 28027),
+    ('Hortaleza', 180462, 27.31, 40.4725, -3.6400, 28043),
+    ('Villaverde', 142608, 20.19, 40.3447, -3.7011, 28021),
+    ('Villa de Vallecas', 108649, 51.47, 40.3728, -3.6150, 28031),
+    ('Vicálvaro', 68297, 35.12, 40.4022, -3.5900, 28032),
+    ('San Blas-Canillejas', 156149, 22.72, 40.4350, -3.6100, 28022),
+    ('Barajas', 46876, 33.56, 40.4789, -3.5800, 28042),
+]
+DISTRICT_LAT = np.array([d[3] for d in DISTRITOS])
+DISTRICT_LON = np.array([d[4] for d in DISTRITOS])
+
+# Perfiles horarios (0-23): reparto de los viajes, intensidad del tráfico y ocupación de los parkings
+BICIMAD_HOURLY = np.array([0.6, 0.3, 0.2, 0.1, 0.1, 0.3, 1.2, 3.5, 6.5, 4.8, 3.6, 3.8,
+                           4.5, 5.2, 5.8, 5.0, 5.2, 6.4, 7.8, 7.2, 5.4, 3.6, 2.2, 1.2])
+BICIMAD_HOURLY = BICIMAD_HOURLY / BICIMAD_HOURLY.sum()
+TRAFFIC_HOURLY = np.array([0.25, 0.18, 0.12, 0.10, 0.12, 0.25, 0.55, 0.90, 1.00, 0.85, 0.75, 0.75,
+                           0.80, 0.85, 0.80, 0.78, 0.82, 0.92, 1.00, 0.95, 0.75, 0.55, 0.42, 0.32])
+PARKING_HOURLY = np.array([0.30, 0.25, 0.22, 0.20, 0.20, 0.25, 0.35, 0.55, 0.75, 0.85, 0.90, 0.90,
+                           0.88, 0.85, 0.85, 0.87, 0.88, 0.85, 0.80, 0.70, 0.60, 0.50, 0.42, 0.35])
+
+CONGESTION_LEVELS = np.array(['Baja', 'Moderada', 'Alta', 'Muy Alta'])
+AVISO_CATEGORIES = {
+    'Aceras y calzadas': ['Baldosa suelta', 'Bache', 'Socavón'],
+    'Limpieza': ['Residuos', 'Excrementos caninos'],
+    'Mobiliario urbano': ['Bancos', 'Fuente rota'],
+    'Zonas verdes': ['Rama peligrosa', 'Falta riego'],
+    'Alumbrado': ['Farola apagada', 'Farola dañada'],
+    'Señalización': ['Señal dañada', 'Semáforo averiado'],
+    'Contenedores y papeleras': ['Contenedor desbordado', 'Papelera rota'],
+    'Alcantarillado': ['Atasco', 'Olores'],
+    'Fuentes': ['Fuente sin agua'],
+    'Grafitis': ['Pintadas'],
+}
+AVISO_STATES = (['Recibida', 'Asignada', 'En tramitación', 'Resuelta'], [0.23, 0.26, 0.12, 0.39])
+AVISO_PRIORITIES = (['Baja', 'Media', 'Alta'], [0.18, 0.44, 0.38])
+AVISO_ORIGINS = (['App móvil', 'Web', 'Teléfono 010'], [0.92, 0.055, 0.025])
+
+MUNICIPAL_DDL = """-- Madrid Sostenible - Base de Datos Municipal
+-- Dump SQL sintético generado por synthetic_data.py
+
+DROP TABLE IF EXISTS consumo_energetico;
+DROP TABLE IF EXISTS zonas_verdes;
+DROP TABLE IF EXISTS estaciones_transporte;
+DROP TABLE IF EXISTS lineas_transporte;
+DROP TABLE IF EXISTS edificios_publicos;
+DROP TABLE IF EXISTS distritos;
+
+CREATE TABLE distritos (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    poblacion INTEGER NOT NULL,
+    superficie_km2 REAL NOT NULL,
+    densidad_poblacion REAL NOT NULL,
+    latitud REAL NOT NULL,
+    longitud REAL NOT NULL,
+    codigo_postal_principal INTEGER
+);
+
+CREATE TABLE edificios_publicos (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    tipo TEXT NOT NULL CHECK (tipo IN ('Administrativo', 'Educativo', 'Sanitario', 'Cultural', 'Deportivo', 'Social')),
+    distrito_id INTEGER NOT NULL,
+    direccion TEXT NOT NULL,
+    latitud REAL NOT NULL,
+    longitud REAL NOT NULL,
+    superficie_m2 INTEGER NOT NULL,
+    año_construccion INTEGER,
+    ultimo_renovado INTEGER,
+    accesibilidad TEXT CHECK (accesibilidad IN ('Alta', 'Media', 'Baja')),
+    certificacion_energetica TEXT CHECK (certificacion_energetica IN ('A', 'B', 'C', 'D', 'E', 'F', 'G')),
+    FOREIGN KEY (distrito_id) REFERENCES distritos(id)
+);
+
+CREATE TABLE lineas_transporte (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    tipo TEXT NOT NULL CHECK (tipo IN ('Metro', 'EMT', 'Cercanías')),
+    longitud_km REAL,
+    num_paradas INTEGER,
+    frecuencia_media_min REAL,
+    año_inauguracion INTEGER
+);
+
+CREATE TABLE estaciones_transporte (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    linea_id INTEGER NOT NULL,
+    tipo TEXT NOT NULL CHECK (tipo IN ('Estación', 'Parada')),
+    distrito_id INTEGER NOT NULL,
+    latitud REAL NOT NULL,
+    longitud REAL NOT NULL,
+    accesibilidad TEXT CHECK (accesibilidad IN ('Total', 'Parcial', 'Ninguna')),
+    correspondencia BOOLEAN,
+    año_inauguracion INTEGER,
+    FOREIGN KEY (linea_id) REFERENCES lineas_transporte(id),
+    FOREIGN KEY (distrito_id) REFERENCES distritos(id)
+);
+
+CREATE TABLE zonas_verdes (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    tipo TEXT NOT NULL CHECK (tipo IN ('Parque', 'Jardín', 'Zona ajardinada', 'Área forestal')),
+    distrito_id INTEGER NOT NULL,
+    superficie_m2 REAL NOT NULL,
+    latitud REAL NOT NULL,
+    longitud REAL NOT NULL,
+    año_creacion INTEGER,
+    num_especies_vegetales INTEGER,
+    tiene_area_infantil BOOLEAN,
+    tiene_area_deportiva BOOLEAN,
+    tiene_area_canina BOOLEAN,
+    FOREIGN KEY (distrito_id) REFERENCES distritos(id)
+);
+
+CREATE TABLE consumo_energetico (
+    id INTEGER PRIMARY KEY,
+    edificio_id INTEGER NOT NULL,
+    fecha DATE NOT NULL,
+    consumo_electrico_kwh REAL NOT NULL,
+    consumo_gas_m3 REAL,
+    consumo_agua_m3 REAL,
+    emisiones_co2_kg REAL,
+    coste_total_euros REAL,
+    FOREIGN KEY (edificio_id) REFERENCES edificios_publicos(id)
+);
+"""
+SQL_BATCH_ROWS = 500  # filas por sentencia INSERT
+
+def _rng(seed, dataset, chunk=0):
+    # Un flujo aleatorio independiente por dataset y bloque: el resultado no depende del orden de generación
+    return np.random.default_rng([seed, dataset, chunk])
+
+def _chunks(rows):
+    for start in range(0, rows, CHUNK_ROWS):
+        yield start // CHUNK_ROWS, start, min(start + CHUNK_ROWS, rows)
+
+def _clamp(value, low, high):
+    return int(min(max(value, low), high))
+
+def _near_districts(rng, district_idx, spread=0.008):
+    """Coordinates scattered around the centroid of each district index."""
+    lat = DISTRICT_LAT[district_idx] + rng.normal(0, spread, len(district_idx))
+    lon = DISTRICT_LON[district_idx] + rng.normal(0, spread, len(district_idx))
+    return lat.round(4), lon.round(4)
+
+def dataset_sizes(scale):
+    """Rows of every generated dataset (and its dimensions) for a given ``scale``."""
+    parkings = _clamp(scale // 2400, 15, 10_000)
+    return {
+        'bicimad': scale,
+        'trafico': scale,
+        'parkings': scale,
+        'avisos': scale,
+        'aparcamientos': parkings,
+        'sensores': _clamp(scale // 240, 10, 5_000),
+        'estaciones_bicimad': _clamp(scale // 1000, 43, 3_000),
+        'usuarios': max(100, scale // 5),
+        'edificios': _clamp(scale // 1000, 100, 50_000),
+        'lineas': _clamp(scale // 10_000, 20, 500),
+        'estaciones_transporte': _clamp(scale // 1000, 40, 50_000),
+        'zonas_verdes': _clamp(scale // 2000, 50, 25_000),
+    }
+
+def _write_csv(path, frames, **kwargs):
+    rows = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for i, df in enumerate(frames):
+            df.to_csv(f, index=False, header=(i == 0), **kwargs)
+            rows += len(df)
+    return rows
+
+def _capacities(parking_ids):
+    # Capacidad fija por aparcamiento, la misma en la ficha y en la rotación
+    return 150 + (parking_ids * 37) % 500
+
+def generate_bicimad(sizes, seed):
+    n_stations, n_users = sizes['estaciones_bicimad'], sizes['usuarios']
+    days = max(1, math.ceil(sizes['bicimad'] / TRIPS_PER_DAY))
+    for chunk, start, stop in _chunks(sizes['bicimad']):
+        rng = _rng(seed, 1, chunk)
+        n = stop - start
+        idx = np.arange(start, stop)
+        day = (idx * days) // sizes['bicimad']
+        hour = rng.choice(24, n, p=BICIMAD_HOURLY)
+        inicio = (np.datetime64(START_DATE) + day.astype('timedelta64[D]')
+                  + (hour * 3600 + rng.integers(0, 3600, n)).astype('timedelta64[s]'))
+        duracion = np.clip(rng.lognormal(np.log(800), 0.5, n), 120, 7200).astype(int)
+        distancia = (duracion / 3600 * np.clip(rng.normal(10, 2, n), 5, 20)).round(2)
+        origen = rng.integers(1, n_stations + 1, n)
+        # El destino nunca coincide con el origen
+        destino = (origen + rng.integers(1, n_stations, n) - 1) % n_stations + 1
+        yield pd.DataFrame({
+            'id': idx + 1,
+            'usuario_id': rng.integers(1, n_users + 1, n),
+            'tipo_usuario': np.where(rng.random(n) < 0.88, 'Anual', 'Ocasional'),
+            'estacion_origen': origen,
+            'estacion_destino': destino,
+            'fecha_hora_inicio': inicio,
+            'fecha_hora_fin': inicio + duracion.astype('timedelta64[s]'),
+            'duracion_segundos': duracion,
+            'distancia_km': distancia,
+            'calorias_estimadas': (distancia * 53).round().astype(int),
+            'co2_evitado_gramos': (distancia * 200).round().astype(int)
+        })
+
+def generate_traffic(sizes, seed):
+    n_sensors = sizes['sensores']
+    for chunk, start, stop in _chunks(sizes['trafico']):
+        rng = _rng(seed, 2, chunk)
+        n = stop - start
+        idx = np.arange(start, stop)
+        # Orden temporal: todas las lecturas de una hora (una por sensor) antes de la hora siguiente
+        sensor = idx % n_sensors + 1
+        hours = idx // n_sensors
+        load = np.clip(TRAFFIC_HOURLY[hours % 24] * rng.lognormal(0, 0.15, n), 0.02, 1.2)
+        base = 400 + (sensor * 7919) % 1200
+        total = (base * load).round().astype(int)
+        coches = (total * 0.75).round().astype(int)
+        motos = (total * 0.06).round().astype(int)
+        camiones = (total * 0.17).round().astype(int)
+        yield pd.DataFrame({
+            'sensor_id': sensor,
+            'fecha_hora': np.datetime64(START_DATE) + hours.astype('timedelta64[h]'),
+            'total_vehiculos': total,
+            'coches': coches,
+            'motos': motos,
+            'camiones': camiones,
+            'buses': np.maximum(total - coches - motos - camiones, 0),
+            'velocidad_media_kmh': np.clip(85 - 55 * load + rng.normal(0, 4, n), 8, 90).round().astype(int),
+            'nivel_congestion': CONGESTION_LEVELS[np.digitize(load, [0.4, 0.7, 0.9])]
+        })
+
+def generate_parkings(sizes, seed):
+    n_parkings = sizes['aparcamientos']
+    for chunk, start, stop in _chunks(sizes['parkings']):
+        rng = _rng(seed, 3, chunk)
+        n = stop - start
+        idx = np.arange(start, stop)
+        parking = idx % n_parkings + 1
+        hours = idx // n_parkings
+        capacidad = _capacities(parking)
+        ratio = np.clip(PARKING_HOURLY[hours % 24] * rng.normal(1, 0.12, n), 0.02, 0.99)
+        ocupadas = (capacidad * ratio).round().astype(int)
+        yield pd.DataFrame({
+            'aparcamiento_id': parking,
+            'fecha': np.datetime64(START_DATE) + (hours // 24).astype('timedelta64[D]'),
+            'hora': hours % 24,
+            'plazas_ocupadas': ocupadas,
+            'plazas_libres': capacidad - ocupadas,
+            'porcentaje_ocupacion': (ocupadas / capacidad * 100).round(1)
+        })
+
+def generate_parking_info(sizes, seed):
+    rng = _rng(seed, 4)
+    n = sizes['aparcamientos']
+    ids = np.arange(1, n + 1)
+    district = rng.integers(0, len(DISTRITOS), n)
+    lat, lon = _near_districts(rng, district)
+    capacidad = _capacities(ids)
+    names = np.array([d[0] for d in DISTRITOS])[district]
+    return pd.DataFrame({
+        'aparcamiento_id': ids,
+        'nombre': [f"Aparcamiento {name} {i}" for name, i in zip(names, ids)],
+        'direccion': [f"Calle {name} {i % 120 + 1} Madrid" for name, i in zip(names, ids)],
+        'capacidad_total': capacidad,
+        'plazas_movilidad_reducida': np.maximum(1, (capacidad * 0.025).round().astype(int)),
+        'plazas_vehiculos_electricos': (capacidad * rng.uniform(0.01, 0.05, n)).round().astype(int),
+        'tarifa_hora_euros': rng.uniform(2.2, 3.5, n).round(2),
+        'horario': np.where(rng.random(n) < 0.8, '24 horas', '07:00-23:00'),
+        'latitud': lat,
+        'longitud': lon
+    })
+
+def generate_avisos(sizes, seed, path):
+    categories = list(AVISO_CATEGORIES)
+    names = np.array([d[0] for d in DISTRITOS])
+    # Los avisos se concentran en los distritos más poblados y céntricos
+    weights = np.array([d[1] / d[2] ** 0.5 for d in DISTRITOS])
+    weights = weights / weights.sum()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for chunk, start, stop in _chunks(sizes['avisos']):
+            rng = _rng(seed, 5, chunk)
+            n = stop - start
+            category = rng.integers(0, len(categories), n)
+            subcategory = [AVISO_CATEGORIES[categories[c]][k % len(AVISO_CATEGORIES[categories[c]])]
+                           for c, k in zip(category, rng.integers(0, 6, n))]
+            district = rng.choice(len(DISTRITOS), n, p=weights)
+            lat, lon = _near_districts(rng, district, spread=0.006)
+            reporte = (np.datetime64(START_DATE) + rng.integers(0, 31 * 86400, n).astype('timedelta64[s]'))
+            estado = rng.choice(AVISO_STATES[0], n, p=AVISO_STATES[1])
+            resolucion = reporte + rng.integers(3600, 10 * 86400, n).astype('timedelta64[s]')
+            df = pd.DataFrame({
+                'id': np.arange(start, stop) + 1,
+                'categoria': np.array(categories)[category],
+                'subcategoria': subcategory,
+                'descripcion': [f"{s} en {d}" for s, d in zip(subcategory, names[district])],
+                'distrito': names[district],
+                'fecha_reporte': pd.Series(reporte).dt.strftime('%Y-%m-%d %H:%M:%S'),
+                'estado': estado,
+                'fecha_resolucion': pd.Series(resolucion).dt.strftime('%Y-%m-%d %H:%M:%S').where(estado == 'Resuelta'),
+                'latitud': lat,
+                'longitud': lon,
+                'prioridad': rng.choice(AVISO_PRIORITIES[0], n, p=AVISO_PRIORITIES[1]),
+                'origen': rng.choice(AVISO_ORIGINS[0], n, p=AVISO_ORIGINS[1]),
+                'likes': rng.poisson(4, n)
+            })
+            if chunk:
+                f.write(',')
+            # to_json escribe la lista de registros completa: quitamos los corchetes para encadenar bloques
+            f.write(df.to_json(orient='records', force_ascii=False)[1:-1])
+        f.write(']')
+    return sizes['avisos']
+
+def _sql_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NULL'
+    if isinstance(value, (bool, np.bool_)):
+        return 'true' if value else 'false'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+def _write_inserts(f, table, df):
+    columns = ', '.join(df.columns)
+    records = df.itertuples(index=False, name=None)
+    rows = [', '.join(_sql_value(v) for v in record) for record in records]
+    for start in range(0, len(rows), SQL_BATCH_ROWS):
+        values = ',\n'.join(f"({row})" for row in rows[start:start + SQL_BATCH_ROWS])
+        f.write(f"\nINSERT INTO {table} ({columns}) VALUES\n{values};\n")
+
+def generate_municipal_sql(sizes, seed, path):
+    """Municipal SQL dump with the same tables as ``dump-bbdd-municipal.sql``; returns the rows per table."""
+    rng = _rng(seed, 6)
+    names = [d[0] for d in DISTRITOS]
+    tables = {'distritos': pd.DataFrame({
+        'id': range(1, len(DISTRITOS) + 1),
+        'nombre': names,
+        'poblacion': [d[1] for d in DISTRITOS],
+        'superficie_km2': [d[2] for d in DISTRITOS],
+        'densidad_poblacion': [round(d[1] / d[2], 2) for d in DISTRITOS],
+        'latitud': DISTRICT_LAT,
+        'longitud': DISTRICT_LON,
+        'codigo_postal_principal': [d[5] for d in DISTRITOS]
+    })}
+
+    n = sizes['edificios']
+    district = rng.integers(0, len(DISTRITOS), n)
+    lat, lon = _near_districts(rng, district)
+    tipos = np.array(['Administrativo', 'Educativo', 'Sanitario', 'Cultural', 'Deportivo', 'Social'])[rng.integers(0, 6, n)]
+    construccion = rng.integers(1900, 2020, n)
+    tables['edificios_publicos'] = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'nombre': [f"Edificio {t} {names[d]} {i}" for t, d, i in zip(tipos, district, range(1, n + 1))],
+        'tipo': tipos,
+        'distrito_id': district + 1,
+        'direccion': [f"Calle {names[d]} {i % 150 + 1}" for d, i in zip(district, range(n))],
+        'latitud': lat,
+        'longitud': lon,
+        'superficie_m2': rng.integers(500, 12000, n),
+        'año_construccion': construccion,
+        'ultimo_renovado': np.minimum(construccion + rng.integers(5, 60, n), 2024),
+        'accesibilidad': np.array(['Alta', 'Media', 'Baja'])[rng.integers(0, 3, n)],
+        'certificacion_energetica': np.array(list('ABCDEFG'))[rng.integers(0, 7, n)]
+    })
+
+    n = sizes['lineas']
+    tipos = np.where(np.arange(n) < 12, 'Metro', np.where(np.arange(n) < n - 5, 'EMT', 'Cercanías'))
+    tables['lineas_transporte'] = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'nombre': [f"Línea {i}" if t == 'Metro' else f"{t} {i}" for t, i in zip(tipos, range(1, n + 1))],
+        'tipo': tipos,
+        'longitud_km': rng.uniform(5, 40, n).round(1),
+        'num_paradas': rng.integers(10, 45, n),
+        'frecuencia_media_min': rng.uniform(3, 15, n).round(1),
+        'año_inauguracion': rng.integers(1919, 2020, n)
+    })
+
+    n = sizes['estaciones_transporte']
+    district = rng.integers(0, len(DISTRITOS), n)
+    lat, lon = _near_districts(rng, district)
+    linea = rng.integers(1, sizes['lineas'] + 1, n)
+    tables['estaciones_transporte'] = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'nombre': [f"Estación {names[d]} {i}" for d, i in zip(district, range(1, n + 1))],
+        'linea_id': linea,
+        'tipo': np.where(linea <= 12, 'Estación', 'Parada'),
+        'distrito_id': district + 1,
+        'latitud': lat,
+        'longitud': lon,
+        'accesibilidad': np.array(['Total', 'Parcial', 'Ninguna'])[rng.integers(0, 3, n)],
+        'correspondencia': rng.random(n) < 0.25,
+        'año_inauguracion': rng.integers(1919, 2020, n)
+    })
+
+    n = sizes['zonas_verdes']
+    district = rng.integers(0, len(DISTRITOS), n)
+    lat, lon = _near_districts(rng, district)
+    tables['zonas_verdes'] = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'nombre': [f"Parque {names[d]} {i}" for d, i in zip(district, range(1, n + 1))],
+        'tipo': np.array(['Parque', 'Jardín', 'Zona ajardinada', 'Área forestal'])[rng.integers(0, 4, n)],
+        'distrito_id': district + 1,
+        'superficie_m2': rng.lognormal(np.log(20000), 1.2, n).round(),
+        'latitud': lat,
+        'longitud': lon,
+        'año_creacion': rng.integers(1850, 2020, n),
+        'num_especies_vegetales': rng.integers(5, 90, n),
+        'tiene_area_infantil': rng.random(n) < 0.6,
+        'tiene_area_deportiva': rng.random(n) < 0.4,
+        'tiene_area_canina': rng.random(n) < 0.3
+    })
+
+    # Consumo mensual de cada edificio público durante un año
+    buildings = sizes['edificios']
+    edificio = np.tile(np.arange(1, buildings + 1), 12)
+    month = np.repeat(np.arange(12), buildings)
+    electrico = rng.uniform(800, 5000, len(edificio)).round()
+    tables['consumo_energetico'] = pd.DataFrame({
+        'id': np.arange(1, len(edificio) + 1),
+        'edificio_id': edificio,
+        'fecha': [f"2024-{m + 1:02d}-01" for m in month],
+        'consumo_electrico_kwh': electrico,
+        'consumo_gas_m3': rng.uniform(50, 600, len(edificio)).round(),
+        'consumo_agua_m3': rng.uniform(30, 300, len(edificio)).round(),
+        'emisiones_co2_kg': (electrico * 0.4375).round(1),
+        'coste_total_euros': (electrico * 0.32).round(2)
+    })
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(MUNICIPAL_DDL)
+        for table, df in tables.items():
+            _write_inserts(f, table, df)
+    return {table: len(df) for table, df in tables.items()}
+
+def generate_dataset(output_dir, scale, seed=42, force=False):
+    """Write every raw dataset for ``scale`` rows to ``output_dir``; returns the manifest.
+
+    If ``output_dir`` already holds the data for the same ``scale`` and ``seed`` it is
+    reused unless ``force`` is set.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('scale') == scale and manifest.get('seed') == seed:
+            print(f"Synthetic data for scale {scale} already in {output_dir}")
+            return manifest
+
+    sizes = dataset_sizes(scale)
+    print(f"Generating synthetic data (scale {scale}, seed {seed}) in {output_dir}...")
+    files = {}
+
+    def record(file_name, rows):
+        files[file_name] = {'rows': rows, 'bytes': os.path.getsize(os.path.join(output_dir, file_name))}
+        print(f"  {file_name}: {rows} rows, {files[file_name]['bytes'] / 1024 / 1024:.1f} MB")
+
+    timestamp = '%Y-%m-%d %H:%M:%S'
+    path = os.path.join(output_dir, 'bicimad-usos.csv')
+    record('bicimad-usos.csv', _write_csv(path, generate_bicimad(sizes, seed), date_format=timestamp))
+    path = os.path.join(output_dir, 'trafico-horario.csv')
+    record('trafico-horario.csv', _write_csv(path, generate_traffic(sizes, seed), date_format=timestamp))
+    path = os.path.join(output_dir, 'parkings-rotacion.csv')
+    record('parkings-rotacion.csv', _write_csv(path, generate_parkings(sizes, seed), date_format='%Y-%m-%d'))
+    path = os.path.join(output_dir, 'ext_aparcamientos_info.csv')
+    record('ext_aparcamientos_info.csv', _write_csv(path, [generate_parking_info(sizes, seed)]))
+    record('avisamadrid.json', generate_avisos(sizes, seed, os.path.join(output_dir, 'avisamadrid.json')))
+    municipal = generate_municipal_sql(sizes, seed, os.path.join(output_dir, 'dump-bbdd-municipal.sql'))
+    record('dump-bbdd-municipal.sql', sum(municipal.values()))
+
+    manifest = {
+        'scale': scale,
+        'seed': seed,
+        'generated_at': datetime.datetime.now().isoformat(),
+        'sizes': sizes,
+        'municipal_tables': municipal,
+        'files': files
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate synthetic raw data for the data lake pipeline.')
+    parser.add_argument('--scale', type=int, default=100_000, help='rows per dataset (10^3 to 10^8)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='/data/synthetic', help='directory for the generated files')
+    parser.add_argument('--force', action='store_true', help='regenerate even if the data already exists')
+    args = parser.parse_args()
+    generate_dataset(args.output, args.scale, args.seed, force=args.force)
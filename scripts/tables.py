@@ -0,0 +1,281 @@
+"""
+Snapshot-isolated tables for the process and access zones.
+
+A table keeps the name of the dataset it replaces (e.g. ``facts/ocupacion_parkings.parquet``)
+and lives under that name without the extension:
+
+    <bucket>/facts/ocupacion_parkings/data/<snapshot_id>-<n>.parquet    immutable data files
+    <bucket>/facts/ocupacion_parkings/_snapshots/<snapshot_id>.json     manifest of each snapshot
+    <bucket>/facts/ocupacion_parkings/_current.json                     pointer to the current one
+    <bucket>/facts/ocupacion_parkings/_lease.json                       commit lease (taken by ETag CAS, never deleted)
+
+A writer uploads new data files, writes the manifest of the new snapshot (every live file
+with its rows, size, column statistics and the sequence number of the snapshot that added
+it) and then replaces the pointer with a single PUT. Readers go pointer -> manifest -> data
+files, and data files are never modified, so a reader sees either the previous snapshot or
+the new one, never a mix.
+
+The pointer also keeps the snapshot history, so time travel (``snapshot_id`` or ``as_of``)
+takes one extra read, and ``changes_since`` returns the files added and removed since a
+snapshot from two manifests, without listing the bucket. Snapshots beyond the last
+``SNAPSHOTS_RETAINED`` are expired together with the data files only they referenced.
+
+Several processes write the same tables (the pipeline, ``parking_stream`` and
+``compaction``), so a commit holds the table lease (``storage.object_lease``) from reading
+the parent snapshot until the pointer is replaced; commits of one process are also
+serialized with a thread lock. The pointer is still re-read before it is replaced, so a
+commit that outlived its lease is detected (``CommitConflict``) instead of silently lost.
+"""
+from utils import get_minio_client
+from storage import object_lease
+from metrics import timed
+import io
+import json
+import uuid
+import datetime
+import threading
+from minio.deleteobjects import DeleteObject
+
+POINTER_OBJECT = '_current.json'
+LEASE_OBJECT = '_lease.json'
+SNAPSHOTS_DIR = '_snapshots'
+DATA_DIR = 'data'
+SNAPSHOTS_RETAINED = 10
+COMMIT_ATTEMPTS = 3
+
+_commit_locks = {}
+_commit_locks_lock = threading.Lock()
+
+class CommitConflict(Exception):
+    """The table pointer changed while a snapshot was being committed."""
+
+def table_root(name):
+    """Prefix of a table: its dataset name without the ``.parquet`` extension."""
+    return name[:-len('.parquet')] if name.endswith('.parquet') else name.rstrip('/')
+
+def new_snapshot_id():
+    """Time-ordered, unique snapshot identifier (allocated before the data is written)."""
+    return f"{datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+def data_file_name(name, snapshot_id, part=0):
+    """Object name of a new immutable data file of snapshot ``snapshot_id``."""
+    return f"{table_root(name)}/{DATA_DIR}/{snapshot_id}-{part}.parquet"
+
+def data_file_entry(object_name, rows, size, column_stats=None):
+    """Manifest entry of a data file."""
+    return {'path': object_name, 'rows': rows, 'bytes': size, 'column_stats': column_stats}
+
+def _manifest_name(name, snapshot_id):
+    return f"{table_root(name)}/{SNAPSHOTS_DIR}/{snapshot_id}.json"
+
+def _pointer_name(name):
+    return f"{table_root(name)}/{POINTER_OBJECT}"
+
+def _lease_name(name):
+    return f"{table_root(name)}/{LEASE_OBJECT}"
+
+def _read_json(client, bucket, object_name):
+    response = client.get_object(bucket, object_name)
+    try:
+        return json.loads(response.read().decode('utf-8'))
+    finally:
+        response.close()
+        response.release_conn()
+
+def _write_json(client, bucket, object_name, document):
+    data = json.dumps(document, default=str).encode('utf-8')
+    client.put_object(bucket, object_name, io.BytesIO(data), length=len(data), content_type='application/json')
+
+def load_pointer(bucket, name, client=None):
+    """Current pointer of a table (with its snapshot history), or None if ``name`` is not a table."""
+    client = client or get_minio_client()
+    try:
+        return _read_json(client, bucket, _pointer_name(name))
+    except Exception:
+        return None
+
+def is_table(bucket, name, client=None):
+    return load_pointer(bucket, name, client) is not None
+
+def _history_entry(pointer, snapshot_id=None, as_of=None):
+    history = pointer['history']
+    if snapshot_id is not None:
+        for entry in history:
+            if entry['snapshot_id'] == snapshot_id:
+                return entry
+        raise ValueError(f"Snapshot {snapshot_id} of table {pointer['table']} does not exist or has expired")
+    if as_of is not None:
+        as_of = as_of.isoformat() if isinstance(as_of, (datetime.date, datetime.datetime)) else str(as_of)
+        # El historial está en orden de commit: el último confirmado antes de as_of
+        candidates = [entry for entry in history if entry['committed_at'] <= as_of]
+        if not candidates:
+            raise ValueError(f"Table {pointer['table']} has no snapshot committed before {as_of}")
+        return candidates[-1]
+    return history[-1]
+
+def load_snapshot(bucket, name, snapshot_id=None, as_of=None, client=None):
+    """Manifest of the current snapshot, of ``snapshot_id`` or of the last one committed at ``as_of``.
+
+    Returns None if ``name`` is not a table.
+    """
+    client = client or get_minio_client()
+    pointer = load_pointer(bucket, name, client)
+    if pointer is None:
+        return None
+    entry = _history_entry(pointer, snapshot_id, as_of)
+    return _read_json(client, bucket, entry['manifest'])
+
+def history(bucket, name):
+    """Snapshots of a table still available for time travel, oldest first."""
+    pointer = load_pointer(bucket, name)
+    return pointer['history'] if pointer else []
+
+def _table_lock(bucket, name):
+    with _commit_locks_lock:
+        return _commit_locks.setdefault((bucket, table_root(name)), threading.Lock())
+
+def commit_snapshot(bucket, name, snapshot_id, files, operation='overwrite', summary=None, replaced=None):
+    """Commit already-written data files as snapshot ``snapshot_id``; returns its manifest.
+
+    ``overwrite`` replaces every live file of the table; ``append`` adds ``files`` to them;
+    ``replace`` swaps the live files listed in ``replaced`` for ``files`` and keeps the rest
+    (compaction), raising ``CommitConflict`` if any of them is no longer live.
+    """
+    if operation not in ('overwrite', 'append', 'replace'):
+        raise ValueError(f"Unsupported table operation: {operation}")
+    replaced = set(replaced or ())
+    client = get_minio_client()
+    with _table_lock(bucket, name), object_lease(client, bucket, _lease_name(name)), timed('table_commit'):
+        for attempt in range(COMMIT_ATTEMPTS):
+            pointer = load_pointer(bucket, name, client)
+            parent = _read_json(client, bucket, pointer['history'][-1]['manifest']) if pointer else None
+            sequence = parent['sequence'] + 1 if parent else 1
+            added = [dict(entry, sequence=sequence, snapshot_id=snapshot_id) for entry in files]
+            if operation == 'replace':
+                live_paths = {entry['path'] for entry in parent['files']} if parent else set()
+                if not replaced <= live_paths:
+                    # Otro commit ya ha reescrito o eliminado alguno de los ficheros
+                    raise CommitConflict(f"Files of {bucket}/{table_root(name)} to replace are no longer live: "
+                                         f"{', '.join(sorted(replaced - live_paths))}")
+                kept = [entry for entry in parent['files'] if entry['path'] not in replaced] if parent else []
+                removed = sorted(replaced)
+            else:
+                kept = parent['files'] if parent and operation == 'append' else []
+                removed = [entry['path'] for entry in parent['files']] if parent and operation == 'overwrite' else []
+            live = kept + added
+            manifest = {
+                'table': table_root(name),
+                'bucket': bucket,
+                'snapshot_id': snapshot_id,
+                'sequence': sequence,
+                'parent_snapshot': parent['snapshot_id'] if parent else None,
+                'operation': operation,
+                'committed_at': datetime.datetime.now().isoformat(),
+                'files': live,
+                'added': [entry['path'] for entry in added],
+                'removed': removed,
+                'summary': dict(summary or {}, rows=sum(entry['rows'] or 0 for entry in live),
+                                files=len(live), bytes=sum(entry['bytes'] or 0 for entry in live))
+            }
+            manifest_name = _manifest_name(name, snapshot_id)
+            _write_json(client, bucket, manifest_name, manifest)
+
+            # Otro proceso ha confirmado mientras tanto: se reconstruye sobre su snapshot
+            current = load_pointer(bucket, name, client)
+            current_id = current['current_snapshot'] if current else None
+            if current_id != (pointer['current_snapshot'] if pointer else None):
+                print(f"Concurrent commit on {bucket}/{table_root(name)}, retrying ({attempt + 1}/{COMMIT_ATTEMPTS})")
+                continue
+
+            entries = (pointer['history'] if pointer else []) + [{
+                'snapshot_id': snapshot_id,
+                'sequence': sequence,
+                'operation': operation,
+                'committed_at': manifest['committed_at'],
+                'manifest': manifest_name,
+                'rows': manifest['summary']['rows']
+            }]
+            retained, expired = entries[-SNAPSHOTS_RETAINED:], entries[:-SNAPSHOTS_RETAINED]
+            # El cambio de puntero es el commit: un único PUT
+            _write_json(client, bucket, _pointer_name(name), {
+                'table': table_root(name),
+                'current_snapshot': snapshot_id,
+                'sequence': sequence,
+                'manifest': manifest_name,
+                'history': retained
+            })
+            print(f"Table {bucket}/{table_root(name)} committed snapshot {snapshot_id} "
+                  f"(#{sequence}, {operation}, {manifest['summary']['rows']} rows)")
+            if expired:
+                try:
+                    expire_snapshots(client, bucket, name, expired, retained)
+                except Exception as e:
+                    print(f"Error expiring old snapshots of {bucket}/{table_root(name)}: {e}")
+            return manifest
+        raise CommitConflict(f"Could not commit snapshot {snapshot_id} of {bucket}/{table_root(name)} "
+                             f"after {COMMIT_ATTEMPTS} attempts")
+
+def expire_snapshots(client, bucket, name, expired, retained):
+    """Delete the manifests of ``expired`` snapshots and the data files no retained snapshot uses."""
+    live = set()
+    for entry in retained:
+        live.update(item['path'] for item in _read_json(client, bucket, entry['manifest'])['files'])
+    garbage = []
+    for entry in expired:
+        try:
+            manifest = _read_json(client, bucket, entry['manifest'])
+            garbage += [item['path'] for item in manifest['files'] if item['path'] not in live]
+        except Exception:
+            pass
+        garbage.append(entry['manifest'])
+    garbage = sorted(set(garbage))
+    for error in client.remove_objects(bucket, [DeleteObject(object_name) for object_name in garbage]):
+        print(f"Error deleting {bucket}/{error.name}: {error.message}")
+    print(f"Expired {len(expired)} snapshots of {bucket}/{table_root(name)} ({len(garbage)} objects removed)")
+
+def referenced_objects(bucket, name, client=None):
+    """Objects a table still needs: pointer, lease, retained manifests and the data files they list."""
+    client = client or get_minio_client()
+    pointer = load_pointer(bucket, name, client)
+    if pointer is None:
+        return set()
+    referenced = {_pointer_name(name), _lease_name(name)}
+    for entry in pointer['history']:
+        referenced.add(entry['manifest'])
+        try:
+            referenced.update(item['path'] for item in _read_json(client, bucket, entry['manifest'])['files'])
+        except Exception as e:
+            print(f"Error reading manifest {bucket}/{entry['manifest']}: {e}")
+    return referenced
+
+def changes_since(bucket, name, snapshot_id):
+    """Files added and removed between ``snapshot_id`` and the current snapshot.
+
+    Reads only the two manifests: live files carry the sequence number of the snapshot that
+    added them. Raises ``ValueError`` if ``snapshot_id`` has expired (read the whole table).
+    """
+    client = get_minio_client()
+    pointer = load_pointer(bucket, name, client)
+    if pointer is None:
+        raise ValueError(f"{bucket}/{name} is not a table")
+    base = _read_json(client, bucket, _history_entry(pointer, snapshot_id)['manifest'])
+    current = _read_json(client, bucket, pointer['manifest'])
+    current_paths = {entry['path'] for entry in current['files']}
+    return {
+        'from_snapshot': base['snapshot_id'],
+        'to_snapshot': current['snapshot_id'],
+        'added': [entry for entry in current['files'] if entry['sequence'] > base['sequence']],
+        'removed': [entry['path'] for entry in base['files'] if entry['path'] not in current_paths]
+    }
+
+def table_metadata(manifest):
+    """Catalog metadata describing the snapshot a dataset currently points to."""
+    metadata = {
+        'snapshot_id': manifest['snapshot_id'],
+        'sequence': manifest['sequence'],
+        'rows': manifest['summary']['rows'],
+        'data_files': [entry['path'] for entry in manifest['files']]
+    }
+    if len(manifest['files']) == 1 and manifest['files'][0].get('column_stats'):
+        metadata['column_stats'] = manifest['files'][0]['column_stats']
+    return metadata
@@ -1,21 +1,64 @@
 # File: scripts/utils.py
-from minio import Minio
+from storage import get_storage_client
+from metrics import bind_stage, timed, response_retries, response_size
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import io
 import trino
 import os
 import json
 import datetime
 import hashlib
+import queue
+import threading
+import uuid
+import itertools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Tamaño por defecto de los bloques leídos del cursor de servidor y de cada parte del multipart upload
+EXPORT_CHUNK_SIZE = 50000
+EXPORT_PART_SIZE = 10 * 1024 * 1024
+
+# Peticiones simultáneas al descargar objetos pequeños de gobierno (el pool del cliente MinIO es de 10)
+GOVERN_FETCH_WORKERS = int(os.environ.get('GOVERN_FETCH_WORKERS', '8'))
+
+# Prefijo de los packs de documentos que escribe compaction.py
+COMPACTED_PREFIX = '_compacted'
+
+# Hilos que suben al lake en segundo plano dentro de deferred_lake_writes
+LAKE_WRITE_WORKERS = int(os.environ.get('LAKE_WRITE_WORKERS', '4'))
+
+# Escrituras diferidas: executor activo y futuros pendientes (None = escrituras síncronas)
+_lake_writer = None
+_pending_lake_writes = []
+_lake_writes_lock = threading.Lock()
+
+# Actualizaciones de los índices de gobierno acumuladas dentro de batched_index_updates
+# (None = cada documento se indexa al escribirlo)
+_index_batch = None
+_index_batch_lock = threading.Lock()
+
+# Tipos de PostgreSQL (OID) a tipos de Arrow para fijar el esquema antes de leer los datos
+POSTGRES_ARROW_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    25: pa.string(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1042: pa.string(),
+    1043: pa.string(),
+    1082: pa.date32(),
+    1114: pa.timestamp('us'),
+    1184: pa.timestamp('us', tz='UTC'),
+}
 
 def get_minio_client():
-    """Create and return a MinIO client."""
-    return Minio(
-        "minio:9000",
-        access_key="minioadmin",
-        secret_key="minioadmin",
-        secure=False
-    )
+    """Create and return a client of the configured storage backend (MinIO unless ``STORAGE_BACKEND`` says otherwise)."""
+    return get_storage_client()
 
 def get_trino_connection():
     """Create and return a Trino connection."""
@@ -39,7 +82,9 @@ def upload_file_to_minio(file_path, bucket_name, object_name=None):
         client.make_bucket(bucket_name)
 
     # Upload the file
-    client.fput_object(bucket_name, object_name, file_path)
+    with timed('minio_upload') as op:
+        client.fput_object(bucket_name, object_name, file_path)
+        op.add(bytes=os.path.getsize(file_path))
     print(f"File {file_path} uploaded to {bucket_name}/{object_name}")
 
     # Store metadata in govern-zone-metadata
@@ -51,11 +96,101 @@ def download_file_from_minio(bucket_name, object_name, file_path=None):
         file_path = object_name
 
     client = get_minio_client()
-    client.fget_object(bucket_name, object_name, file_path)
+    with timed('minio_download') as op:
+        client.fget_object(bucket_name, object_name, file_path)
+        op.add(bytes=os.path.getsize(file_path))
     print(f"File {bucket_name}/{object_name} downloaded to {file_path}")
 
-def upload_dataframe_to_minio(df, bucket_name, object_name, format='csv', metadata=None):
-    """Upload a pandas DataFrame to MinIO with metadata."""
+def _column_statistics_accumulator():
+    """New ``column_stats.ColumnStatistics``, or None if statistics cannot be computed."""
+    try:
+        from column_stats import ColumnStatistics
+        return ColumnStatistics()
+    except Exception as e:
+        print(f"Column statistics disabled: {e}")
+        return None
+
+def _column_statistics(data):
+    """Column statistics of a DataFrame or Arrow table (None on failure, the upload goes on)."""
+    stats = _column_statistics_accumulator()
+    if stats is None:
+        return None
+    try:
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data, preserve_index=False)
+        return stats.update(data).to_dict()
+    except Exception as e:
+        print(f"Error computing column statistics: {e}")
+        return None
+
+@contextlib.contextmanager
+def deferred_lake_writes(max_workers=LAKE_WRITE_WORKERS):
+    """Run ``upload_dataframe_to_minio`` calls in background threads while the block executes.
+
+    On exit every pending write is awaited and the first error is raised, so the data is
+    durable once the block completes. Use ``flush_lake_writes`` for an earlier barrier.
+    The block also batches the index updates (``batched_index_updates``).
+    """
+    global _lake_writer
+    if _lake_writer is not None:
+        # Bloques anidados: se reutiliza el executor exterior
+        yield
+        return
+    _lake_writer = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lake-writer')
+    try:
+        with batched_index_updates():
+            yield
+            flush_lake_writes()
+    finally:
+        _lake_writer.shutdown(wait=True)
+        _lake_writer = None
+        _pending_lake_writes.clear()
+
+def flush_lake_writes():
+    """Wait for the pending deferred writes; raises the first error. Returns how many were awaited.
+
+    The index updates collected so far (``batched_index_updates``) are applied as well.
+    """
+    with _lake_writes_lock:
+        pending = list(_pending_lake_writes)
+        _pending_lake_writes.clear()
+    errors = []
+    for future in pending:
+        try:
+            future.result()
+        except Exception as e:
+            errors.append(e)
+    # Los documentos de las escrituras que sí terminaron se indexan aunque otras fallen
+    flush_index_updates()
+    if errors:
+        print(f"{len(errors)} of {len(pending)} deferred lake writes failed")
+        raise errors[0]
+    return len(pending)
+
+def upload_dataframe_to_minio(df, bucket_name, object_name, format='csv', metadata=None, snapshot_id=None,
+                              append=False):
+    """Upload a pandas DataFrame to MinIO with metadata.
+
+    Inside ``deferred_lake_writes`` the upload runs in the background on a snapshot of the
+    DataFrame (the caller may keep modifying it) and a future is returned.
+
+    With ``snapshot_id`` (``tables.new_snapshot_id``) ``object_name`` is a table: the data is
+    written to a new immutable Parquet file and committed as that snapshot, replacing the
+    previous one atomically. ``append=True`` adds the file to the current snapshot instead.
+    """
+    if snapshot_id is not None and format.lower() != 'parquet':
+        raise ValueError(f"Tables are stored as Parquet, not {format}")
+    if append and snapshot_id is None:
+        raise ValueError("Only tables (snapshot_id) can be appended to")
+    if _lake_writer is not None:
+        future = _lake_writer.submit(bind_stage(_upload_dataframe), df.copy(), bucket_name, object_name, format,
+                                     dict(metadata) if metadata is not None else None, snapshot_id, append)
+        with _lake_writes_lock:
+            _pending_lake_writes.append(future)
+        return future
+    return _upload_dataframe(df, bucket_name, object_name, format, metadata, snapshot_id, append)
+
+def _upload_dataframe(df, bucket_name, object_name, format='csv', metadata=None, snapshot_id=None, append=False):
     client = get_minio_client()
 
     # Make sure the bucket exists
@@ -63,27 +198,44 @@ def upload_dataframe_to_minio(df, bucket_name, object_name, format='csv', metada
         client.make_bucket(bucket_name)
 
     # Convert DataFrame to bytes in the specified format
+    column_stats = None
     if format.lower() == 'csv':
-        buffer = io.BytesIO()
-        df.to_csv(buffer, index=False)
-        buffer.seek(0)
+        with timed('csv_encode') as op:
+            buffer = io.BytesIO()
+            df.to_csv(buffer, index=False)
+            buffer.seek(0)
+            op.add(bytes=buffer.getbuffer().nbytes, rows=len(df))
         content_type = 'text/csv'
+        # El CSV no pasa por Arrow: las estadísticas hacen su propia conversión del DataFrame
+        column_stats = _column_statistics(df)
     elif format.lower() == 'parquet':
-        buffer = io.BytesIO()
-        df.to_parquet(buffer, index=False)
-        buffer.seek(0)
+        with timed('parquet_encode') as op:
+            # Una sola conversión a Arrow sirve para las estadísticas y para escribir el Parquet
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            buffer = io.BytesIO()
+            pq.write_table(table, buffer)
+            buffer.seek(0)
+            op.add(bytes=buffer.getbuffer().nbytes, rows=len(df))
+        column_stats = _column_statistics(table)
         content_type = 'application/octet-stream'
     else:
         raise ValueError(f"Unsupported format: {format}")
 
-    # Upload the data
-    client.put_object(
-        bucket_name, object_name, buffer,
-        length=buffer.getbuffer().nbytes,
-        content_type=content_type
-    )
+    # Upload the data (a table gets a new data file instead of overwriting the object)
+    if snapshot_id is not None:
+        from tables import data_file_name
+        target_object = data_file_name(object_name, snapshot_id)
+    else:
+        target_object = object_name
+    with timed('minio_upload') as op:
+        client.put_object(
+            bucket_name, target_object, buffer,
+            length=buffer.getbuffer().nbytes,
+            content_type=content_type
+        )
+        op.add(bytes=buffer.getbuffer().nbytes)
 
-    print(f"DataFrame uploaded to {bucket_name}/{object_name}")
+    print(f"DataFrame uploaded to {bucket_name}/{target_object}")
 
     # Store metadata
     if metadata is None:
@@ -97,25 +249,321 @@ def upload_dataframe_to_minio(df, bucket_name, object_name, format='csv', metada
         'columns': list(df.columns),
         'column_types': {col: str(df[col].dtype) for col in df.columns}
     })
+    if column_stats is not None:
+        metadata['column_stats'] = column_stats
+    if snapshot_id is not None:
+        from tables import commit_snapshot, data_file_entry, table_metadata
+        manifest = commit_snapshot(bucket_name, object_name, snapshot_id, [
+            data_file_entry(target_object, len(df), buffer.getbuffer().nbytes, column_stats)
+        ], operation='append' if append else 'overwrite')
+        metadata.update(table_metadata(manifest))
 
     # Store metadata in govern-zone-metadata
     store_object_metadata(bucket_name, object_name, metadata)
 
-def download_dataframe_from_minio(bucket_name, object_name, format='csv'):
-    """Download a file from MinIO into a pandas DataFrame."""
-    client = get_minio_client()
+def download_dataframe_from_minio(bucket_name, object_name, format='csv', snapshot_id=None, as_of=None):
+    """Download a file from MinIO into a pandas DataFrame.
 
-    # Get the object
-    response = client.get_object(bucket_name, object_name)
-
-    # Convert to DataFrame based on format
+    Parquet datasets stored as tables (``tables``) are read from their current snapshot, or
+    from ``snapshot_id`` / the snapshot current at ``as_of`` (time travel).
+    """
+    client = get_minio_client()
+    if format.lower() == 'parquet':
+        from tables import load_snapshot
+        manifest = load_snapshot(bucket_name, object_name, snapshot_id, as_of, client)
+        if manifest is not None:
+            frames = [_download_parquet(client, bucket_name, entry['path']) for entry in manifest['files']]
+            if len(frames) == 1:
+                return frames[0]
+            return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if snapshot_id is not None or as_of is not None:
+            raise ValueError(f"{bucket_name}/{object_name} is not a table: no snapshots to read")
+
+    # Get the object and convert to DataFrame based on format
     if format.lower() == 'csv':
-        return pd.read_csv(response)
+        # El CSV se decodifica mientras se descarga: una sola operación
+        with timed('csv_download_decode') as op:
+            response = client.get_object(bucket_name, object_name)
+            df = pd.read_csv(response)
+            op.add(bytes=response_size(response), rows=len(df), retries=response_retries(response))
+        return df
     elif format.lower() == 'parquet':
-        return pd.read_parquet(io.BytesIO(response.read()))
+        return _download_parquet(client, bucket_name, object_name)
     else:
         raise ValueError(f"Unsupported format: {format}")
 
+def _download_parquet(client, bucket_name, object_name):
+    with timed('minio_download') as op:
+        response = client.get_object(bucket_name, object_name)
+        data = response.read()
+        op.add(bytes=len(data), retries=response_retries(response))
+    with timed('parquet_decode') as op:
+        df = pd.read_parquet(io.BytesIO(data))
+        op.add(bytes=len(data), rows=len(df))
+    return df
+
+class _StreamingUploadBuffer:
+    """File-like bridge between a Parquet writer and a MinIO multipart upload running in another thread."""
+
+    def __init__(self, max_pending_writes=16):
+        self._queue = queue.Queue(maxsize=max_pending_writes)
+        self._pending = bytearray()
+        self._position = 0
+        self._eof = False
+        self._error = None
+        self.closed = False
+
+    # Lado del escritor (ParquetWriter)
+    def write(self, data):
+        data = bytes(data)
+        while True:
+            if self._error is not None:
+                raise IOError(f"Upload aborted: {self._error}")
+            try:
+                self._queue.put(data, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._queue.put(None)
+
+    # Lado del lector (put_object)
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._pending) < size):
+            chunk = self._queue.get()
+            if self._error is not None:
+                # El escritor ha fallado: no dejamos que se suba un Parquet truncado
+                raise IOError(f"Export aborted: {self._error}")
+            if chunk is None:
+                self._eof = True
+            else:
+                self._pending += chunk
+        if size < 0:
+            size = len(self._pending)
+        data = bytes(self._pending[:size])
+        del self._pending[:size]
+        return data
+
+    def abort(self, error):
+        self._error = error
+        # Vaciamos la cola para desbloquear al escritor
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+def _arrow_schema_from_cursor(description, first_rows):
+    """Build an Arrow schema from a DB-API cursor description, inferring unknown types from the first rows."""
+    fields = []
+    for index, column in enumerate(description):
+        arrow_type = POSTGRES_ARROW_TYPES.get(column[1])
+        if arrow_type is None:
+            values = [row[index] for row in first_rows if row[index] is not None]
+            arrow_type = pa.array(values).type if values else pa.string()
+        fields.append(pa.field(column[0], arrow_type))
+    return pa.schema(fields)
+
+def export_query_to_minio(connection, query, bucket_name, object_name, chunk_size=EXPORT_CHUNK_SIZE,
+                          part_size=EXPORT_PART_SIZE, metadata=None, snapshot_id=None):
+    """Stream the result of a PostgreSQL query to a Parquet object in MinIO.
+
+    Rows are read through a named (server-side) cursor in blocks of ``chunk_size``; each block
+    becomes a row group that is written straight into a multipart upload, so memory stays bounded
+    by the block size and the data is serialized only once. With ``snapshot_id`` the result is
+    committed as a new snapshot of table ``object_name`` (see ``upload_dataframe_to_minio``).
+    """
+    client = get_minio_client()
+    if snapshot_id is not None:
+        from tables import data_file_name
+        target_object = data_file_name(object_name, snapshot_id)
+    else:
+        target_object = object_name
+
+    # Make sure the bucket exists
+    if not client.bucket_exists(bucket_name):
+        client.make_bucket(bucket_name)
+
+    with timed('warehouse_export') as op:
+        stream = _StreamingUploadBuffer()
+        upload_errors = []
+
+        def upload():
+            try:
+                client.put_object(
+                    bucket_name, target_object, stream,
+                    length=-1,
+                    part_size=part_size,
+                    content_type='application/octet-stream'
+                )
+            except Exception as e:
+                upload_errors.append(e)
+                stream.abort(e)
+
+        uploader = threading.Thread(target=upload, daemon=True)
+        uploader.start()
+
+        cursor = connection.cursor(name=f"export_{uuid.uuid4().hex}")
+        cursor.itersize = chunk_size
+        writer = None
+        rows = 0
+        stats = _column_statistics_accumulator()
+        try:
+            cursor.execute(query)
+            while True:
+                records = cursor.fetchmany(chunk_size)
+                if writer is None:
+                    schema = _arrow_schema_from_cursor(cursor.description, records)
+                    writer = pq.ParquetWriter(stream, schema)
+                if not records:
+                    break
+                columns = list(zip(*records))
+                batch = pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema
+                )
+                writer.write_table(batch, row_group_size=chunk_size)
+                if stats is not None:
+                    try:
+                        stats.update(batch)
+                    except Exception as e:
+                        print(f"Error computing column statistics: {e}")
+                        stats = None
+                rows += len(records)
+            writer.close()
+        except Exception as e:
+            stream.abort(e)
+            if writer is not None:
+                try:
+                    writer.close()
+                except IOError:
+                    pass
+            raise
+        finally:
+            cursor.close()
+            stream.close()
+            uploader.join()
+
+        if upload_errors:
+            raise upload_errors[0]
+        op.add(bytes=stream.tell(), rows=rows)
+        size = stream.tell()
+
+    print(f"Query result streamed to {bucket_name}/{target_object} ({rows} rows)")
+
+    # Store metadata
+    if metadata is None:
+        metadata = {}
+
+    metadata.update({
+        'uploaded_at': datetime.datetime.now().isoformat(),
+        'format': 'parquet',
+        'rows': rows,
+        'columns': schema.names,
+        'column_types': {field.name: str(field.type) for field in schema}
+    })
+    if stats is not None:
+        metadata['column_stats'] = stats.to_dict()
+    if snapshot_id is not None:
+        from tables import commit_snapshot, data_file_entry, table_metadata
+        manifest = commit_snapshot(bucket_name, object_name, snapshot_id, [
+            data_file_entry(target_object, rows, size, metadata.get('column_stats'))
+        ])
+        metadata.update(table_metadata(manifest))
+
+    store_object_metadata(bucket_name, object_name, metadata)
+    return rows
+
+def _read_object(client, bucket_name, object_name, parser):
+    with timed('minio_download') as op:
+        response = client.get_object(bucket_name, object_name)
+        try:
+            data = response.read()
+            op.add(bytes=len(data), retries=response_retries(response))
+        finally:
+            # Devolvemos la conexión al pool aunque falle la lectura
+            response.close()
+            response.release_conn()
+    return parser(data) if parser else data
+
+def fetch_objects(bucket_name, object_names, parser=None, max_workers=GOVERN_FETCH_WORKERS):
+    """Download many small objects concurrently, yielding ``(object_name, result, error)`` as they arrive.
+
+    At most ``max_workers`` requests are in flight at once (keep it within the MinIO client's
+    connection pool size). ``parser`` turns the raw bytes into the result, e.g. ``parse_json``.
+    """
+    client = get_minio_client()
+    names = iter(object_names)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        while True:
+            # Ventana acotada de peticiones en curso
+            for object_name in itertools.islice(names, max_workers - len(pending)):
+                pending[executor.submit(_read_object, client, bucket_name, object_name, parser)] = object_name
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                object_name = pending.pop(future)
+                try:
+                    yield object_name, future.result(), None
+                except Exception as e:
+                    yield object_name, None, e
+
+def parse_json(data):
+    return json.loads(data.decode('utf-8'))
+
+def packs_prefix(prefix):
+    """Prefix of the compacted JSON-lines packs of the documents under ``prefix``."""
+    return f"{COMPACTED_PREFIX}/{prefix}"
+
+def read_pack(client, bucket_name, object_name):
+    """Entries (``{'object', 'etag', 'document'}``) of one compacted pack."""
+    response = client.get_object(bucket_name, object_name)
+    try:
+        return [json.loads(line) for line in response.read().decode('utf-8').splitlines() if line.strip()]
+    finally:
+        response.close()
+        response.release_conn()
+
+def fetch_prefix_documents(bucket, prefix, parser=parse_json):
+    """JSON documents under ``prefix``, yielding ``(object_name, document, error)`` like ``fetch_objects``.
+
+    Documents come from the compacted packs; only the loose objects written (or rewritten)
+    after their last compaction are downloaded one by one.
+    """
+    client = get_minio_client()
+    loose = {obj.object_name: obj.etag for obj in client.list_objects(bucket, prefix=prefix, recursive=True)
+             if obj.object_name.endswith('.json')}
+    packed = {}
+    for obj in sorted(client.list_objects(bucket, prefix=packs_prefix(prefix), recursive=True),
+                      key=lambda obj: obj.object_name):
+        # Packs en orden de creación: el más reciente gana
+        for entry in read_pack(client, bucket, obj.object_name):
+            packed[entry['object']] = entry
+    changed = [name for name in loose if name not in packed or packed[name]['etag'] != loose[name]]
+    for name, entry in packed.items():
+        if name not in changed:
+            yield name, entry['document'], None
+    yield from fetch_objects(bucket, changed, parser)
+
 def execute_trino_query(query):
     """Execute a query in Trino and return the results as a DataFrame."""
     conn = get_trino_connection()
@@ -132,6 +580,65 @@ def execute_trino_query(query):
     else:
         return pd.DataFrame()
 
+@contextlib.contextmanager
+def batched_index_updates():
+    """Collect the catalog upserts, lineage records and cache invalidations of the block.
+
+    Each index is then written once: one catalog write, one lineage graph write (and cycle
+    check) and one query cache invalidation per flush.
+
+    They are applied on exit (also when the block fails, since the documents are already in
+    the lake) and by every ``flush_lake_writes``. Nested blocks share the outer batch.
+    """
+    global _index_batch
+    if _index_batch is not None:
+        yield
+        return
+    _index_batch = {'catalog': {}, 'lineage': [], 'invalidated': set()}
+    try:
+        yield
+    finally:
+        try:
+            flush_index_updates()
+        finally:
+            _index_batch = None
+
+def flush_index_updates():
+    """Apply the index updates collected by ``batched_index_updates``; returns how many there were."""
+    with _index_batch_lock:
+        if not _index_batch:
+            return 0
+        documents = dict(_index_batch['catalog'])
+        records = list(_index_batch['lineage'])
+        targets = set(_index_batch['invalidated'])
+        _index_batch['catalog'].clear()
+        _index_batch['lineage'].clear()
+        _index_batch['invalidated'].clear()
+    if documents:
+        try:
+            from catalog import upsert_catalog_entries
+            upsert_catalog_entries(documents)
+        except Exception as e:
+            print(f"Error updating metadata catalog with {len(documents)} documents: {e}")
+    if records:
+        _index_lineage(records)
+    if targets:
+        _invalidate_cached_results(targets)
+    return len(documents) + len(records)
+
+def _index_metadata(metadata_object_name, metadata):
+    """Upsert a metadata document into the compacted catalog index (batched when enabled)."""
+    with _index_batch_lock:
+        if _index_batch is not None:
+            # La última versión del documento sustituye a la anterior dentro del lote
+            _index_batch['catalog'][metadata_object_name] = dict(metadata)
+            return
+    try:
+        from catalog import update_catalog
+        update_catalog(metadata_object_name, metadata)
+    except Exception as e:
+        print(f"Error updating metadata catalog for {metadata_object_name}: {e}")
+
 def store_file_metadata(bucket_name, object_name, file_path):
     """Store file metadata in the govern-zone-metadata bucket."""
     client = get_minio_client()
@@ -158,15 +665,18 @@ def store_file_metadata(bucket_name, object_name, file_path):
     if not client.bucket_exists('govern-zone-metadata'):
         client.make_bucket('govern-zone-metadata')
 
-    client.put_object(
-        'govern-zone-metadata',
-        metadata_object_name,
-        metadata_buffer,
-        length=len(metadata_json),
-        content_type='application/json'
-    )
+    with timed('metadata_write') as op:
+        client.put_object(
+            'govern-zone-metadata',
+            metadata_object_name,
+            metadata_buffer,
+            length=len(metadata_json),
+            content_type='application/json'
+        )
+        op.add(bytes=len(metadata_json))
 
     print(f"Metadata stored in govern-zone-metadata/{metadata_object_name}")
+    _index_metadata(metadata_object_name, metadata)
 
 def store_object_metadata(bucket_name, object_name, metadata):
     """Store object metadata in the govern-zone-metadata bucket."""
@@ -187,15 +697,18 @@ def store_object_metadata(bucket_name, object_name, metadata):
     if not client.bucket_exists('govern-zone-metadata'):
         client.make_bucket('govern-zone-metadata')
 
-    client.put_object(
-        'govern-zone-metadata',
-        metadata_object_name,
-        metadata_buffer,
-        length=len(metadata_json),
-        content_type='application/json'
-    )
+    with timed('metadata_write') as op:
+        client.put_object(
+            'govern-zone-metadata',
+            metadata_object_name,
+            metadata_buffer,
+            length=len(metadata_json),
+            content_type='application/json'
+        )
+        op.add(bytes=len(metadata_json))
 
     print(f"Metadata stored in govern-zone-metadata/{metadata_object_name}")
+    _index_metadata(metadata_object_name, metadata)
 
 def calculate_file_hash(file_path):
     """Calculate SHA-256 hash of a file for data lineage tracking."""
@@ -208,8 +721,14 @@ def calculate_file_hash(file_path):
 
     return sha256_hash.hexdigest()
 
-def log_data_transformation(source_bucket, source_object, target_bucket, target_object, transformation_description):
-    """Log data transformation details for data lineage and governance."""
+def log_data_transformation(source_bucket, source_object, target_bucket, target_object, transformation_description,
+                            additional_sources=None, target_snapshot=None):
+    """Log data transformation details for data lineage and governance.
+
+    ``additional_sources`` lists further ``(bucket, object)`` inputs of a transformation with
+    several sources; the first source stays in ``source`` for backwards compatibility.
+    ``target_snapshot`` is the snapshot of the target table the transformation produced.
+    """
     client = get_minio_client()
 
     # Prepare lineage metadata
@@ -219,12 +738,18 @@ def log_data_transformation(source_bucket, source_object, target_bucket, target_
             'bucket': source_bucket,
             'object': source_object
         },
+        'sources': [
+            {'bucket': bucket, 'object': object_name}
+            for bucket, object_name in [(source_bucket, source_object)] + list(additional_sources or [])
+        ],
         'target': {
             'bucket': target_bucket,
             'object': target_object
         },
         'transformation': transformation_description
     }
+    if target_snapshot is not None:
+        lineage['target']['snapshot_id'] = target_snapshot
 
     # Store lineage information
     lineage_json = json.dumps(lineage)
@@ -235,16 +760,42 @@ def log_data_transformation(source_bucket, source_object, target_bucket, target_
     if not client.bucket_exists('govern-zone-metadata'):
         client.make_bucket('govern-zone-metadata')
 
-    client.put_object(
-        'govern-zone-metadata',
-        lineage_object_name,
-        lineage_buffer,
-        length=len(lineage_json),
-        content_type='application/json'
-    )
+    with timed('lineage_write') as op:
+        client.put_object(
+            'govern-zone-metadata',
+            lineage_object_name,
+            lineage_buffer,
+            length=len(lineage_json),
+            content_type='application/json'
+        )
+        op.add(bytes=len(lineage_json))
 
     print(f"Transformation lineage stored in govern-zone-metadata/{lineage_object_name}")
 
+    with _index_batch_lock:
+        if _index_batch is not None:
+            _index_batch['lineage'].append((lineage, lineage_object_name))
+            _index_batch['invalidated'].add((target_bucket, target_object))
+            return
+    _index_lineage([(lineage, lineage_object_name)])
+    _invalidate_cached_results({(target_bucket, target_object)})
+
+def _index_lineage(records):
+    # Índice del grafo de linaje con listas de adyacencia en ambos sentidos
+    try:
+        from lineage_graph import add_lineage_records
+        add_lineage_records(records)
+    except Exception as e:
+        print(f"Error updating lineage graph with {len(records)} records: {e}")
+
+def _invalidate_cached_results(targets):
+    # Los destinos han cambiado: los resultados cacheados que los leen dejan de ser válidos
+    try:
+        from query_cache import invalidate_targets
+        invalidate_targets(targets)
+    except Exception as e:
+        print(f"Error invalidating cached query results for {len(targets)} targets: {e}")
+
 def convert_to_serializable(obj):
     """Convert object to JSON serializable type."""
     import numpy as np
@@ -252,7 +803,7 @@ def convert_to_serializable(obj):
         return bool(obj)
     elif isinstance(obj, (np.int_, np.intc, np.intp, np.int8, np.int16, np.int32, np.int64)):
         return int(obj)
-    elif isinstance(obj, (np.float_, np.float16, np.float32, np.float64)):
+    elif isinstance(obj, (np.floating,)):
         return float(obj)
     elif isinstance(obj, (np.ndarray,)):
         return obj.tolist()
@@ -319,13 +870,22 @@ def validate_data_quality(df, dataset_name, rules=None):
     if not client.bucket_exists('govern-zone-metadata'):
         client.make_bucket('govern-zone-metadata')
 
-    client.put_object(
-        'govern-zone-metadata',
-        quality_object_name,
-        quality_buffer,
-        length=len(quality_json),
-        content_type='application/json'
-    )
+    with timed('quality_write') as op:
+        client.put_object(
+            'govern-zone-metadata',
+            quality_object_name,
+            quality_buffer,
+            length=len(quality_json),
+            content_type='application/json'
+        )
+        op.add(bytes=len(quality_json))
 
     print(f"Data quality results stored in govern-zone-metadata/{quality_object_name}")
+
+    # Histórico columnar particionado por fecha y dataset para los informes de tendencias
+    try:
+        from quality_history import append_quality_results
+        append_quality_results(serializable_results)
+    except Exception as e:
+        print(f"Error appending quality results of {dataset_name} to the history: {e}")
     return quality_results
\ No newline at end of file